@@ -0,0 +1,9 @@
+"""Throughput benchmarks for the Cython solver.
+
+Run all benchmarks with:
+
+    $ python -m benchmarks
+
+The results are printed to the standard output as a JSON document
+(see `benchmarks.runner` for details).
+"""
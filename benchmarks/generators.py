@@ -0,0 +1,153 @@
+"""Generators of synthetic trading turns.
+
+All generators are deterministic: the same parameters and the same
+`seed` always produce the same data.
+"""
+
+import math
+import random
+from bisect import bisect
+from datetime import date
+from itertools import accumulate
+from typing import NamedTuple, Iterator
+
+BASE_DEBTOR_ID = 1
+CREATION_DATE = date(2024, 1, 1)
+
+
+class CurrencyRow(NamedTuple):
+    is_confirmed: bool
+    debtor_info_locator: str
+    debtor_id: int
+    peg_debtor_info_locator: str
+    peg_debtor_id: int
+    peg_exchange_rate: float
+
+
+class BidRow(NamedTuple):
+    creditor_id: int
+    debtor_id: int
+    amount: int
+    peg_debtor_id: int
+    peg_exchange_rate: float
+    creation_date: date
+    last_transfer_number: int
+
+
+def get_locator(debtor_id: int) -> str:
+    return f"https://example.com/debtors/{debtor_id}"
+
+
+def generate_currency_tree(
+        currencies_count: int,
+        max_depth: int = 10,
+        confirmed_ratio: float = 0.9,
+        seed: int = 0,
+) -> list[CurrencyRow]:
+    """Generate a peg-tree of currencies.
+
+    The base currency (`BASE_DEBTOR_ID`) is the root of the tree.
+    Every other currency is pegged to a randomly chosen currency
+    which is less than `max_depth` pegs away from the base currency.
+    """
+    assert currencies_count > 0
+    assert max_depth > 0
+    rnd = random.Random(seed)
+    base_locator = get_locator(BASE_DEBTOR_ID)
+    rows = [
+        CurrencyRow(True, base_locator, BASE_DEBTOR_ID, "", 0, math.nan)
+    ]
+    depths = [0]
+    pegs = [0]  # indexes of the currencies that can be used as pegs
+
+    for i in range(1, currencies_count):
+        peg_index = pegs[rnd.randrange(len(pegs))]
+        peg = rows[peg_index]
+        debtor_id = BASE_DEBTOR_ID + i
+        rows.append(
+            CurrencyRow(
+                rnd.random() < confirmed_ratio,
+                get_locator(debtor_id),
+                debtor_id,
+                peg.debtor_info_locator,
+                peg.debtor_id,
+                rnd.choice([0.5, 1.0, 2.0, 10.0]),
+            )
+        )
+        depth = depths[peg_index] + 1
+        depths.append(depth)
+        if depth < max_depth:
+            pegs.append(i)
+
+    return rows
+
+
+def calc_prices(currencies: list[CurrencyRow]) -> dict[int, float]:
+    """Return the prices of all currencies, expressed in base
+    currency's tokens.
+    """
+    prices = {BASE_DEBTOR_ID: 1.0}
+    for row in currencies[1:]:
+        prices[row.debtor_id] = (
+            prices[row.peg_debtor_id] * row.peg_exchange_rate
+        )
+    return prices
+
+
+def generate_bids(
+        currencies: list[CurrencyRow],
+        traders_count: int,
+        bids_per_trader: int = 4,
+        popularity_skew: float = 1.0,
+        demand_skew: float = 0.0,
+        seed: int = 0,
+) -> Iterator[BidRow]:
+    """Generate traders' bids, ordered by creditor ID.
+
+    Traders choose currencies with probabilities proportional to
+    `1 / rank ** popularity_skew`, so that a small number of
+    currencies get most of the bids. When `demand_skew` is positive,
+    popular currencies tend to be bought, and unpopular currencies
+    tend to be sold. When `demand_skew` is zero, every bid is a buy
+    bid or a sell bid with equal probability.
+    """
+    assert bids_per_trader > 0
+    rnd = random.Random(seed)
+    prices = calc_prices(currencies)
+    n = len(currencies)
+    cum_weights = list(
+        accumulate(1.0 / (rank ** popularity_skew) for rank in range(1, n + 1))
+    )
+    total_weight = cum_weights[-1]
+
+    for creditor_id in range(1, traders_count + 1):
+        amounts = {}
+        for _ in range(bids_per_trader):
+            index = bisect(cum_weights, rnd.random() * total_weight)
+            index = min(index, n - 1)
+            buy_probability = 0.5 + demand_skew * (0.5 - index / n)
+            value = rnd.randrange(1000, 1000000)
+            amount = max(1, int(value / prices[currencies[index].debtor_id]))
+            amounts[index] = (
+                amount if rnd.random() < buy_probability else -amount
+            )
+
+        # Bids are priceable only when the trader has bids for all the
+        # currencies in the peg-chain, so zero-amount bids are added
+        # for the missing peg currencies.
+        for index in list(amounts):
+            while index != 0:
+                index = currencies[index].peg_debtor_id - BASE_DEBTOR_ID
+                amounts.setdefault(index, 0)
+
+        for index in sorted(amounts):
+            currency = currencies[index]
+            yield BidRow(
+                creditor_id,
+                currency.debtor_id,
+                amounts[index],
+                currency.peg_debtor_id,
+                currency.peg_exchange_rate,
+                CREATION_DATE,
+                0,
+            )
@@ -0,0 +1,391 @@
+"""Run the solver benchmarks, and report the results as JSON.
+
+Every benchmark runs in a separate (forked) process, so that the
+reported peak RSS (resident set size) reflects only the memory used
+by the given benchmark. The generation of the synthetic data is not
+included in the measured time, but is included in the peak RSS.
+
+The produced JSON document looks like this:
+
+    {
+      "python": "3.11.4",
+      "scale": "small",
+      "seed": 0,
+      "results": [
+        {
+          "name": "analyze_bids",
+          "params": {"currencies": 1000, "traders": 10000, ...},
+          "ops": 52345,
+          "seconds": 0.0812,
+          "ops_per_sec": 644642.9,
+          "peak_rss_kb": 65432
+        },
+        ...
+      ]
+    }
+
+When the measured time is zero, "ops_per_sec" will be null. Some
+benchmarks add a "details" field to their results. For example, the
+"compare_engines" benchmark runs the solver with the "dfs" and the
+"flow" engines on the same generated turn, and reports the time and
+the total traded value for each engine:
+
+    "details": {
+      "engines": {
+        "dfs": {"seconds": 0.52, "takings": 10235, "traded_value": ...},
+        "flow": {"seconds": 3.17, "takings": 10388, "traded_value": ...}
+      },
+      "flow_to_dfs_value_ratio": 1.0213
+    }
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+from . import generators as g
+
+SCALES = {
+    "tiny": {"currencies": 100, "traders": 1000},
+    "small": {"currencies": 1000, "traders": 10000},
+    "medium": {"currencies": 5000, "traders": 100000},
+    "large": {"currencies": 20000, "traders": 1000000},
+}
+MIN_TRADE_AMOUNT = 1000
+COLLECTOR_ID = -1
+
+
+def _generate_turn(params: dict) -> tuple[list, list]:
+    currencies = g.generate_currency_tree(
+        params["currencies"],
+        max_depth=params["max_depth"],
+        seed=params["seed"],
+    )
+    bids = list(
+        g.generate_bids(
+            currencies,
+            params["traders"],
+            bids_per_trader=params["bids_per_trader"],
+            popularity_skew=params["popularity_skew"],
+            demand_skew=params["demand_skew"],
+            seed=params["seed"],
+        )
+    )
+    return currencies, bids
+
+
+def _register_currencies(x, currencies: list) -> None:
+    for row in currencies:
+        if row.peg_debtor_id == 0:
+            x.register_currency(
+                row.is_confirmed, row.debtor_info_locator, row.debtor_id
+            )
+        else:
+            x.register_currency(*row)
+
+
+def _create_bid_processor(params: dict):
+    from swpt_trade.solver import BidProcessor
+
+    return BidProcessor(
+        g.get_locator(g.BASE_DEBTOR_ID),
+        g.BASE_DEBTOR_ID,
+        params["max_depth"],
+        MIN_TRADE_AMOUNT,
+    )
+
+
+def bench_analyze_bids(params: dict) -> tuple[int, float]:
+    """Time `BidProcessor.analyze_bids`."""
+    currencies, bids = _generate_turn(params)
+    bp = _create_bid_processor(params)
+    _register_currencies(bp, currencies)
+    bp.get_currency_price(g.BASE_DEBTOR_ID)  # prepares the currency tree
+
+    for bid in bids:
+        bp.register_bid(*bid[:5])
+
+    started_at = time.perf_counter()
+    bp.analyze_bids()
+    return len(bids), time.perf_counter() - started_at
+
+
+def bench_candidate_offers_iter(params: dict) -> tuple[int, float]:
+    """Time `BidProcessor.candidate_offers_iter`."""
+    currencies, bids = _generate_turn(params)
+    bp = _create_bid_processor(params)
+    _register_currencies(bp, currencies)
+    bp.get_currency_price(g.BASE_DEBTOR_ID)  # prepares the currency tree
+
+    started_at = time.perf_counter()
+    for _ in bp.candidate_offers_iter(bids):
+        pass
+    return len(bids), time.perf_counter() - started_at
+
+
+def bench_candidate_offer_columns_iter(params: dict) -> tuple[int, float]:
+    """Time `BidProcessor.candidate_offer_columns_iter`, including the
+    encoding of the candidate offers in PostgreSQL's binary `COPY`
+    format.
+    """
+    from swpt_trade.solver import encode_binary_copy
+
+    currencies, bids = _generate_turn(params)
+    bp = _create_bid_processor(params)
+    _register_currencies(bp, currencies)
+    bp.get_currency_price(g.BASE_DEBTOR_ID)  # prepares the currency tree
+
+    started_at = time.perf_counter()
+    for columns in bp.candidate_offer_columns_iter(bids):
+        encode_binary_copy((1, *columns, 0), "hqqqDqT")
+    return len(bids), time.perf_counter() - started_at
+
+
+def _generate_offers(params: dict) -> tuple[list, list, list]:
+    # Returns the currencies, the sell offers and the buy offers.
+    currencies, bids = _generate_turn(params)
+    sell_offers = [
+        (bid.creditor_id, bid.debtor_id, -bid.amount, COLLECTOR_ID)
+        for bid in bids if bid.amount < 0
+    ]
+    buy_offers = [
+        (bid.creditor_id, bid.debtor_id, bid.amount)
+        for bid in bids if bid.amount > 0
+    ]
+    return currencies, sell_offers, buy_offers
+
+
+def bench_find_cycle(params: dict) -> tuple[int, float]:
+    """Time `Digraph.find_cycle`. The number of found cycles is
+    reported as the number of operations.
+    """
+    from swpt_trade.solver import Digraph
+
+    currencies, sell_offers, buy_offers = _generate_offers(params)
+    prices = g.calc_prices(currencies)
+    graph = Digraph()
+    for row in currencies:
+        price = prices[row.debtor_id]
+        graph.add_currency(row.debtor_id, MIN_TRADE_AMOUNT * price)
+    for creditor_id, debtor_id, amount, _ in sell_offers:
+        graph.add_supply(amount * prices[debtor_id], debtor_id, creditor_id)
+    for creditor_id, debtor_id, amount in buy_offers:
+        graph.add_demand(amount * prices[debtor_id], debtor_id, creditor_id)
+
+    cycles_count = 0
+    started_at = time.perf_counter()
+    while graph.find_cycle() is not None:
+        cycles_count += 1
+    return cycles_count, time.perf_counter() - started_at
+
+
+def _create_solver(
+        params: dict,
+        engine: str,
+        currencies: list,
+        sell_offers: list,
+        buy_offers: list,
+):
+    from array import array
+    from swpt_trade.solver import Solver
+
+    solver = Solver(
+        g.get_locator(g.BASE_DEBTOR_ID),
+        g.BASE_DEBTOR_ID,
+        params["max_depth"],
+        MIN_TRADE_AMOUNT,
+        params["threads"],
+        engine,
+        preferred_cycle_length=params["preferred_cycle_length"],
+    )
+    _register_currencies(solver, currencies)
+    solver.analyze_currencies()
+    if sell_offers:
+        solver.register_sell_offers_bulk(
+            *(array("q", column) for column in zip(*sell_offers))
+        )
+    if buy_offers:
+        solver.register_buy_offers_bulk(
+            *(array("q", column) for column in zip(*buy_offers))
+        )
+    return solver
+
+
+def bench_analyze_offers(params: dict) -> tuple[int, float]:
+    """Time `Solver.analyze_offers`. The number of registered offers
+    is reported as the number of operations.
+    """
+    currencies, sell_offers, buy_offers = _generate_offers(params)
+    solver = _create_solver(
+        params, params["engine"], currencies, sell_offers, buy_offers
+    )
+
+    started_at = time.perf_counter()
+    solver.analyze_offers()
+    return len(sell_offers) + len(buy_offers), (
+        time.perf_counter() - started_at
+    )
+
+
+def bench_compare_engines(params: dict) -> tuple[int, float, dict]:
+    """Run `Solver.analyze_offers` with every solving engine, on the
+    same generated turn. The number of registered offers is reported
+    as the number of operations, and the reported time is the total
+    time for all engines. For each engine, the details contain the
+    time, the number of takings (the matched sell offers), and the
+    total traded value (the sum of all taken amounts, measured in
+    tokens of the base currency).
+    """
+    from swpt_trade.solver import ENGINE_DFS, ENGINE_FLOW
+
+    currencies, sell_offers, buy_offers = _generate_offers(params)
+    prices = g.calc_prices(currencies)
+    engines = {}
+    total_seconds = 0.0
+
+    for engine in [ENGINE_DFS, ENGINE_FLOW]:
+        solver = _create_solver(
+            params, engine, currencies, sell_offers, buy_offers
+        )
+        started_at = time.perf_counter()
+        solver.analyze_offers()
+        seconds = time.perf_counter() - started_at
+        total_seconds += seconds
+
+        takings_count = 0
+        traded_value = 0.0
+        for taking in solver.takings_iter():
+            takings_count += 1
+            traded_value -= taking.amount * prices[taking.debtor_id]
+
+        engines[engine] = {
+            "seconds": round(seconds, 6),
+            "takings": takings_count,
+            "traded_value": round(traded_value, 1),
+        }
+        del solver
+
+    dfs_value = engines[ENGINE_DFS]["traded_value"]
+    flow_value = engines[ENGINE_FLOW]["traded_value"]
+    details = {
+        "engines": engines,
+        "flow_to_dfs_value_ratio": (
+            round(flow_value / dfs_value, 4) if dfs_value > 0 else None
+        ),
+    }
+    return len(sell_offers) + len(buy_offers), total_seconds, details
+
+
+BENCHMARKS = {
+    "analyze_bids": bench_analyze_bids,
+    "candidate_offers_iter": bench_candidate_offers_iter,
+    "candidate_offer_columns_iter": bench_candidate_offer_columns_iter,
+    "find_cycle": bench_find_cycle,
+    "analyze_offers": bench_analyze_offers,
+    "compare_engines": bench_compare_engines,
+}
+
+
+def _run_in_child(name: str, params: dict, conn) -> None:
+    # Benchmarks return an (ops, seconds) tuple, optionally followed
+    # by a dictionary with benchmark-specific details.
+    ops, seconds, *details = BENCHMARKS[name](params)
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    conn.send((ops, seconds, peak_rss_kb, details[0] if details else None))
+    conn.close()
+
+
+def run_benchmark(name: str, params: dict) -> dict:
+    """Run a benchmark in a separate process, and return the result."""
+    ctx = multiprocessing.get_context("fork")
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    process = ctx.Process(
+        target=_run_in_child, args=(name, params, child_conn)
+    )
+    process.start()
+    child_conn.close()
+    try:
+        ops, seconds, peak_rss_kb, details = parent_conn.recv()
+    except EOFError:
+        raise RuntimeError(f"benchmark {name} has failed") from None
+    finally:
+        process.join()
+
+    result = {
+        "name": name,
+        "params": params,
+        "ops": ops,
+        "seconds": round(seconds, 6),
+        "ops_per_sec": round(ops / seconds, 1) if seconds > 0 else None,
+        "peak_rss_kb": peak_rss_kb,
+    }
+    if details is not None:
+        result["details"] = details
+    return result
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Measure the throughput of the Cython solver.",
+    )
+    parser.add_argument(
+        "-s",
+        "--scale",
+        choices=list(SCALES),
+        default="small",
+        help="the size of the generated trading turn (default: small)",
+    )
+    parser.add_argument(
+        "-b",
+        "--benchmark",
+        action="append",
+        choices=list(BENCHMARKS),
+        help="run only the given benchmark (can be repeated)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-depth", type=int, default=10)
+    parser.add_argument("--bids-per-trader", type=int, default=4)
+    parser.add_argument("--popularity-skew", type=float, default=1.0)
+    parser.add_argument("--demand-skew", type=float, default=0.0)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--engine", choices=["dfs", "flow"], default="dfs")
+    parser.add_argument("--preferred-cycle-length", type=int, default=0)
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="write the JSON report to the given file (default: stdout)",
+    )
+    args = parser.parse_args(argv)
+
+    params = dict(
+        SCALES[args.scale],
+        seed=args.seed,
+        max_depth=args.max_depth,
+        bids_per_trader=args.bids_per_trader,
+        popularity_skew=args.popularity_skew,
+        demand_skew=args.demand_skew,
+        threads=args.threads,
+        engine=args.engine,
+        preferred_cycle_length=args.preferred_cycle_length,
+    )
+    report = {
+        "python": platform.python_version(),
+        "scale": args.scale,
+        "seed": args.seed,
+        "results": [
+            run_benchmark(name, params)
+            for name in (args.benchmark or BENCHMARKS)
+        ],
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
@@ -0,0 +1,96 @@
+"""partition per-turn solver tables by turn_id
+
+Revision ID: 7c1d9e5b0a42
+Revises: 3e7a41c9d2b5
+Create Date: 2026-10-17 11:40:02.137715
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c1d9e5b0a42'
+down_revision = '3e7a41c9d2b5'
+branch_labels = None
+depends_on = None
+
+
+# Each existing table becomes the default partition of a new
+# partitioned table with the same name. (The primary key indexes
+# must be renamed first, because index names are unique per schema.)
+PARTITIONED_TABLES = [
+    ('debtor_info', ['turn_id', 'debtor_info_locator']),
+    ('confirmed_debtor', ['turn_id', 'debtor_id']),
+    ('currency_info', ['turn_id', 'debtor_info_locator']),
+    ('sell_offer', ['turn_id', 'creditor_id', 'debtor_id']),
+    ('buy_offer', ['turn_id', 'creditor_id', 'debtor_id']),
+    ('creditor_taking', ['turn_id', 'creditor_id', 'debtor_id']),
+    ('collector_collecting', ['turn_id', 'debtor_id', 'creditor_id']),
+    ('collector_sending', ['turn_id', 'debtor_id', 'from_collector_id', 'to_collector_id']),
+    ('collector_receiving', ['turn_id', 'debtor_id', 'to_collector_id', 'from_collector_id']),
+    ('collector_dispatching', ['turn_id', 'debtor_id', 'creditor_id']),
+    ('creditor_giving', ['turn_id', 'creditor_id', 'debtor_id']),
+]
+
+
+def upgrade(engine_name):
+    globals()["upgrade_%s" % engine_name]()
+
+
+def downgrade(engine_name):
+    globals()["downgrade_%s" % engine_name]()
+
+
+
+
+
+def upgrade_():
+    pass
+
+
+def downgrade_():
+    pass
+
+
+def upgrade_solver():
+    for table, pk_columns in PARTITIONED_TABLES:
+        default = f'{table}_default'
+        op.execute(f'ALTER TABLE {table} RENAME TO {default}')
+        op.execute(f'ALTER INDEX {table}_pkey RENAME TO {default}_pkey')
+        op.execute(
+            f'CREATE TABLE {table} (LIKE {default} INCLUDING DEFAULTS'
+            f' INCLUDING CONSTRAINTS INCLUDING COMMENTS)'
+            f' PARTITION BY LIST (turn_id)'
+        )
+        op.execute(
+            f'ALTER TABLE {table} ADD PRIMARY KEY ({", ".join(pk_columns)})'
+        )
+        op.execute(
+            f"DO $$ BEGIN EXECUTE format('COMMENT ON TABLE {table} IS %L',"
+            f" obj_description('{default}'::regclass, 'pg_class')); END $$"
+        )
+        op.execute(f'ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT')
+
+    op.execute(
+        'ALTER INDEX idx_currency_info_confirmed_debtor_id'
+        ' RENAME TO currency_info_default_confirmed_debtor_id_idx'
+    )
+    op.create_index('idx_currency_info_confirmed_debtor_id', 'currency_info', ['turn_id', 'debtor_id'], unique=True, postgresql_where=sa.text('is_confirmed'))
+
+
+def downgrade_solver():
+    # NOTE: Detached partitions keep their indexes, while the indexes
+    # of the dropped partitioned tables are dropped with them.
+    for table, pk_columns in PARTITIONED_TABLES:
+        default = f'{table}_default'
+        op.execute(f'ALTER TABLE {table} DETACH PARTITION {default}')
+        op.execute(f'INSERT INTO {default} SELECT * FROM {table}')
+        op.execute(f'DROP TABLE {table}')
+        op.execute(f'ALTER TABLE {default} RENAME TO {table}')
+        op.execute(f'ALTER INDEX {default}_pkey RENAME TO {table}_pkey')
+
+    op.execute(
+        'ALTER INDEX currency_info_default_confirmed_debtor_id_idx'
+        ' RENAME TO idx_currency_info_confirmed_debtor_id'
+    )
@@ -0,0 +1,84 @@
+"""remove the default partitions of per-turn solver tables
+
+Revision ID: a8f3c2d17b64
+Revises: 5d2e8f1c7a36
+Create Date: 2026-10-17 18:05:31.260417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8f3c2d17b64'
+down_revision = '5d2e8f1c7a36'
+branch_labels = None
+depends_on = None
+
+
+# Partitions can not be detached concurrently from a partitioned
+# table which has a default partition. Therefore, the rows of each
+# default partition are moved to per-turn partitions, and the default
+# partition is dropped.
+PARTITIONED_TABLES = [
+    ('debtor_info', ['turn_id', 'debtor_info_locator']),
+    ('confirmed_debtor', ['turn_id', 'debtor_id']),
+    ('currency_info', ['turn_id', 'debtor_info_locator']),
+    ('sell_offer', ['turn_id', 'creditor_id', 'debtor_id']),
+    ('buy_offer', ['turn_id', 'creditor_id', 'debtor_id']),
+    ('creditor_taking', ['turn_id', 'creditor_id', 'debtor_id']),
+    ('collector_collecting', ['turn_id', 'debtor_id', 'creditor_id']),
+    ('collector_sending', ['turn_id', 'debtor_id', 'from_collector_id', 'to_collector_id']),
+    ('collector_receiving', ['turn_id', 'debtor_id', 'to_collector_id', 'from_collector_id']),
+    ('collector_dispatching', ['turn_id', 'debtor_id', 'creditor_id']),
+    ('creditor_giving', ['turn_id', 'creditor_id', 'debtor_id']),
+]
+
+
+def upgrade(engine_name):
+    globals()["upgrade_%s" % engine_name]()
+
+
+def downgrade(engine_name):
+    globals()["downgrade_%s" % engine_name]()
+
+
+
+
+
+def upgrade_():
+    pass
+
+
+def downgrade_():
+    pass
+
+
+def upgrade_solver():
+    for table, pk_columns in PARTITIONED_TABLES:
+        default = f'{table}_default'
+        op.execute(f'ALTER TABLE {table} DETACH PARTITION {default}')
+        op.execute(
+            f"DO $$ DECLARE t integer; BEGIN"
+            f" FOR t IN SELECT DISTINCT turn_id FROM {default} LOOP"
+            f" EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF"
+            f" {table} FOR VALUES IN (%s)', '{table}_t' || t, t);"
+            f" END LOOP; END $$"
+        )
+        op.execute(f'INSERT INTO {table} SELECT * FROM {default}')
+        op.execute(f'DROP TABLE {default}')
+
+
+def downgrade_solver():
+    for table, pk_columns in PARTITIONED_TABLES:
+        default = f'{table}_default'
+        op.execute(
+            f'CREATE TABLE {default} (LIKE {table} INCLUDING DEFAULTS'
+            f' INCLUDING CONSTRAINTS)'
+        )
+        op.execute(
+            f'ALTER TABLE {default} ADD PRIMARY KEY ({", ".join(pk_columns)})'
+        )
+        if table == 'currency_info':
+            op.create_index('currency_info_default_confirmed_debtor_id_idx', default, ['turn_id', 'debtor_id'], unique=True, postgresql_where=sa.text('is_confirmed'))
+        op.execute(f'ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT')
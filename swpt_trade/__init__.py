@@ -207,9 +207,20 @@ class Configuration(metaclass=MetaEnvReader):
     BASE_DEBTOR_ID: _parse_debtor_id = None
     MAX_DISTANCE_TO_BASE = 10
     MIN_TRADE_AMOUNT = 1000
+    SOLVER_THREADS = 1
+    SOLVER_ENGINE = "dfs"
+    SOLVER_CACHE_DIR = ""
+    SOLVER_SPILL_DIR = ""
+    SOLVER_SPILL_MEMORY_LIMIT = 268435456
+    SOLVER_PREFERRED_CYCLE_LENGTH = 0
+    SOLVER_LOAD_THREADS = 1
+    SOLVER_CHECKPOINT_DIR = "/var/tmp"
+    SOLVER_METRICS_FILE = ""
 
     SOLVER_POSTGRES_URL = ""
     SOLVER_CLIENT_POOL_SIZE: int = None
+    UPLOAD_WITH_COPY_PIPE = False
+    AGGREGATE_DISPATCHING_STATUSES_IN_SQL = False
 
     # The default value for `WORKER_POSTGRES_URL` is a random valid
     # connection string. This allows solver processes (they do not use
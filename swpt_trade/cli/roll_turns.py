@@ -62,14 +62,21 @@ def roll_turns(period, period_offset, check_interval, quit_early):
     completed, the turn advances to the next phase. The durations of
     phases 1 and 2 are controlled by the environment variables
     TURN_PHASE1_DURATION and TURN_PHASE2_DURATION. (Note that time
-    units can also be included in values of these variables.)
+    units can also be included in values of these variables.) The
+    per-turn partitions of the solver's tables are dropped as soon as
+    the turn has advanced far enough, so that they are not needed
+    anymore.
 
     Another important environment variables which control the way
     trading turns work are: BASE_DEBTOR_INFO_LOCATOR, BASE_DEBTOR_ID,
-    MAX_DISTANCE_TO_BASE, MIN_TRADE_AMOUNT.
+    MAX_DISTANCE_TO_BASE, MIN_TRADE_AMOUNT, SOLVER_THREADS,
+    SOLVER_ENGINE, SOLVER_CACHE_DIR, SOLVER_SPILL_DIR,
+    SOLVER_SPILL_MEMORY_LIMIT, SOLVER_PREFERRED_CYCLE_LENGTH,
+    SOLVER_LOAD_THREADS, SOLVER_CHECKPOINT_DIR, SOLVER_METRICS_FILE.
     """
     from swpt_trade.utils import parse_timedelta
     from swpt_trade.solve_turn import try_to_advance_turn_to_phase3
+    from swpt_trade.partitions import drop_obsolete_turn_partitions
 
     c = current_app.config
     period = parse_timedelta(period or c["TURN_PERIOD"])
@@ -105,10 +112,25 @@ def roll_turns(period, period_offset, check_interval, quit_early):
                     max_commit_period=max_commit_period,
                 )
             elif phase == 2 and turn.phase_deadline < check_began_at:
-                try_to_advance_turn_to_phase3(turn)
+                try_to_advance_turn_to_phase3(
+                    turn,
+                    num_threads=c["SOLVER_THREADS"],
+                    engine=c["SOLVER_ENGINE"],
+                    cache_dir=c["SOLVER_CACHE_DIR"],
+                    spill_dir=c["SOLVER_SPILL_DIR"],
+                    spill_memory_limit=c["SOLVER_SPILL_MEMORY_LIMIT"],
+                    preferred_cycle_length=c[
+                        "SOLVER_PREFERRED_CYCLE_LENGTH"
+                    ],
+                    load_threads=c["SOLVER_LOAD_THREADS"],
+                    checkpoint_dir=c["SOLVER_CHECKPOINT_DIR"],
+                    metrics_file=c["SOLVER_METRICS_FILE"],
+                )
             elif phase == 3:
                 procedures.try_to_advance_turn_to_phase4(turn.turn_id)
 
+        drop_obsolete_turn_partitions()
+
         elapsed_time = datetime.now(tz=timezone.utc) - check_began_at
         wait_seconds = (check_interval - elapsed_time).total_seconds()
 
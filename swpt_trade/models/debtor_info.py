@@ -2,6 +2,7 @@ from __future__ import annotations
 from datetime import datetime, timedelta
 from sqlalchemy.sql.expression import null, or_, and_
 from swpt_trade.extensions import db
+from swpt_trade.utils import calc_sql_hash
 from .common import get_now_utc
 
 
@@ -15,6 +16,16 @@ class DebtorInfoDocument(db.Model):
     fetched_at = db.Column(
         db.TIMESTAMP(timezone=True), nullable=False, default=get_now_utc
     )
+    debtor_info_locator_hash = db.Column(
+        db.Integer,
+        db.Computed(calc_sql_hash(debtor_info_locator), persisted=True),
+        nullable=False,
+        comment=(
+            "The highest 32 bits of the MD5 hash of `debtor_info_locator`."
+            " This allows the records which belong to a given sharding"
+            " realm to be selected efficiently."
+        ),
+    )
     __table_args__ = (
         db.CheckConstraint(peg_exchange_rate >= 0.0),
         db.CheckConstraint(
@@ -31,6 +42,10 @@ class DebtorInfoDocument(db.Model):
                 ),
             )
         ),
+        db.Index(
+            "idx_debtor_info_document_debtor_info_locator_hash",
+            debtor_info_locator_hash,
+        ),
         {
             "comment": (
                 "Represents relevant trading information about a given"
@@ -58,6 +73,16 @@ class DebtorLocatorClaim(db.Model):
         db.TIMESTAMP(timezone=True), nullable=False, default=get_now_utc
     )
     forced_locator_refetch_at = db.Column(db.TIMESTAMP(timezone=True))
+    debtor_hash = db.Column(
+        db.Integer,
+        db.Computed(calc_sql_hash(debtor_id), persisted=True),
+        nullable=False,
+        comment=(
+            "The highest 32 bits of the MD5 hash of `debtor_id`. This"
+            " allows the records which belong to a given sharding realm"
+            " to be selected efficiently."
+        ),
+    )
     __table_args__ = (
         db.CheckConstraint(
             or_(
@@ -76,6 +101,11 @@ class DebtorLocatorClaim(db.Model):
             latest_locator_fetch_at,
             postgresql_where=latest_locator_fetch_at != null(),
         ),
+        db.Index(
+            "idx_debtor_locator_claim_debtor_hash",
+            debtor_hash,
+            postgresql_where=debtor_info_locator != null(),
+        ),
         {
             "comment": (
                 "Represents a reliable claim made by a given debtor,"
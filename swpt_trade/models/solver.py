@@ -156,6 +156,7 @@ class DebtorInfo(db.Model):
     peg_exchange_rate = db.Column(db.FLOAT)
     __table_args__ = (
         {
+            "postgresql_partition_by": "LIST (turn_id)",
             "comment": (
                 'Represents relevant information about a given currency'
                 ' (aka debtor), so that the currency can participate'
@@ -175,6 +176,7 @@ class ConfirmedDebtor(db.Model):
     debtor_info_locator = db.Column(db.String, nullable=False)
     __table_args__ = (
         {
+            "postgresql_partition_by": "LIST (turn_id)",
             "comment": (
                 'Represents the fact that a given currency (aka debtor) is'
                 ' verified (confirmed), so that this currency can be traded'
@@ -206,6 +208,7 @@ class CurrencyInfo(db.Model):
             postgresql_where=is_confirmed,
         ),
         {
+            "postgresql_partition_by": "LIST (turn_id)",
             "comment": (
                 'Represents relevant information about a given currency'
                 ' (aka debtor), so that the currency can participate'
@@ -229,6 +232,7 @@ class SellOffer(db.Model):
     __table_args__ = (
         db.CheckConstraint(amount > 0),
         {
+            "postgresql_partition_by": "LIST (turn_id)",
             "comment": (
                 'Represents a sell offer, participating in a given trading'
                 ' turn. "Worker" servers are responsible for populating this'
@@ -249,6 +253,7 @@ class BuyOffer(db.Model):
     __table_args__ = (
         db.CheckConstraint(amount > 0),
         {
+            "postgresql_partition_by": "LIST (turn_id)",
             "comment": (
                 'Represents a buy offer, participating in a given trading'
                 ' turn. "Worker" servers are responsible for populating this'
@@ -260,6 +265,39 @@ class BuyOffer(db.Model):
     )
 
 
+class TurnCommitProgress(db.Model):
+    __bind_key__ = "solver"
+    turn_id = db.Column(db.Integer, primary_key=True)
+    stream_name = db.Column(
+        db.String,
+        primary_key=True,
+        comment=(
+            'The name of the stream of solver results: "takings",'
+            ' "collector_transfers", or "givings".'
+        ),
+    )
+    written_rows = db.Column(
+        db.BigInteger,
+        nullable=False,
+        default=0,
+        comment="The number of already written stream items.",
+    )
+    is_completed = db.Column(db.BOOLEAN, nullable=False, default=False)
+    __table_args__ = (
+        db.CheckConstraint(written_rows >= 0),
+        {
+            "comment": (
+                'Represents the progress of writing a given stream of'
+                ' solver results for a given trading turn. The "solver"'
+                ' server writes the results in many small transactions'
+                ' while the turn is still in phase 2, and updates this'
+                ' table after each transaction. The records will be deleted'
+                ' when the turn advances to phase 3.'
+            ),
+        },
+    )
+
+
 class CreditorTaking(db.Model):
     __bind_key__ = "solver"
     turn_id = db.Column(db.Integer, primary_key=True)
@@ -271,6 +309,7 @@ class CreditorTaking(db.Model):
     __table_args__ = (
         db.CheckConstraint(amount > 0),
         {
+            "postgresql_partition_by": "LIST (turn_id)",
             "comment": (
                 'Informs the "worker" server responsible for the given'
                 ' customer account, that the given amount must be withdrawn'
@@ -294,6 +333,7 @@ class CollectorCollecting(db.Model):
     __table_args__ = (
         db.CheckConstraint(amount > 0),
         {
+            "postgresql_partition_by": "LIST (turn_id)",
             "comment": (
                 'Informs the "worker" server responsible for the given'
                 ' collector, that the given amount will be withdrawn'
@@ -318,6 +358,7 @@ class CollectorSending(db.Model):
         db.CheckConstraint(amount > 0),
         db.CheckConstraint(from_collector_id != to_collector_id),
         {
+            "postgresql_partition_by": "LIST (turn_id)",
             "comment": (
                 'Informs the "worker" server responsible for the given'
                 ' "from collector" account, that the given amount must be'
@@ -342,6 +383,7 @@ class CollectorReceiving(db.Model):
         db.CheckConstraint(amount > 0),
         db.CheckConstraint(from_collector_id != to_collector_id),
         {
+            "postgresql_partition_by": "LIST (turn_id)",
             "comment": (
                 'Informs the "worker" server responsible for the given'
                 ' "to collector" account, that the given amount will be'
@@ -365,6 +407,7 @@ class CollectorDispatching(db.Model):
     __table_args__ = (
         db.CheckConstraint(amount > 0),
         {
+            "postgresql_partition_by": "LIST (turn_id)",
             "comment": (
                 'Informs the "worker" server responsible for the given'
                 ' collector, that the given amount must be deposited'
@@ -388,6 +431,7 @@ class CreditorGiving(db.Model):
     __table_args__ = (
         db.CheckConstraint(amount > 0),
         {
+            "postgresql_partition_by": "LIST (turn_id)",
             "comment": (
                 'Informs the "worker" server responsible for the given'
                 ' customer account, that the given amount will be deposited'
@@ -1,6 +1,7 @@
 from __future__ import annotations
 from sqlalchemy.sql.expression import null, or_, and_
 from swpt_trade.extensions import db
+from swpt_trade.utils import calc_sql_hash
 from .common import (
     TS0,
     DATE0,
@@ -54,6 +55,16 @@ class TradingPolicy(db.Model):
     config_flags = db.Column(
         db.Integer, nullable=False, default=DEFAULT_CONFIG_FLAGS
     )
+    creditor_hash = db.Column(
+        db.Integer,
+        db.Computed(calc_sql_hash(creditor_id), persisted=True),
+        nullable=False,
+        comment=(
+            "The highest 32 bits of the MD5 hash of `creditor_id`. This"
+            " allows the records which belong to a given sharding realm"
+            " to be selected efficiently."
+        ),
+    )
     __table_args__ = (
         db.CheckConstraint(latest_ledger_update_id >= 0),
         db.CheckConstraint(latest_policy_update_id >= 0),
@@ -72,6 +83,11 @@ class TradingPolicy(db.Model):
                 ),
             )
         ),
+        db.Index(
+            "idx_trading_policy_creditor_hash",
+            creditor_hash,
+            creditor_id,
+        ),
         {
             "comment": (
                 "Represents important information about a given customer"
@@ -0,0 +1,276 @@
+"""Manage the per-turn partitions of the solver's tables.
+
+The tables which contain per-turn data are partitioned by `turn_id`
+(PostgreSQL's declarative LIST partitioning). Each turn gets its own
+partition in every such table. The partitions are created when the
+turn starts, and are dropped as soon as the turn's data in the given
+table is not needed anymore. This is much cheaper than deleting the
+rows one by one, and does not leave dead tuples behind.
+
+The partitioned tables do not have default partitions. Therefore, an
+attempt to insert rows for a turn whose partition has been dropped
+(by a late worker process, for example) fails with an integrity
+error, and the rows are discarded.
+
+The tables which contain solver results are handled differently. The
+turn partitions for these tables are not created when the turn
+starts. Instead, the solver writes its results to stand-alone
+"staging" tables, which are attached as turn partitions when the
+turn advances to phase 3. Before that, the results are not visible
+in the partitioned tables at all.
+
+To avoid blocking the queries to the partitioned tables, partitions
+are never created with `CREATE TABLE ... PARTITION OF` or dropped
+while attached, because this requires an ACCESS EXCLUSIVE lock on the
+partitioned table. Instead, partitions are created as stand-alone
+tables, and then attached, or concurrently detached, and then
+dropped. These operations lock the partitioned table only with a
+SHARE UPDATE EXCLUSIVE lock.
+"""
+
+import re
+from typing import Iterable
+from sqlalchemy import text, select
+from swpt_trade.extensions import db
+from swpt_trade.models import (
+    Turn,
+    DebtorInfo,
+    ConfirmedDebtor,
+    CurrencyInfo,
+    SellOffer,
+    BuyOffer,
+    CreditorTaking,
+    CollectorCollecting,
+    CollectorSending,
+    CollectorReceiving,
+    CollectorDispatching,
+    CreditorGiving,
+)
+
+PARTITIONED_MODELS = [
+    DebtorInfo,
+    ConfirmedDebtor,
+    CurrencyInfo,
+    SellOffer,
+    BuyOffer,
+    CreditorTaking,
+    CollectorCollecting,
+    CollectorSending,
+    CollectorReceiving,
+    CollectorDispatching,
+    CreditorGiving,
+]
+
+STAGED_MODELS = [
+    CreditorTaking,
+    CollectorCollecting,
+    CollectorSending,
+    CollectorReceiving,
+    CollectorDispatching,
+    CreditorGiving,
+]
+
+# The turn's partition in the table of a given model becomes obsolete
+# when the turn reaches the given phase.
+OBSOLETE_PARTITION_PHASES = {
+    DebtorInfo: 2,
+    ConfirmedDebtor: 2,
+    CurrencyInfo: 3,
+    SellOffer: 3,
+    BuyOffer: 3,
+    CreditorTaking: 4,
+    CollectorCollecting: 4,
+    CollectorSending: 4,
+    CollectorReceiving: 4,
+    CollectorDispatching: 4,
+    CreditorGiving: 4,
+}
+
+
+def get_partition_name(table_name: str, turn_id: int) -> str:
+    return f"{table_name}_t{turn_id}"
+
+
+def create_turn_partitions(turn_id: int) -> None:
+    """Create the partitions for the given turn, in all partitioned
+    tables, except the tables for solver results (see
+    `create_staging_partitions`).
+
+    This must be done before any rows for the turn are inserted.
+    Partitions which exist already are not changed.
+    """
+    turn_id = int(turn_id)
+
+    for model in PARTITIONED_MODELS:
+        if model in STAGED_MODELS:
+            continue
+        table_name = model.__table__.name
+        partition_name = get_partition_name(table_name, turn_id)
+        _create_partition_table(table_name, partition_name, turn_id)
+        _attach_partition(table_name, partition_name, turn_id)
+
+
+def create_staging_partitions(turn_id: int, models: Iterable) -> None:
+    """Create empty (not attached) partitions for the given turn, in
+    the tables of the given models. Existing partitions for the given
+    turn will be dropped.
+    """
+    turn_id = int(turn_id)
+
+    for model in models:
+        assert model in STAGED_MODELS
+        table_name = model.__table__.name
+        partition_name = get_partition_name(table_name, turn_id)
+        _execute(f"DROP TABLE IF EXISTS {partition_name}")
+        _create_partition_table(table_name, partition_name, turn_id)
+
+
+def attach_staging_partitions(turn_id: int, models: Iterable) -> None:
+    """Attach the partitions created by `create_staging_partitions`
+    to the tables of the given models.
+
+    Partitions that do not exist, or have been attached already, are
+    skipped.
+    """
+    turn_id = int(turn_id)
+
+    for model in models:
+        assert model in STAGED_MODELS
+        table_name = model.__table__.name
+        partition_name = get_partition_name(table_name, turn_id)
+        _attach_partition(table_name, partition_name, turn_id)
+
+
+def drop_turn_partitions(turn_id: int, models: Iterable) -> None:
+    """Drop the partitions for the given turn, in the tables of the
+    given models.
+
+    Attached partitions are detached concurrently, and then dropped.
+    `DETACH PARTITION ... CONCURRENTLY` can not be executed inside a
+    transaction block, and waits for all transactions which use the
+    partitioned table to finish. Therefore, the statements are
+    executed in autocommit mode, and the current database session is
+    closed first.
+    """
+    turn_id = int(turn_id)
+    db.session.close()
+
+    with _connect_in_autocommit_mode() as conn:
+        for model in models:
+            assert model in PARTITIONED_MODELS
+            table_name = model.__table__.name
+            partition_name = get_partition_name(table_name, turn_id)
+            _drop_partition(conn, table_name, partition_name)
+
+
+def drop_obsolete_turn_partitions() -> None:
+    """Drop the partitions (attached or not) which are not needed
+    anymore, because their turns have advanced far enough (see
+    `OBSOLETE_PARTITION_PHASES`).
+
+    Like `drop_turn_partitions`, this function closes the current
+    database session, and must not be called inside a transaction.
+    """
+    db.session.close()
+
+    with _connect_in_autocommit_mode() as conn:
+        turn_phases = dict(
+            conn.execute(select(Turn.turn_id, Turn.phase)).all()
+        )
+
+        for model, obsolete_phase in OBSOLETE_PARTITION_PHASES.items():
+            table_name = model.__table__.name
+            pattern = re.compile(rf"{table_name}_t(\d+)")
+            partition_names = conn.execute(
+                text(
+                    "SELECT relname FROM pg_class"
+                    " WHERE relkind = 'r' AND relname LIKE :prefix"
+                    " AND pg_table_is_visible(oid)"
+                ),
+                {"prefix": f"{table_name}\\_t%"},
+            ).scalars().all()
+
+            for partition_name in partition_names:
+                m = pattern.fullmatch(partition_name)
+                if m is None:
+                    continue
+
+                # The partitions of unknown turns are dropped too.
+                phase = turn_phases.get(int(m.group(1)))
+                if phase is None or phase >= obsolete_phase:
+                    _drop_partition(conn, table_name, partition_name)
+
+
+def _create_partition_table(
+        table_name: str,
+        partition_name: str,
+        turn_id: int,
+) -> None:
+    # The created table has the same columns and indexes as the
+    # partitioned table, and a CHECK constraint which matches the
+    # partition bound. This way, attaching it later does not need to
+    # scan its rows, and the existing indexes will be used.
+    _execute(
+        f"CREATE TABLE IF NOT EXISTS {partition_name}"
+        f" (LIKE {table_name} INCLUDING ALL,"
+        f" CHECK (turn_id = {turn_id}))"
+    )
+
+
+def _attach_partition(
+        table_name: str,
+        partition_name: str,
+        turn_id: int,
+) -> None:
+    is_partition = db.session.execute(
+        text(
+            "SELECT relispartition FROM pg_class"
+            " WHERE oid = to_regclass(:name)"
+        ),
+        {"name": partition_name},
+        bind_arguments={"bind": db.engines["solver"]},
+    ).scalar_one_or_none()
+
+    if is_partition is False:
+        _execute(
+            f"ALTER TABLE {table_name} ATTACH PARTITION {partition_name}"
+            f" FOR VALUES IN ({turn_id})"
+        )
+
+
+def _drop_partition(conn, table_name: str, partition_name: str) -> None:
+    detach_pending = conn.execute(
+        text(
+            "SELECT inhdetachpending FROM pg_inherits"
+            " WHERE inhrelid = to_regclass(:name)"
+        ),
+        {"name": partition_name},
+    ).scalar_one_or_none()
+
+    if detach_pending is not None:
+        # When a concurrent detach has been interrupted, the partition
+        # remains in "detach pending" state, and the detach must be
+        # finalized.
+        mode = "FINALIZE" if detach_pending else "CONCURRENTLY"
+        conn.execute(
+            text(
+                f"ALTER TABLE {table_name}"
+                f" DETACH PARTITION {partition_name} {mode}"
+            )
+        )
+
+    conn.execute(text(f"DROP TABLE IF EXISTS {partition_name}"))
+
+
+def _connect_in_autocommit_mode():
+    return db.engines["solver"].connect().execution_options(
+        isolation_level="AUTOCOMMIT"
+    )
+
+
+def _execute(statement: str, **params) -> None:
+    db.session.execute(
+        text(statement),
+        params,
+        bind_arguments={"bind": db.engines["solver"]},
+    )
@@ -1,11 +1,12 @@
 from typing import TypeVar, Callable, Sequence, List, Iterable, Tuple
 from random import Random
 from datetime import datetime, timezone, timedelta
-from sqlalchemy import select, insert, delete, text
+from sqlalchemy import select, insert, text
 from sqlalchemy.sql.expression import null, and_
 from sqlalchemy.orm import load_only
 from swpt_trade.utils import can_start_new_turn
 from swpt_trade.extensions import db
+from swpt_trade.partitions import create_turn_partitions
 from swpt_trade.models import (
     TS0,
     Turn,
@@ -67,6 +68,8 @@ def start_new_turn_if_possible(
                 phase_deadline=current_ts + phase1_duration,
             )
             db.session.add(new_turn)
+            db.session.flush()
+            create_turn_partitions(new_turn.turn_id)
             return [new_turn]
 
     return unfinished_turns
@@ -142,32 +145,10 @@ def try_to_advance_turn_to_phase2(
         turn.phase_deadline = current_ts + phase2_duration
         turn.collection_deadline = current_ts + max_commit_period
 
-        # NOTE: When reaching turn phase 2, all records for the given
-        # turn from the `DebtorInfo` and `ConfirmedDebtor` tables will
-        # be deleted. This however, does not guarantee that a worker
-        # process will not continue to insert new rows for the given
-        # turn in these tables. Therefore, in order to ensure that
-        # such obsolete records will be deleted eventually, here we
-        # delete all records for which the turn phase 2 has been
-        # reached.
-        db.session.execute(
-            delete(DebtorInfo)
-            .where(
-                and_(
-                    Turn.turn_id == DebtorInfo.turn_id,
-                    Turn.phase >= 2,
-                )
-            )
-        )
-        db.session.execute(
-            delete(ConfirmedDebtor)
-            .where(
-                and_(
-                    Turn.turn_id == ConfirmedDebtor.turn_id,
-                    Turn.phase >= 2,
-                )
-            )
-        )
+        # NOTE: The partitions for the given turn of the `DebtorInfo`
+        # and `ConfirmedDebtor` tables are not needed anymore. They
+        # will be dropped by `drop_obsolete_turn_partitions`, outside
+        # of this transaction.
 
 
 @atomic
@@ -201,6 +182,12 @@ def try_to_advance_turn_to_phase4(turn_id: int) -> None:
             turn.phase = 4
             turn.phase_deadline = None
 
+            # NOTE: The partitions for the turn are empty now, but
+            # dropping them is still needed to get rid of their dead
+            # rows. They will be dropped by
+            # `drop_obsolete_turn_partitions`, outside of this
+            # transaction.
+
 
 @atomic
 def get_unfinished_turns() -> Sequence[Turn]:
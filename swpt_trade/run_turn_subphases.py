@@ -1,21 +1,48 @@
 import logging
 import math
+from array import array
+from itertools import chain
+from contextlib import closing
 from typing import TypeVar, Callable
 from datetime import datetime, timezone, timedelta
-from itertools import groupby
-from sqlalchemy import select, insert, delete, text
+from sqlalchemy import (
+    select,
+    insert,
+    delete,
+    text,
+    func,
+    literal,
+    cast,
+    union_all,
+    Integer,
+    BigInteger,
+    TIMESTAMP,
+)
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.sql.expression import null, false, and_
+from psycopg.errors import UniqueViolation, CheckViolation
 from flask import current_app
 from swpt_pythonlib.utils import ShardingRealm
 from swpt_trade.utils import (
     batched,
+    to_microseconds,
+    copy_binary,
+    copy_binary_to_connection,
+    copy_query_results,
+    sharding_realm_filter,
+    sharding_realm_hash_filter,
     u16_to_i16,
     contain_principal_overflow,
-    DispatchingData,
+    MAX_INT64,
+    iter_in_thread,
+    ThreadedConsumer,
 )
 from swpt_trade.extensions import db
-from swpt_trade.solver import CandidateOfferAuxData, BidProcessor
+from swpt_trade.solver import (
+    BidProcessor,
+    DispatchingStatuses,
+    encode_binary_copy,
+)
 from swpt_trade.models import (
     DebtorInfoDocument,
     DebtorLocatorClaim,
@@ -49,8 +76,67 @@ from swpt_trade.models import (
 
 INSERT_BATCH_SIZE = 50000
 SELECT_BATCH_SIZE = 50000
-BID_COUNTER_THRESHOLD = 100000
+PIPELINE_QUEUE_SIZE = 2
 DELETION_FLAG = WorkerAccount.CONFIG_SCHEDULED_FOR_DELETION_FLAG
+CANDIDATE_OFFER_COPY_COLUMNS = [
+    "turn_id",
+    "amount",
+    "debtor_id",
+    "creditor_id",
+    "account_creation_date",
+    "last_transfer_number",
+    "inserted_at",
+]
+WORKER_COLLECTING_COPY_COLUMNS = [
+    "collector_id",
+    "turn_id",
+    "debtor_id",
+    "creditor_id",
+    "amount",
+    "collected",
+    "purge_after",
+]
+WORKER_SENDING_COPY_COLUMNS = [
+    "from_collector_id",
+    "turn_id",
+    "debtor_id",
+    "to_collector_id",
+    "amount",
+    "purge_after",
+]
+WORKER_RECEIVING_COPY_COLUMNS = [
+    "to_collector_id",
+    "turn_id",
+    "debtor_id",
+    "from_collector_id",
+    "expected_amount",
+    "received_amount",
+    "purge_after",
+]
+WORKER_DISPATCHING_COPY_COLUMNS = [
+    "collector_id",
+    "turn_id",
+    "debtor_id",
+    "creditor_id",
+    "amount",
+    "purge_after",
+]
+DISPATCHING_STATUS_COPY_COLUMNS = [
+    "collector_id",
+    "turn_id",
+    "debtor_id",
+    "inserted_at",
+    "amount_to_collect",
+    "amount_to_send",
+    "started_sending",
+    "all_sent",
+    "amount_to_receive",
+    "number_to_receive",
+    "all_received",
+    "amount_to_dispatch",
+    "started_dispatching",
+    "awaiting_signal_flag",
+]
 
 
 T = TypeVar("T")
@@ -84,6 +170,28 @@ def run_phase1_subphase0(turn_id: int) -> None:
 def _populate_debtor_infos(w_conn, s_conn, turn_id):
     sharding_realm: ShardingRealm = current_app.config["SHARDING_REALM"]
 
+    if current_app.config["UPLOAD_WITH_COPY_PIPE"]:
+        return _copy_through_pipe(
+            w_conn,
+            s_conn,
+            DebtorInfo,
+            select(
+                literal(turn_id, Integer).label("turn_id"),
+                DebtorInfoDocument.debtor_info_locator,
+                DebtorInfoDocument.debtor_id,
+                DebtorInfoDocument.peg_debtor_info_locator,
+                DebtorInfoDocument.peg_debtor_id,
+                DebtorInfoDocument.peg_exchange_rate,
+            )
+            .where(
+                sharding_realm_hash_filter(
+                    DebtorInfoDocument.debtor_info_locator_hash,
+                    sharding_realm,
+                )
+            ),
+            turn_id,
+        )
+
     with w_conn.execution_options(yield_per=SELECT_BATCH_SIZE).execute(
             select(
                 DebtorInfoDocument.debtor_info_locator,
@@ -92,6 +200,12 @@ def _populate_debtor_infos(w_conn, s_conn, turn_id):
                 DebtorInfoDocument.peg_debtor_id,
                 DebtorInfoDocument.peg_exchange_rate,
             )
+            .where(
+                sharding_realm_hash_filter(
+                    DebtorInfoDocument.debtor_info_locator_hash,
+                    sharding_realm,
+                )
+            )
     ) as result:
         for rows in batched(result, INSERT_BATCH_SIZE):
             dicts_to_insert = [
@@ -104,7 +218,6 @@ def _populate_debtor_infos(w_conn, s_conn, turn_id):
                     "peg_exchange_rate": row.peg_exchange_rate,
                 }
                 for row in rows
-                if sharding_realm.match_str(row.debtor_info_locator)
             ]
             if dicts_to_insert:
                 try:
@@ -118,7 +231,8 @@ def _populate_debtor_infos(w_conn, s_conn, turn_id):
                     logger = logging.getLogger(__name__)
                     logger.warning(
                         "An attempt has been made to insert an already"
-                        " existing debtor info row for turn %d.",
+                        " existing debtor info row for turn %d, or the"
+                        " turn's partition has been dropped.",
                         turn_id,
                     )
                     s_conn.rollback()
@@ -130,12 +244,40 @@ def _populate_debtor_infos(w_conn, s_conn, turn_id):
 def _populate_confirmed_debtors(w_conn, s_conn, turn_id):
     sharding_realm: ShardingRealm = current_app.config["SHARDING_REALM"]
 
+    if current_app.config["UPLOAD_WITH_COPY_PIPE"]:
+        return _copy_through_pipe(
+            w_conn,
+            s_conn,
+            ConfirmedDebtor,
+            select(
+                literal(turn_id, Integer).label("turn_id"),
+                DebtorLocatorClaim.debtor_id,
+                DebtorLocatorClaim.debtor_info_locator,
+            )
+            .where(
+                and_(
+                    DebtorLocatorClaim.debtor_info_locator != null(),
+                    sharding_realm_hash_filter(
+                        DebtorLocatorClaim.debtor_hash, sharding_realm
+                    ),
+                )
+            ),
+            turn_id,
+        )
+
     with w_conn.execution_options(yield_per=SELECT_BATCH_SIZE).execute(
             select(
                 DebtorLocatorClaim.debtor_id,
                 DebtorLocatorClaim.debtor_info_locator,
             )
-            .where(DebtorLocatorClaim.debtor_info_locator != null())
+            .where(
+                and_(
+                    DebtorLocatorClaim.debtor_info_locator != null(),
+                    sharding_realm_hash_filter(
+                        DebtorLocatorClaim.debtor_hash, sharding_realm
+                    ),
+                )
+            )
     ) as result:
         for rows in batched(result, INSERT_BATCH_SIZE):
             dicts_to_insert = [
@@ -145,7 +287,6 @@ def _populate_confirmed_debtors(w_conn, s_conn, turn_id):
                     "debtor_id": row.debtor_id,
                 }
                 for row in rows
-                if sharding_realm.match(row.debtor_id)
             ]
             if dicts_to_insert:
                 try:
@@ -159,7 +300,8 @@ def _populate_confirmed_debtors(w_conn, s_conn, turn_id):
                     logger = logging.getLogger(__name__)
                     logger.warning(
                         "An attempt has been made to insert an already"
-                        " existing confirmed debtor row for turn %d.",
+                        " existing confirmed debtor row for turn %d, or the"
+                        " turn's partition has been dropped.",
                         turn_id,
                     )
                     s_conn.rollback()
@@ -198,6 +340,13 @@ def run_phase2_subphase0(turn_id: int) -> None:
 
 def _load_currencies(bp: BidProcessor, turn_id: int) -> None:
     with db.engines["solver"].connect() as s_conn:
+        bp.reserve_currencies(
+            s_conn.execute(
+                select(func.count())
+                .select_from(CurrencyInfo)
+                .where(CurrencyInfo.turn_id == turn_id)
+            ).scalar_one()
+        )
         with s_conn.execution_options(yield_per=SELECT_BATCH_SIZE).execute(
                 select(
                     CurrencyInfo.is_confirmed,
@@ -217,62 +366,97 @@ def _load_currencies(bp: BidProcessor, turn_id: int) -> None:
 
 
 def _generate_candidate_offers(bp, turn_id):
+    # This is a pipeline of three stages, connected by bounded queues:
+    # a reader thread fetches and decodes the trading policies, the
+    # current thread analyzes the bids, and a writer thread writes the
+    # candidate offers. This way the database I/O overlaps with the
+    # analysis. Note that the writer thread uses the connection of the
+    # current session, so that the candidate offers are written in the
+    # current transaction. Therefore, the session must not be used
+    # until the writer thread has finished.
     current_ts = datetime.now(tz=timezone.utc)
+    inserted_at = to_microseconds(current_ts)
     sharding_realm: ShardingRealm = current_app.config["SHARDING_REALM"]
-    bid_counter = 0
+    w_engine = db.engine
+    s_connection = db.session.connection(
+        bind_arguments={"mapper": CandidateOfferSignal}
+    )
 
-    with db.engine.connect() as w_conn:
-        with w_conn.execution_options(yield_per=SELECT_BATCH_SIZE).execute(
-                select(
-                    TradingPolicy.creditor_id,
-                    TradingPolicy.debtor_id,
-                    TradingPolicy.creation_date,
-                    TradingPolicy.principal,
-                    TradingPolicy.last_transfer_number,
-                    TradingPolicy.min_principal,
-                    TradingPolicy.max_principal,
-                    TradingPolicy.peg_debtor_id,
-                    TradingPolicy.peg_exchange_rate,
-                    and_(
-                        TradingPolicy.account_id != "",
-                        TradingPolicy.account_id_is_obsolete == false(),
-                    ).label("has_account_id"),
-                    (
-                        TradingPolicy.config_flags.op("&")(DELETION_FLAG) != 0
-                    ).label("is_scheduled_for_deletion"),
-                    (
-                        TradingPolicy.policy_name != null()
-                    ).label("wants_to_trade"),
-                )
-                .order_by(TradingPolicy.creditor_id)
-        ) as result:
-            for creditor_id, rows in groupby(result, lambda r: r.creditor_id):
-                if sharding_realm.match(creditor_id):
-                    for row in rows:
-                        assert row.creditor_id == creditor_id
-                        rate = row.peg_exchange_rate
-
-                        bp.register_bid(
-                            creditor_id,
+    def read_bids():
+        with w_engine.connect() as w_conn:
+            with w_conn.execution_options(yield_per=SELECT_BATCH_SIZE).execute(
+                    select(
+                        TradingPolicy.creditor_id,
+                        TradingPolicy.debtor_id,
+                        TradingPolicy.creation_date,
+                        TradingPolicy.principal,
+                        TradingPolicy.last_transfer_number,
+                        TradingPolicy.min_principal,
+                        TradingPolicy.max_principal,
+                        TradingPolicy.peg_debtor_id,
+                        TradingPolicy.peg_exchange_rate,
+                        and_(
+                            TradingPolicy.account_id != "",
+                            TradingPolicy.account_id_is_obsolete == false(),
+                        ).label("has_account_id"),
+                        (
+                            TradingPolicy.config_flags.op("&")(DELETION_FLAG)
+                            != 0
+                        ).label("is_scheduled_for_deletion"),
+                        (
+                            TradingPolicy.policy_name != null()
+                        ).label("wants_to_trade"),
+                    )
+                    .where(
+                        sharding_realm_hash_filter(
+                            TradingPolicy.creditor_hash, sharding_realm
+                        )
+                    )
+                    # Ordering by `creditor_hash` first keeps the bids
+                    # of each trader together, and allows the rows to
+                    # be read with a range scan over the creditor hash
+                    # index.
+                    .order_by(
+                        TradingPolicy.creditor_hash,
+                        TradingPolicy.creditor_id,
+                    )
+            ) as result:
+                for rows in result.partitions():
+                    yield [
+                        (
+                            row.creditor_id,
                             row.debtor_id,
                             _calc_bid_amount(row),
                             row.peg_debtor_id or 0,
-                            math.nan if rate is None else rate,
-                            CandidateOfferAuxData(
-                                creation_date=row.creation_date,
-                                last_transfer_number=row.last_transfer_number,
-                            ),
+                            math.nan if row.peg_exchange_rate is None
+                            else row.peg_exchange_rate,
+                            row.creation_date,
+                            row.last_transfer_number,
                         )
-                        bid_counter += 1
-
-                    # Process the registered bids when they become too
-                    # many, so that they can not use up the available
-                    # memory.
-                    if bid_counter >= BID_COUNTER_THRESHOLD:
-                        _process_bids(bp, turn_id, current_ts)
-                        bid_counter = 0
+                        for row in rows
+                    ]
+
+    def write_offers(columns):
+        # The candidate offers are written with PostgreSQL's binary
+        # `COPY`, without creating Python objects for them.
+        copy_binary_to_connection(
+            s_connection,
+            CandidateOfferSignal,
+            CANDIDATE_OFFER_COPY_COLUMNS,
+            encode_binary_copy((turn_id, *columns, inserted_at), "hqqqDqT"),
+        )
 
-            _process_bids(bp, turn_id, current_ts)
+    # The bids of each trader are analyzed as soon as all of them have
+    # been received, so that the memory consumption does not depend on
+    # the number of traders.
+    with (
+            closing(iter_in_thread(read_bids, PIPELINE_QUEUE_SIZE)) as reader,
+            ThreadedConsumer(write_offers, PIPELINE_QUEUE_SIZE) as writer,
+    ):
+        for columns in bp.candidate_offer_columns_iter(
+                chain.from_iterable(reader), INSERT_BATCH_SIZE
+        ):
+            writer.put(columns)
 
 
 def _calc_bid_amount(row) -> int:
@@ -294,27 +478,6 @@ def _calc_bid_amount(row) -> int:
     return contain_principal_overflow(row.max_principal - row.principal)
 
 
-def _process_bids(bp: BidProcessor, turn_id: int, ts: datetime) -> None:
-    for candidate_offers in batched(bp.analyze_bids(), INSERT_BATCH_SIZE):
-        db.session.execute(
-            insert(CandidateOfferSignal).execution_options(
-                insertmanyvalues_page_size=INSERT_BATCH_SIZE
-            ),
-            [
-                {
-                    "turn_id": turn_id,
-                    "amount": o.amount,
-                    "debtor_id": o.debtor_id,
-                    "creditor_id": o.creditor_id,
-                    "account_creation_date": o.aux_data.creation_date,
-                    "last_transfer_number": o.aux_data.last_transfer_number,
-                    "inserted_at": ts,
-                }
-                for o in candidate_offers
-            ],
-        )
-
-
 def _copy_active_collectors(bp: BidProcessor) -> None:
     with db.engines["solver"].connect() as s_conn:
         db.session.execute(
@@ -399,6 +562,33 @@ def run_phase2_subphase5(turn_id: int) -> None:
 def _populate_sell_offers(w_conn, s_conn, turn_id):
     sharding_realm: ShardingRealm = current_app.config["SHARDING_REALM"]
 
+    if current_app.config["UPLOAD_WITH_COPY_PIPE"]:
+        return _copy_through_pipe(
+            w_conn,
+            s_conn,
+            SellOffer,
+            select(
+                literal(turn_id, Integer).label("turn_id"),
+                AccountLock.creditor_id,
+                AccountLock.debtor_id,
+                (-AccountLock.amount).label("amount"),
+                AccountLock.collector_id,
+            )
+            .where(
+                and_(
+                    AccountLock.turn_id == turn_id,
+                    AccountLock.released_at == null(),
+                    AccountLock.transfer_id != null(),
+                    AccountLock.finalized_at == null(),
+                    AccountLock.amount < 0,
+                    sharding_realm_filter(
+                        AccountLock.creditor_id, sharding_realm
+                    ),
+                )
+            ),
+            turn_id,
+        )
+
     with w_conn.execution_options(yield_per=SELECT_BATCH_SIZE).execute(
             select(
                 AccountLock.creditor_id,
@@ -413,6 +603,9 @@ def _populate_sell_offers(w_conn, s_conn, turn_id):
                     AccountLock.transfer_id != null(),
                     AccountLock.finalized_at == null(),
                     AccountLock.amount < 0,
+                    sharding_realm_filter(
+                        AccountLock.creditor_id, sharding_realm
+                    ),
                 )
             )
     ) as result:
@@ -426,7 +619,6 @@ def _populate_sell_offers(w_conn, s_conn, turn_id):
                     "collector_id": row.collector_id,
                 }
                 for row in rows
-                if sharding_realm.match(row.creditor_id)
             ]
             if dicts_to_insert:
                 try:
@@ -440,7 +632,8 @@ def _populate_sell_offers(w_conn, s_conn, turn_id):
                     logger = logging.getLogger(__name__)
                     logger.warning(
                         "An attempt has been made to insert an already"
-                        " existing sell offer row for turn %d.",
+                        " existing sell offer row for turn %d, or the"
+                        " turn's partition has been dropped.",
                         turn_id,
                     )
                     s_conn.rollback()
@@ -452,6 +645,32 @@ def _populate_sell_offers(w_conn, s_conn, turn_id):
 def _populate_buy_offers(w_conn, s_conn, turn_id):
     sharding_realm: ShardingRealm = current_app.config["SHARDING_REALM"]
 
+    if current_app.config["UPLOAD_WITH_COPY_PIPE"]:
+        return _copy_through_pipe(
+            w_conn,
+            s_conn,
+            BuyOffer,
+            select(
+                literal(turn_id, Integer).label("turn_id"),
+                AccountLock.creditor_id,
+                AccountLock.debtor_id,
+                AccountLock.amount,
+            )
+            .where(
+                and_(
+                    AccountLock.turn_id == turn_id,
+                    AccountLock.released_at == null(),
+                    AccountLock.transfer_id != null(),
+                    AccountLock.finalized_at == null(),
+                    AccountLock.amount > 0,
+                    sharding_realm_filter(
+                        AccountLock.creditor_id, sharding_realm
+                    ),
+                )
+            ),
+            turn_id,
+        )
+
     with w_conn.execution_options(yield_per=SELECT_BATCH_SIZE).execute(
             select(
                 AccountLock.creditor_id,
@@ -465,6 +684,9 @@ def _populate_buy_offers(w_conn, s_conn, turn_id):
                     AccountLock.transfer_id != null(),
                     AccountLock.finalized_at == null(),
                     AccountLock.amount > 0,
+                    sharding_realm_filter(
+                        AccountLock.creditor_id, sharding_realm
+                    ),
                 )
             )
     ) as result:
@@ -477,7 +699,6 @@ def _populate_buy_offers(w_conn, s_conn, turn_id):
                     "amount": row.amount,
                 }
                 for row in rows
-                if sharding_realm.match(row.creditor_id)
             ]
             if dicts_to_insert:
                 try:
@@ -491,7 +712,8 @@ def _populate_buy_offers(w_conn, s_conn, turn_id):
                     logger = logging.getLogger(__name__)
                     logger.warning(
                         "An attempt has been made to insert an already"
-                        " existing buy offer row for turn %d.",
+                        " existing buy offer row for turn %d, or the"
+                        " turn's partition has been dropped.",
                         turn_id,
                     )
                     s_conn.rollback()
@@ -500,6 +722,25 @@ def _populate_buy_offers(w_conn, s_conn, turn_id):
             s_conn.commit()
 
 
+def _copy_through_pipe(w_conn, s_conn, model, query, turn_id):
+    # The rows are streamed directly from the worker's database to the
+    # solver's database, and are filtered by the worker's database
+    # server. This is much faster than inserting them one by one.
+    try:
+        with s_conn.begin():
+            copy_query_results(w_conn, query, s_conn, model)
+    except (UniqueViolation, CheckViolation):
+        # NOTE: A `CheckViolation` error is raised when the turn's
+        # partition has been dropped already.
+        logger = logging.getLogger(__name__)
+        logger.warning(
+            "An attempt has been made to insert already existing %s rows"
+            " for turn %d, or the turn's partition has been dropped.",
+            model.__table__.name,
+            turn_id,
+        )
+
+
 @atomic
 def run_phase3_subphase0(turn_id: int) -> None:
     worker_turn = (
@@ -513,7 +754,15 @@ def run_phase3_subphase0(turn_id: int) -> None:
         .one_or_none()
     )
     if worker_turn:
-        statuses = DispatchingData(worker_turn.turn_id)
+        # When the dispatching statuses are calculated by the
+        # database, there is no need to aggregate them here.
+        aggregate_in_sql = current_app.config[
+            "AGGREGATE_DISPATCHING_STATUSES_IN_SQL"
+        ]
+        statuses = (
+            None if aggregate_in_sql
+            else DispatchingStatuses(worker_turn.turn_id)
+        )
 
         with db.engines["solver"].connect() as s_conn:
             _copy_creditor_takings(s_conn, worker_turn)
@@ -522,7 +771,10 @@ def run_phase3_subphase0(turn_id: int) -> None:
             _copy_collector_sendings(s_conn, worker_turn, statuses)
             _copy_collector_receivings(s_conn, worker_turn, statuses)
             _copy_collector_dispatchings(s_conn, worker_turn, statuses)
-            _create_dispatching_statuses(worker_turn, statuses)
+            if aggregate_in_sql:
+                _create_dispatching_statuses_in_sql(worker_turn)
+            else:
+                _create_dispatching_statuses(worker_turn, statuses)
             _insert_revise_account_lock_signals(worker_turn)
 
         worker_turn.worker_turn_subphase = 5
@@ -616,7 +868,7 @@ def _copy_creditor_givings(s_conn, worker_turn):
 def _copy_collector_collectings(s_conn, worker_turn, statuses):
     turn_id = worker_turn.turn_id
     cfg = current_app.config
-    purge_after = (
+    purge_after = to_microseconds(
         worker_turn.collection_deadline
         + timedelta(days=cfg["APP_WORKER_COLLECTING_SLACK_DAYS"])
     )
@@ -626,11 +878,10 @@ def _copy_collector_collectings(s_conn, worker_turn, statuses):
 
     with s_conn.execution_options(yield_per=SELECT_BATCH_SIZE).execute(
             select(
-                CollectorCollecting.turn_id,
+                CollectorCollecting.collector_id,
                 CollectorCollecting.debtor_id,
                 CollectorCollecting.creditor_id,
                 CollectorCollecting.amount,
-                CollectorCollecting.collector_id,
             )
             .where(
                 and_(
@@ -643,38 +894,36 @@ def _copy_collector_collectings(s_conn, worker_turn, statuses):
             )
     ) as result:
         for rows in batched(result, INSERT_BATCH_SIZE):
-            dicts_to_insert = [
-                {
-                    "collector_id": row.collector_id,
-                    "turn_id": turn_id,
-                    "debtor_id": row.debtor_id,
-                    "creditor_id": row.creditor_id,
-                    "amount": row.amount,
-                    "collected": False,
-                    "purge_after": purge_after,
-                }
-                for row in rows
-            ]
-            if dicts_to_insert:
-                db.session.execute(
-                    insert(WorkerCollecting).execution_options(
-                        insertmanyvalues_page_size=INSERT_BATCH_SIZE
+            collector_ids, debtor_ids, creditor_ids, amounts = (
+                _to_i64_columns(rows)
+            )
+            copy_binary(
+                db.session,
+                WorkerCollecting,
+                WORKER_COLLECTING_COPY_COLUMNS,
+                encode_binary_copy(
+                    (
+                        collector_ids,
+                        turn_id,
+                        debtor_ids,
+                        creditor_ids,
+                        amounts,
+                        False,  # collected
+                        purge_after,
                     ),
-                    dicts_to_insert,
+                    "qiqqq?T",
+                ),
+            )
+            if statuses is not None:
+                statuses.register_collecting_bulk(
+                    collector_ids, debtor_ids, amounts
                 )
-                for d in dicts_to_insert:
-                    statuses.register_collecting(
-                        d["collector_id"],
-                        d["turn_id"],
-                        d["debtor_id"],
-                        d["amount"],
-                    )
 
 
 def _copy_collector_sendings(s_conn, worker_turn, statuses):
     turn_id = worker_turn.turn_id
     cfg = current_app.config
-    purge_after = (
+    purge_after = to_microseconds(
         worker_turn.collection_deadline
         + timedelta(days=cfg["APP_WORKER_SENDING_SLACK_DAYS"])
     )
@@ -684,9 +933,8 @@ def _copy_collector_sendings(s_conn, worker_turn, statuses):
 
     with s_conn.execution_options(yield_per=SELECT_BATCH_SIZE).execute(
             select(
-                CollectorSending.turn_id,
-                CollectorSending.debtor_id,
                 CollectorSending.from_collector_id,
+                CollectorSending.debtor_id,
                 CollectorSending.to_collector_id,
                 CollectorSending.amount,
             )
@@ -700,37 +948,35 @@ def _copy_collector_sendings(s_conn, worker_turn, statuses):
             )
     ) as result:
         for rows in batched(result, INSERT_BATCH_SIZE):
-            dicts_to_insert = [
-                {
-                    "from_collector_id": row.from_collector_id,
-                    "turn_id": turn_id,
-                    "debtor_id": row.debtor_id,
-                    "to_collector_id": row.to_collector_id,
-                    "amount": row.amount,
-                    "purge_after": purge_after,
-                }
-                for row in rows
-            ]
-            if dicts_to_insert:
-                db.session.execute(
-                    insert(WorkerSending).execution_options(
-                        insertmanyvalues_page_size=INSERT_BATCH_SIZE
+            from_collector_ids, debtor_ids, to_collector_ids, amounts = (
+                _to_i64_columns(rows)
+            )
+            copy_binary(
+                db.session,
+                WorkerSending,
+                WORKER_SENDING_COPY_COLUMNS,
+                encode_binary_copy(
+                    (
+                        from_collector_ids,
+                        turn_id,
+                        debtor_ids,
+                        to_collector_ids,
+                        amounts,
+                        purge_after,
                     ),
-                    dicts_to_insert,
+                    "qiqqqT",
+                ),
+            )
+            if statuses is not None:
+                statuses.register_sending_bulk(
+                    from_collector_ids, debtor_ids, amounts
                 )
-                for d in dicts_to_insert:
-                    statuses.register_sending(
-                        d["from_collector_id"],
-                        d["turn_id"],
-                        d["debtor_id"],
-                        d["amount"],
-                    )
 
 
 def _copy_collector_receivings(s_conn, worker_turn, statuses):
     turn_id = worker_turn.turn_id
     cfg = current_app.config
-    purge_after = (
+    purge_after = to_microseconds(
         worker_turn.collection_deadline
         + timedelta(days=cfg["APP_WORKER_SENDING_SLACK_DAYS"])
     )
@@ -740,9 +986,8 @@ def _copy_collector_receivings(s_conn, worker_turn, statuses):
 
     with s_conn.execution_options(yield_per=SELECT_BATCH_SIZE).execute(
             select(
-                CollectorReceiving.turn_id,
-                CollectorReceiving.debtor_id,
                 CollectorReceiving.to_collector_id,
+                CollectorReceiving.debtor_id,
                 CollectorReceiving.from_collector_id,
                 CollectorReceiving.amount,
             )
@@ -756,38 +1001,36 @@ def _copy_collector_receivings(s_conn, worker_turn, statuses):
             )
     ) as result:
         for rows in batched(result, INSERT_BATCH_SIZE):
-            dicts_to_insert = [
-                {
-                    "to_collector_id": row.to_collector_id,
-                    "turn_id": turn_id,
-                    "debtor_id": row.debtor_id,
-                    "from_collector_id": row.from_collector_id,
-                    "expected_amount": row.amount,
-                    "received_amount": 0,
-                    "purge_after": purge_after,
-                }
-                for row in rows
-            ]
-            if dicts_to_insert:
-                db.session.execute(
-                    insert(WorkerReceiving).execution_options(
-                        insertmanyvalues_page_size=INSERT_BATCH_SIZE
+            to_collector_ids, debtor_ids, from_collector_ids, amounts = (
+                _to_i64_columns(rows)
+            )
+            copy_binary(
+                db.session,
+                WorkerReceiving,
+                WORKER_RECEIVING_COPY_COLUMNS,
+                encode_binary_copy(
+                    (
+                        to_collector_ids,
+                        turn_id,
+                        debtor_ids,
+                        from_collector_ids,
+                        amounts,  # expected_amount
+                        0,  # received_amount
+                        purge_after,
                     ),
-                    dicts_to_insert,
+                    "qiqqqqT",
+                ),
+            )
+            if statuses is not None:
+                statuses.register_receiving_bulk(
+                    to_collector_ids, debtor_ids, amounts
                 )
-                for d in dicts_to_insert:
-                    statuses.register_receiving(
-                        d["to_collector_id"],
-                        d["turn_id"],
-                        d["debtor_id"],
-                        d["expected_amount"],
-                    )
 
 
 def _copy_collector_dispatchings(s_conn, worker_turn, statuses):
     turn_id = worker_turn.turn_id
     cfg = current_app.config
-    purge_after = (
+    purge_after = to_microseconds(
         worker_turn.collection_deadline
         + timedelta(days=cfg["APP_WORKER_DISPATCHING_SLACK_DAYS"])
     )
@@ -797,11 +1040,10 @@ def _copy_collector_dispatchings(s_conn, worker_turn, statuses):
 
     with s_conn.execution_options(yield_per=SELECT_BATCH_SIZE).execute(
             select(
-                CollectorDispatching.turn_id,
+                CollectorDispatching.collector_id,
                 CollectorDispatching.debtor_id,
                 CollectorDispatching.creditor_id,
                 CollectorDispatching.amount,
-                CollectorDispatching.collector_id,
             )
             .where(
                 and_(
@@ -815,44 +1057,163 @@ def _copy_collector_dispatchings(s_conn, worker_turn, statuses):
             )
     ) as result:
         for rows in batched(result, INSERT_BATCH_SIZE):
-            dicts_to_insert = [
-                {
-                    "collector_id": row.collector_id,
-                    "turn_id": turn_id,
-                    "debtor_id": row.debtor_id,
-                    "creditor_id": row.creditor_id,
-                    "amount": row.amount,
-                    "purge_after": purge_after,
-                }
-                for row in rows
-            ]
-            if dicts_to_insert:
-                db.session.execute(
-                    insert(WorkerDispatching).execution_options(
-                        insertmanyvalues_page_size=INSERT_BATCH_SIZE
+            collector_ids, debtor_ids, creditor_ids, amounts = (
+                _to_i64_columns(rows)
+            )
+            copy_binary(
+                db.session,
+                WorkerDispatching,
+                WORKER_DISPATCHING_COPY_COLUMNS,
+                encode_binary_copy(
+                    (
+                        collector_ids,
+                        turn_id,
+                        debtor_ids,
+                        creditor_ids,
+                        amounts,
+                        purge_after,
                     ),
-                    dicts_to_insert,
+                    "qiqqqT",
+                ),
+            )
+            if statuses is not None:
+                statuses.register_dispatching_bulk(
+                    collector_ids, debtor_ids, amounts
                 )
-                for d in dicts_to_insert:
-                    statuses.register_dispatching(
-                        d["collector_id"],
-                        d["turn_id"],
-                        d["debtor_id"],
-                        d["amount"],
-                    )
 
 
-def _create_dispatching_statuses(worker_turn, statuses):
-    for status_dicts in batched(statuses.statuses_iter(), INSERT_BATCH_SIZE):
-        dicts_to_insert = list(status_dicts)
+def _to_i64_columns(rows):
+    # Transposes the rows (each of which must contain only BIGINT
+    # values) into columns, so that every column is built only once,
+    # and can be passed both to `encode_binary_copy` and to the
+    # `DispatchingStatuses.register_*_bulk` methods.
+    return [array("q", column) for column in zip(*rows)]
 
-        if dicts_to_insert:
-            db.session.execute(
-                insert(DispatchingStatus).execution_options(
-                    insertmanyvalues_page_size=INSERT_BATCH_SIZE
+
+def _create_dispatching_statuses(worker_turn, statuses):
+    turn_id = worker_turn.turn_id
+    inserted_at = to_microseconds(datetime.now(tz=timezone.utc))
+
+    for (
+            collector_ids,
+            debtor_ids,
+            amounts_to_collect,
+            amounts_to_send,
+            amounts_to_receive,
+            numbers_to_receive,
+            amounts_to_dispatch,
+    ) in statuses.statuses_iter(INSERT_BATCH_SIZE):
+        # The columns which are not written (`total_collected_amount`
+        # and `total_received_amount`) will be NULL.
+        copy_binary(
+            db.session,
+            DispatchingStatus,
+            DISPATCHING_STATUS_COPY_COLUMNS,
+            encode_binary_copy(
+                (
+                    collector_ids,
+                    turn_id,
+                    debtor_ids,
+                    inserted_at,
+                    amounts_to_collect,
+                    amounts_to_send,
+                    False,  # started_sending
+                    False,  # all_sent
+                    amounts_to_receive,
+                    numbers_to_receive,
+                    False,  # all_received
+                    amounts_to_dispatch,
+                    False,  # started_dispatching
+                    False,  # awaiting_signal_flag
                 ),
-                dicts_to_insert,
+                "qiqTqq??qi?q??",
+            ),
+        )
+
+
+def _create_dispatching_statuses_in_sql(worker_turn):
+    turn_id = worker_turn.turn_id
+    current_ts = datetime.now(tz=timezone.utc)
+    zero = literal(0, BigInteger)
+
+    # Each row of this union contributes to exactly one of the
+    # aggregated amounts. (Note that the turn's rows in the worker
+    # tables have just been inserted, and all of them belong to
+    # this shard.)
+    parts = union_all(
+        select(
+            WorkerCollecting.collector_id.label("collector_id"),
+            WorkerCollecting.debtor_id.label("debtor_id"),
+            WorkerCollecting.amount.label("amount_to_collect"),
+            zero.label("amount_to_send"),
+            zero.label("amount_to_receive"),
+            zero.label("number_to_receive"),
+            zero.label("amount_to_dispatch"),
+        )
+        .where(WorkerCollecting.turn_id == turn_id),
+        select(
+            WorkerSending.from_collector_id,
+            WorkerSending.debtor_id,
+            zero,
+            WorkerSending.amount,
+            zero,
+            zero,
+            zero,
+        )
+        .where(WorkerSending.turn_id == turn_id),
+        select(
+            WorkerReceiving.to_collector_id,
+            WorkerReceiving.debtor_id,
+            zero,
+            zero,
+            WorkerReceiving.expected_amount,
+            literal(1, BigInteger),
+            zero,
+        )
+        .where(WorkerReceiving.turn_id == turn_id),
+        select(
+            WorkerDispatching.collector_id,
+            WorkerDispatching.debtor_id,
+            zero,
+            zero,
+            zero,
+            zero,
+            WorkerDispatching.amount,
+        )
+        .where(WorkerDispatching.turn_id == turn_id),
+    ).subquery()
+
+    def contained_sum(column):
+        # The same as `contain_principal_overflow(sum(column))`.
+        return cast(
+            func.least(
+                func.greatest(func.sum(column), -MAX_INT64), MAX_INT64
+            ),
+            BigInteger,
+        )
+
+    db.session.execute(
+        insert(DispatchingStatus).from_select(
+            DISPATCHING_STATUS_COPY_COLUMNS,
+            select(
+                parts.c.collector_id,
+                literal(turn_id, Integer),
+                parts.c.debtor_id,
+                literal(current_ts, TIMESTAMP(timezone=True)),
+                contained_sum(parts.c.amount_to_collect),
+                contained_sum(parts.c.amount_to_send),
+                false(),
+                false(),
+                contained_sum(parts.c.amount_to_receive),
+                cast(func.sum(parts.c.number_to_receive), Integer),
+                false(),
+                contained_sum(parts.c.amount_to_dispatch),
+                false(),
+                false(),
             )
+            .group_by(parts.c.collector_id, parts.c.debtor_id)
+        )
+    )
 
 
 def _insert_revise_account_lock_signals(worker_turn):
@@ -866,7 +1227,14 @@ def _insert_revise_account_lock_signals(worker_turn):
                     AccountLock.creditor_id,
                     AccountLock.debtor_id,
                 )
-                .where(AccountLock.turn_id == turn_id)
+                .where(
+                    and_(
+                        AccountLock.turn_id == turn_id,
+                        sharding_realm_filter(
+                            AccountLock.creditor_id, sharding_realm
+                        ),
+                    )
+                )
         ) as result:
             for rows in batched(result, INSERT_BATCH_SIZE):
                 dicts_to_insert = [
@@ -877,7 +1245,6 @@ def _insert_revise_account_lock_signals(worker_turn):
                         "inserted_at": current_ts,
                     }
                     for row in rows
-                    if sharding_realm.match(row.creditor_id)
                 ]
                 if dicts_to_insert:
                     db.session.execute(
@@ -1,6 +1,20 @@
-from typing import TypeVar, Callable
+import os
+import json
+import time
+import logging
+import struct
+import hashlib
+import resource
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import (
+    TypeVar, Callable, Optional, Tuple, List, BinaryIO, Iterator
+)
+from array import array
 from datetime import datetime, timezone
-from sqlalchemy import select, insert, delete
+from itertools import islice
+from sqlalchemy import select, delete, func
 from sqlalchemy.sql.expression import and_
 from swpt_trade.extensions import db
 from swpt_trade.models import (
@@ -15,35 +29,149 @@ from swpt_trade.models import (
     CollectorCollecting,
     CreditorGiving,
     CreditorTaking,
+    TurnCommitProgress,
+)
+from swpt_trade.solver import (
+    Solver,
+    ENGINE_DFS,
+    encode_binary_copy,
+    calc_hashes,
+)
+from swpt_trade.utils import batched, copy_binary
+from swpt_trade.partitions import (
+    STAGED_MODELS,
+    get_partition_name,
+    create_staging_partitions,
+    attach_staging_partitions,
 )
-from swpt_trade.solver import Solver
-from swpt_trade.utils import batched, calc_hash
 
 INSERT_BATCH_SIZE = 50000
 SELECT_BATCH_SIZE = 50000
+CURRENCY_PRICES_SNAPSHOT_FILENAME = "currency_prices.snapshot"
+CURRENCY_PRICES_SNAPSHOT_MAGIC = b"SWPTCP01"
+SOLVER_CHECKPOINT_MAGIC = b"SWPTSC01"
+CURRENCY_INFO_STRUCT = struct.Struct("<?q?qdII")
+RESULT_STREAM_NAMES = ["takings", "collector_transfers", "givings"]
+METRICS_PREFIX = "swpt_solver"
 
 
 T = TypeVar("T")
 atomic: Callable[[T], T] = db.atomic
 
 
-def try_to_advance_turn_to_phase3(turn: Turn) -> None:
+def try_to_advance_turn_to_phase3(
+        turn: Turn,
+        num_threads: int = 1,
+        cache_dir: str = "",
+        engine: str = ENGINE_DFS,
+        spill_dir: str = "",
+        spill_memory_limit: int = 268435456,
+        preferred_cycle_length: int = 0,
+        load_threads: int = 1,
+        checkpoint_dir: str = "",
+        metrics_file: str = "",
+) -> None:
     turn_id = turn.turn_id
+    checkpoint_path = (
+        os.path.join(checkpoint_dir, f"turn-{turn_id}.checkpoint")
+        if checkpoint_dir
+        else ""
+    )
+    if _are_solver_results_written(turn_id):
+        # All solver results have been written already, but the turn
+        # has not been advanced to phase 3 (the process has probably
+        # crashed), so there is no need to solve the turn again.
+        _try_to_commit_solver_results(turn_id)
+        _remove_solver_checkpoint(checkpoint_path)
+        return
+
+    timings = {}
     solver = Solver(
         turn.base_debtor_info_locator,
         turn.base_debtor_id,
         turn.max_distance_to_base,
         turn.min_trade_amount,
+        num_threads,
+        engine,
+        spill_dir,
+        spill_memory_limit,
+        preferred_cycle_length,
     )
-    _register_currencies(solver, turn_id)
-    _register_collector_accounts(solver, turn_id)
-    solver.analyze_currencies()
+    checkpoint_file = None
+    if checkpoint_path:
+        fingerprint = _calc_solver_checkpoint_fingerprint(turn)
+        if _has_commit_progress(turn_id):
+            # The writing of the solver results has been started by
+            # a previous (crashed) attempt to solve the turn. If the
+            # solver results have been saved to a checkpoint, the
+            # writing can continue from where it has been stopped.
+            with _measure_time(timings, "read_checkpoint"):
+                checkpoint_file = read_solver_checkpoint(
+                    solver, checkpoint_path, fingerprint
+                )
+        if checkpoint_file is None:
+            _remove_solver_checkpoint(checkpoint_path)
 
-    _register_sell_offers(solver, turn_id)
-    _register_buy_offers(solver, turn_id)
-    solver.analyze_offers()
+    try:
+        if checkpoint_file is None:
+            if not _prepare_for_writing_solver_results(turn_id):
+                return
 
-    _try_to_commit_solver_results(solver, turn_id)
+            _solve_turn(solver, turn, cache_dir, load_threads, timings)
+            if checkpoint_path:
+                with _measure_time(timings, "write_checkpoint"):
+                    write_solver_checkpoint(
+                        solver, checkpoint_path, fingerprint
+                    )
+
+        _write_solver_results(solver, turn_id, timings)
+        with _measure_time(timings, "commit"):
+            _try_to_commit_solver_results(turn_id)
+    finally:
+        if checkpoint_file is not None:
+            checkpoint_file.close()
+
+    _remove_solver_checkpoint(checkpoint_path)
+    _report_solver_metrics(
+        turn_id,
+        solver,
+        timings,
+        checkpoint_file is not None,
+        metrics_file,
+    )
+
+
+def _solve_turn(
+        solver: Solver,
+        turn: Turn,
+        cache_dir: str,
+        load_threads: int,
+        timings: dict,
+) -> None:
+    turn_id = turn.turn_id
+    with _measure_time(timings, "load_collector_accounts"):
+        _register_collector_accounts(solver, turn_id)
+
+    if cache_dir:
+        _analyze_currencies_using_cache(solver, turn, cache_dir, timings)
+    else:
+        with _measure_time(timings, "load_currencies"):
+            _register_currencies(solver, turn_id)
+        with _measure_time(timings, "analyze_currencies"):
+            solver.analyze_currencies()
+
+    with _measure_time(timings, "load_offers"):
+        _register_offers(solver, turn_id, load_threads)
+    with _measure_time(timings, "analyze_offers"):
+        solver.analyze_offers()
+    logging.getLogger(__name__).info(
+        "Found trading cycles for turn %i (length: count): %s",
+        turn_id,
+        ", ".join(
+            f"{length}: {count}"
+            for length, count in sorted(solver.cycle_length_histogram.items())
+        ) or "none",
+    )
 
 
 def _register_currencies(solver: Solver, turn_id: int) -> None:
@@ -60,206 +188,807 @@ def _register_currencies(solver: Solver, turn_id: int) -> None:
                 .where(CurrencyInfo.turn_id == turn_id)
         ) as result:
             for row in result:
-                if row[3] is None or row[4] is None or row[5] is None:
-                    solver.register_currency(row[0], row[1], row[2])
-                else:
-                    solver.register_currency(*row)
+                _register_currency(solver, row)
 
 
-def _register_collector_accounts(solver: Solver, turn_id: int) -> None:
+def _analyze_currencies_using_cache(
+        solver: Solver,
+        turn: Turn,
+        cache_dir: str,
+        timings: dict,
+) -> None:
+    # Consecutive turns often have identical sets of currencies. To
+    # avoid analyzing the same currency tree again and again, the
+    # prices of the tradable currencies are saved to a snapshot file,
+    # along with a fingerprint of the analyzed data. The currencies
+    # are loaded again only when the snapshot can not be used.
+    with _measure_time(timings, "load_currencies"):
+        fingerprint = _calc_currencies_fingerprint(turn)
+
+    snapshot_path = os.path.join(cache_dir, CURRENCY_PRICES_SNAPSHOT_FILENAME)
+    currency_prices = read_currency_prices_snapshot(snapshot_path, fingerprint)
+    if currency_prices is None:
+        with _measure_time(timings, "load_currencies"):
+            _register_currencies(solver, turn.turn_id)
+        with _measure_time(timings, "analyze_currencies"):
+            solver.analyze_currencies()
+            write_currency_prices_snapshot(
+                snapshot_path, fingerprint, *solver.export_currency_prices()
+            )
+    else:
+        with _measure_time(timings, "analyze_currencies"):
+            solver.import_currency_prices(*currency_prices)
+
+
+def _calc_currencies_fingerprint(turn: Turn) -> bytes:
+    m = hashlib.sha256()
+    m.update(CURRENCY_PRICES_SNAPSHOT_MAGIC)
+    m.update(repr((
+        turn.base_debtor_info_locator,
+        turn.base_debtor_id,
+        turn.max_distance_to_base,
+    )).encode("utf8"))
+
     with db.engines['solver'].connect() as conn:
         with conn.execution_options(yield_per=SELECT_BATCH_SIZE).execute(
                 select(
-                    CollectorAccount.collector_id,
-                    CollectorAccount.debtor_id,
+                    CurrencyInfo.is_confirmed,
+                    CurrencyInfo.debtor_info_locator,
+                    CurrencyInfo.debtor_id,
+                    CurrencyInfo.peg_debtor_info_locator,
+                    CurrencyInfo.peg_debtor_id,
+                    CurrencyInfo.peg_exchange_rate,
                 )
-                .where(CollectorAccount.status == 2)
+                .where(CurrencyInfo.turn_id == turn.turn_id)
+                .order_by(CurrencyInfo.debtor_info_locator)
         ) as result:
-            for row in result:
-                solver.register_collector_account(*row)
+            for rows in result.partitions():
+                m.update(b"".join(_encode_currency_info(r) for r in rows))
+
+    return m.digest()
+
+
+def _encode_currency_info(row) -> bytes:
+    # Returns a stable binary representation of a `CurrencyInfo` row.
+    # The fixed-size fields go first, followed by the two locators.
+    has_peg = not (row[3] is None or row[4] is None or row[5] is None)
+    locator = row[1].encode("utf8")
+    peg_locator = row[3].encode("utf8") if has_peg else b""
+    return b"".join([
+        CURRENCY_INFO_STRUCT.pack(
+            row[0],
+            row[2],
+            has_peg,
+            row[4] if has_peg else 0,
+            row[5] if has_peg else 0.0,
+            len(locator),
+            len(peg_locator),
+        ),
+        locator,
+        peg_locator,
+    ])
+
+
+def _register_currency(solver: Solver, row) -> None:
+    if row[3] is None or row[4] is None or row[5] is None:
+        solver.register_currency(row[0], row[1], row[2])
+    else:
+        solver.register_currency(*row)
+
+
+def read_currency_prices_snapshot(
+        path: str,
+        fingerprint: bytes,
+) -> Optional[Tuple[array, array]]:
+    """Return the (debtor_ids, prices) arrays saved in the given
+    snapshot file, or `None` if the file does not exist, or has been
+    saved with a different fingerprint.
+    """
+    magic = CURRENCY_PRICES_SNAPSHOT_MAGIC
+    header_size = len(magic) + len(fingerprint) + 8
+    try:
+        with open(path, "rb") as f:
+            header = f.read(header_size)
+            if (
+                    len(header) != header_size
+                    or header[:len(magic)] != magic
+                    or header[len(magic):-8] != fingerprint
+            ):
+                return None
+
+            n = int.from_bytes(header[-8:], "little")
+            debtor_ids = array("q")
+            debtor_ids.fromfile(f, n)
+            prices = array("f")
+            prices.fromfile(f, n)
+            return debtor_ids, prices
+
+    except (OSError, EOFError) as e:
+        if not isinstance(e, FileNotFoundError):
+            logging.getLogger(__name__).warning(
+                "Can not read currency prices snapshot: %s", e
+            )
+        return None
+
+
+def write_currency_prices_snapshot(
+        path: str,
+        fingerprint: bytes,
+        debtor_ids: array,
+        prices: array,
+) -> None:
+    """Atomically save the given (debtor_ids, prices) arrays to a
+    snapshot file.
+    """
+    assert len(debtor_ids) == len(prices)
+    directory, filename = os.path.split(path)
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{filename}.")
+        with os.fdopen(fd, "wb") as f:
+            f.write(CURRENCY_PRICES_SNAPSHOT_MAGIC)
+            f.write(fingerprint)
+            f.write(len(debtor_ids).to_bytes(8, "little"))
+            debtor_ids.tofile(f)
+            prices.tofile(f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.getLogger(__name__).warning(
+            "Can not write currency prices snapshot: %s", e
+        )
+        if tmp_path is not None:
+            try:
+                os.unlink(tmp_path)
+            except OSError:  # pragma: no cover
+                pass
+
+
+def _calc_solver_checkpoint_fingerprint(turn: Turn) -> bytes:
+    m = hashlib.sha256()
+    m.update(SOLVER_CHECKPOINT_MAGIC)
+    m.update(repr((
+        turn.turn_id,
+        turn.started_at.isoformat(),
+        turn.base_debtor_info_locator,
+        turn.base_debtor_id,
+        turn.max_distance_to_base,
+        turn.min_trade_amount,
+    )).encode("utf8"))
+    return m.digest()
+
+
+def read_solver_checkpoint(
+        solver: Solver,
+        path: str,
+        fingerprint: bytes,
+) -> Optional[BinaryIO]:
+    """Load the solver results saved in the given checkpoint file.
+
+    Returns the opened checkpoint file, which must be closed when the
+    results are not needed anymore, or `None` if the file does not
+    exist, or has been saved with a different fingerprint.
+    """
+    magic = SOLVER_CHECKPOINT_MAGIC
+    header_size = len(magic) + len(fingerprint)
+    f = None
+    try:
+        f = open(path, "rb")
+        header = f.read(header_size)
+        if header == magic + fingerprint:
+            solver.read_checkpoint(f)
+            return f
+
+    except (OSError, ValueError) as e:
+        if not isinstance(e, FileNotFoundError):
+            logging.getLogger(__name__).warning(
+                "Can not read solver checkpoint: %s", e
+            )
+
+    if f is not None:
+        f.close()
+    return None
+
+
+def write_solver_checkpoint(
+        solver: Solver,
+        path: str,
+        fingerprint: bytes,
+) -> None:
+    """Atomically save solver's results to a checkpoint file.
+    """
+    directory, filename = os.path.split(path)
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{filename}.")
+        with os.fdopen(fd, "wb") as f:
+            f.write(SOLVER_CHECKPOINT_MAGIC)
+            f.write(fingerprint)
+            solver.write_checkpoint(f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.getLogger(__name__).warning(
+            "Can not write solver checkpoint: %s", e
+        )
+        if tmp_path is not None:
+            try:
+                os.unlink(tmp_path)
+            except OSError:  # pragma: no cover
+                pass
+
+
+def _remove_solver_checkpoint(path: str) -> None:
+    if path:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:  # pragma: no cover
+            logging.getLogger(__name__).warning(
+                "Can not remove solver checkpoint: %s", e
+            )
+
+
+@contextmanager
+def _measure_time(timings: dict, step: str) -> Iterator[None]:
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_time = time.perf_counter() - started_at
+        timings[step] = timings.get(step, 0.0) + elapsed_time
+
+
+def _report_solver_metrics(
+        turn_id: int,
+        solver: Solver,
+        timings: dict,
+        resumed_from_checkpoint: bool,
+        metrics_file: str,
+) -> None:
+    histogram = solver.cycle_length_histogram
+    cycles_count = sum(histogram.values())
+    cycles_total_length = sum(k * v for k, v in histogram.items())
+
+    # NOTE: On Linux, `ru_maxrss` is measured in kilobytes.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    metrics = {
+        "turn_id": turn_id,
+        "resumed_from_checkpoint": resumed_from_checkpoint,
+        "step_seconds": {
+            step: round(seconds, 6) for step, seconds in timings.items()
+        },
+        "tradable_currencies": solver.tradable_currencies_count,
+        "graph_nodes": solver.graph_nodes_count,
+        "graph_arcs": solver.graph_arcs_count,
+        "cycles": cycles_count,
+        "avg_cycle_length": (
+            cycles_total_length / cycles_count if cycles_count else 0.0
+        ),
+        "max_cycle_length": max(histogram, default=0),
+        "peak_rss_bytes": peak_rss,
+    }
+    logging.getLogger(__name__).info(
+        "Solver metrics: %s", json.dumps(metrics, sort_keys=True)
+    )
+    if metrics_file:
+        write_solver_metrics(metrics_file, metrics)
+
+
+def write_solver_metrics(path: str, metrics: dict) -> None:
+    """Atomically save solver's metrics to a file, in the Prometheus
+    text-based exposition format.
 
+    The file is intended to be collected by the "textfile" collector
+    of Prometheus' node exporter. All metrics are exposed as gauges.
+    """
+    lines = []
 
-def _register_sell_offers(solver: Solver, turn_id: int) -> None:
+    def add_gauge(name, description, samples):
+        name = f"{METRICS_PREFIX}_{name}"
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            lines.append(f"{name}{labels} {float(value)!r}")
+
+    add_gauge("turn_id", "The ID of the last solved turn.", [
+        ("", metrics["turn_id"]),
+    ])
+    add_gauge(
+        "resumed_from_checkpoint",
+        "Whether the results have been loaded from a checkpoint.",
+        [("", metrics["resumed_from_checkpoint"])],
+    )
+    add_gauge("step_duration_seconds", "Wall time of solver's steps.", [
+        (f'{{step="{step}"}}', seconds)
+        for step, seconds in sorted(metrics["step_seconds"].items())
+    ])
+    for name, description in [
+            ("tradable_currencies", "The number of tradable currencies."),
+            ("graph_nodes", "The number of nodes in the trading graph."),
+            ("graph_arcs", "The number of arcs in the trading graph."),
+            ("cycles", "The number of found trading cycles."),
+            ("avg_cycle_length", "The average length of trading cycles."),
+            ("max_cycle_length", "The maximal length of trading cycles."),
+            ("peak_rss_bytes", "The peak resident set size of the process."),
+    ]:
+        add_gauge(name, description, [("", metrics[name])])
+
+    directory, filename = os.path.split(path)
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{filename}.")
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "w") as f:
+            f.write("\n".join(lines))
+            f.write("\n")
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.getLogger(__name__).warning(
+            "Can not write solver metrics: %s", e
+        )
+        if tmp_path is not None:
+            try:
+                os.unlink(tmp_path)
+            except OSError:  # pragma: no cover
+                pass
+
+
+def _register_collector_accounts(solver: Solver, turn_id: int) -> None:
     with db.engines['solver'].connect() as conn:
         with conn.execution_options(yield_per=SELECT_BATCH_SIZE).execute(
                 select(
-                    SellOffer.creditor_id,
-                    SellOffer.debtor_id,
-                    SellOffer.amount,
-                    SellOffer.collector_id,
+                    CollectorAccount.collector_id,
+                    CollectorAccount.debtor_id,
                 )
-                .where(SellOffer.turn_id == turn_id)
+                .where(CollectorAccount.status == 2)
         ) as result:
             for row in result:
-                solver.register_sell_offer(*row)
+                solver.register_collector_account(*row)
 
 
-def _register_buy_offers(solver: Solver, turn_id: int) -> None:
-    with db.engines['solver'].connect() as conn:
+def _register_offers(solver: Solver, turn_id: int, parts: int) -> None:
+    # The sell offers and the buy offers are split into (at most)
+    # `parts` contiguous ranges of `creditor_id`s, and each range is
+    # loaded into arrays in a separate thread, using its own database
+    # connection. Because `creditor_id` immediately follows `turn_id`
+    # in the primary keys, every thread performs an index range scan.
+    # The arrays are registered with the solver in a deterministic
+    # order, as soon as they become available.
+    assert parts > 0
+    engine = db.engines['solver']
+
+    with ThreadPoolExecutor(max_workers=parts) as executor:
+        sell_offers = [
+            executor.submit(_load_sell_offers, engine, turn_id, lo, hi)
+            for lo, hi in _calc_creditor_id_ranges(
+                engine, SellOffer, turn_id, parts
+            )
+        ]
+        buy_offers = [
+            executor.submit(_load_buy_offers, engine, turn_id, lo, hi)
+            for lo, hi in _calc_creditor_id_ranges(
+                engine, BuyOffer, turn_id, parts
+            )
+        ]
+        for future in sell_offers:
+            solver.register_sell_offers_bulk(*future.result())
+        for future in buy_offers:
+            solver.register_buy_offers_bulk(*future.result())
+
+
+def _calc_creditor_id_ranges(
+        engine,
+        model,
+        turn_id: int,
+        parts: int,
+) -> List[Tuple[int, int]]:
+    with engine.connect() as conn:
+        min_creditor_id, max_creditor_id = conn.execute(
+            select(func.min(model.creditor_id), func.max(model.creditor_id))
+            .where(model.turn_id == turn_id)
+        ).one()
+
+    if min_creditor_id is None:
+        return []
+
+    return _split_range(min_creditor_id, max_creditor_id, parts)
+
+
+def _split_range(lo: int, hi: int, parts: int) -> List[Tuple[int, int]]:
+    # Splits the inclusive range [lo, hi] into at most `parts`
+    # non-empty inclusive ranges of (almost) equal width.
+    assert lo <= hi
+    assert parts > 0
+    width = hi - lo + 1
+    bounds = [lo + width * i // parts for i in range(parts + 1)]
+
+    return [
+        (bounds[i], bounds[i + 1] - 1)
+        for i in range(parts)
+        if bounds[i] < bounds[i + 1]
+    ]
+
+
+def _load_sell_offers(
+        engine,
+        turn_id: int,
+        min_creditor_id: int,
+        max_creditor_id: int,
+) -> tuple:
+    return _load_columns(
+        engine,
+        select(
+            SellOffer.creditor_id,
+            SellOffer.debtor_id,
+            SellOffer.amount,
+            SellOffer.collector_id,
+        )
+        .where(
+            and_(
+                SellOffer.turn_id == turn_id,
+                SellOffer.creditor_id.between(
+                    min_creditor_id, max_creditor_id
+                ),
+            )
+        ),
+        4,
+    )
+
+
+def _load_buy_offers(
+        engine,
+        turn_id: int,
+        min_creditor_id: int,
+        max_creditor_id: int,
+) -> tuple:
+    return _load_columns(
+        engine,
+        select(
+            BuyOffer.creditor_id,
+            BuyOffer.debtor_id,
+            BuyOffer.amount,
+        )
+        .where(
+            and_(
+                BuyOffer.turn_id == turn_id,
+                BuyOffer.creditor_id.between(
+                    min_creditor_id, max_creditor_id
+                ),
+            )
+        ),
+        3,
+    )
+
+
+def _load_columns(engine, query, columns_count: int) -> tuple:
+    columns = tuple(array("q") for _ in range(columns_count))
+
+    with engine.connect() as conn:
         with conn.execution_options(yield_per=SELECT_BATCH_SIZE).execute(
-                select(
-                    BuyOffer.creditor_id,
-                    BuyOffer.debtor_id,
-                    BuyOffer.amount,
-                )
-                .where(BuyOffer.turn_id == turn_id)
+                query
         ) as result:
-            for row in result:
-                solver.register_buy_offer(*row)
+            for rows in result.partitions():
+                for column, values in zip(columns, zip(*rows)):
+                    column.extend(values)
+
+    return columns
 
 
 @atomic
-def _try_to_commit_solver_results(solver: Solver, turn_id: int) -> None:
+def _prepare_for_writing_solver_results(turn_id: int) -> bool:
     turn = (
         Turn.query.filter_by(turn_id=turn_id)
         .with_for_update()
         .one_or_none()
     )
-    if turn and turn.phase == 2:
-        _write_takings(solver, turn_id)
-        _write_collector_transfers(solver, turn_id)
-        _write_givings(solver, turn_id)
+    if not (turn and turn.phase == 2):
+        return False
 
-        turn.phase = 3
-        turn.phase_deadline = None
-        turn.collection_started_at = datetime.now(tz=timezone.utc)
+    # The results will be written to empty staging partitions, which
+    # will be attached to the partitioned tables when the turn
+    # advances to phase 3. Creating the staging partitions discards
+    # the results that have been partially written by a previous
+    # (crashed) attempt to solve the turn.
+    create_staging_partitions(turn_id, STAGED_MODELS)
+    db.session.execute(
+        delete(TurnCommitProgress)
+        .where(TurnCommitProgress.turn_id == turn_id)
+    )
 
-        # NOTE: When reaching turn phase 3, all records for the given
-        # turn from the `CurrencyInfo`, `SellOffer`, and `BuyOffer`
-        # tables will be deleted. This however, does not guarantee
-        # that a worker process will not continue to insert new rows
-        # for the given turn in these tables. Therefore, in order to
-        # ensure that such obsolete records will be deleted
-        # eventually, here we delete all records for which the turn
-        # phase 3 has been reached.
-        db.session.execute(
-            delete(CurrencyInfo)
-            .where(
-                and_(
-                    Turn.turn_id == CurrencyInfo.turn_id,
-                    Turn.phase >= 3,
-                )
-            )
-        )
-        db.session.execute(
-            delete(SellOffer)
-            .where(
-                and_(
-                    Turn.turn_id == SellOffer.turn_id,
-                    Turn.phase >= 3,
-                )
+    for stream_name in RESULT_STREAM_NAMES:
+        db.session.add(
+            TurnCommitProgress(
+                turn_id=turn_id,
+                stream_name=stream_name,
+                written_rows=0,
+                is_completed=False,
             )
         )
-        db.session.execute(
-            delete(BuyOffer)
-            .where(
-                and_(
-                    Turn.turn_id == BuyOffer.turn_id,
-                    Turn.phase >= 3,
-                )
+
+    return True
+
+
+def _has_commit_progress(turn_id: int) -> bool:
+    progress_rows = db.session.execute(
+        select(func.count())
+        .select_from(TurnCommitProgress)
+        .where(TurnCommitProgress.turn_id == turn_id)
+    ).scalar_one()
+    db.session.close()
+    return progress_rows == len(RESULT_STREAM_NAMES)
+
+
+def _are_solver_results_written(turn_id: int) -> bool:
+    completed_streams = _count_completed_result_streams(turn_id)
+    db.session.close()
+    return completed_streams == len(RESULT_STREAM_NAMES)
+
+
+def _count_completed_result_streams(turn_id: int) -> int:
+    return db.session.execute(
+        select(func.count())
+        .select_from(TurnCommitProgress)
+        .where(
+            and_(
+                TurnCommitProgress.turn_id == turn_id,
+                TurnCommitProgress.is_completed,
             )
         )
+    ).scalar_one()
 
 
-def _write_takings(solver: Solver, turn_id: int) -> None:
-    for account_changes in batched(solver.takings_iter(), INSERT_BATCH_SIZE):
-        db.session.execute(
-            insert(CreditorTaking).execution_options(
-                insertmanyvalues_page_size=INSERT_BATCH_SIZE
-            ),
-            [
-                {
-                    "turn_id": turn_id,
-                    "creditor_id": ac.creditor_id,
-                    "debtor_id": ac.debtor_id,
-                    "creditor_hash": calc_hash(ac.creditor_id),
-                    "amount": -ac.amount,
-                    "collector_id": ac.collector_id,
-                } for ac in account_changes
-            ],
-        )
-        db.session.execute(
-            insert(CollectorCollecting).execution_options(
-                insertmanyvalues_page_size=INSERT_BATCH_SIZE
+def _write_solver_results(
+        solver: Solver,
+        turn_id: int,
+        timings: dict,
+) -> None:
+    # The results are written to the turn's staging partitions in
+    # many small transactions (chunks), while the turn is still in
+    # phase 2. "Worker" servers will not see them before the staging
+    # partitions are attached, when the turn advances to phase 3. The
+    # number of written items is recorded with each chunk.
+    for stream_name, items, write_chunk in [
+            ("takings", solver.takings_iter(), _write_takings),
+            (
+                "collector_transfers",
+                solver.collector_transfers_iter(),
+                _write_collector_transfers,
             ),
-            [
-                {
-                    "turn_id": turn_id,
-                    "debtor_id": ac.debtor_id,
-                    "creditor_id": ac.creditor_id,
-                    "amount": -ac.amount,
-                    "collector_id": ac.collector_id,
-                    "collector_hash": calc_hash(ac.collector_id),
-                } for ac in account_changes
-            ],
-        )
+            ("givings", solver.givings_iter(), _write_givings),
+    ]:
+        with _measure_time(timings, f"write_{stream_name}"):
+            _write_result_stream(
+                turn_id, stream_name, items, write_chunk, solver.num_threads
+            )
+
 
+def _write_result_stream(
+        turn_id: int,
+        stream_name: str,
+        items,
+        write_chunk: Callable[[tuple, int, int], None],
+        num_threads: int,
+) -> None:
+    progress = _get_commit_progress(turn_id, stream_name)
+    if progress is None or progress.is_completed:
+        return
 
-def _write_collector_transfers(solver: Solver, turn_id: int) -> None:
-    for collector_transfers in batched(
-            solver.collector_transfers_iter(), INSERT_BATCH_SIZE
+    for chunk in batched(
+            islice(items, progress.written_rows, None), INSERT_BATCH_SIZE
     ):
-        db.session.execute(
-            insert(CollectorSending).execution_options(
-                insertmanyvalues_page_size=INSERT_BATCH_SIZE
-            ),
-            [
-                {
-                    "turn_id": turn_id,
-                    "debtor_id": ct.debtor_id,
-                    "from_collector_id": ct.from_creditor_id,
-                    "to_collector_id": ct.to_creditor_id,
-                    "from_collector_hash": calc_hash(ct.from_creditor_id),
-                    "amount": ct.amount,
-                } for ct in collector_transfers
-            ],
-        )
-        db.session.execute(
-            insert(CollectorReceiving).execution_options(
-                insertmanyvalues_page_size=INSERT_BATCH_SIZE
-            ),
-            [
-                {
-                    "turn_id": turn_id,
-                    "debtor_id": ct.debtor_id,
-                    "to_collector_id": ct.to_creditor_id,
-                    "from_collector_id": ct.from_creditor_id,
-                    "to_collector_hash": calc_hash(ct.to_creditor_id),
-                    "amount": ct.amount,
-                } for ct in collector_transfers
-            ],
-        )
+        if not _write_result_chunk(
+                turn_id, stream_name, chunk, write_chunk, num_threads
+        ):
+            return
 
+    _mark_result_stream_as_completed(turn_id, stream_name)
 
-def _write_givings(solver: Solver, turn_id: int) -> None:
-    for account_changes in batched(solver.givings_iter(), INSERT_BATCH_SIZE):
-        db.session.execute(
-            insert(CollectorDispatching).execution_options(
-                insertmanyvalues_page_size=INSERT_BATCH_SIZE
+
+def _get_commit_progress(
+        turn_id: int,
+        stream_name: str,
+) -> Optional[TurnCommitProgress]:
+    progress = (
+        TurnCommitProgress.query
+        .filter_by(turn_id=turn_id, stream_name=stream_name)
+        .one_or_none()
+    )
+    db.session.close()
+    return progress
+
+
+@atomic
+def _write_result_chunk(
+        turn_id: int,
+        stream_name: str,
+        chunk: tuple,
+        write_chunk: Callable[[tuple, int, int], None],
+        num_threads: int,
+) -> bool:
+    turn = (
+        Turn.query.filter_by(turn_id=turn_id)
+        .with_for_update(read=True)
+        .one_or_none()
+    )
+    if not (turn and turn.phase == 2):
+        return False
+
+    write_chunk(chunk, turn_id, num_threads)
+    TurnCommitProgress.query.filter_by(
+        turn_id=turn_id, stream_name=stream_name
+    ).update(
+        {
+            TurnCommitProgress.written_rows: (
+                TurnCommitProgress.written_rows + len(chunk)
             ),
-            [
-                {
-                    "turn_id": turn_id,
-                    "debtor_id": ac.debtor_id,
-                    "creditor_id": ac.creditor_id,
-                    "amount": ac.amount,
-                    "collector_id": ac.collector_id,
-                    "collector_hash": calc_hash(ac.collector_id),
-                } for ac in account_changes
-            ],
-        )
+        },
+        synchronize_session=False,
+    )
+    return True
+
+
+@atomic
+def _mark_result_stream_as_completed(turn_id: int, stream_name: str) -> None:
+    TurnCommitProgress.query.filter_by(
+        turn_id=turn_id, stream_name=stream_name
+    ).update(
+        {TurnCommitProgress.is_completed: True},
+        synchronize_session=False,
+    )
+
+
+@atomic
+def _try_to_commit_solver_results(turn_id: int) -> None:
+    turn = (
+        Turn.query.filter_by(turn_id=turn_id)
+        .with_for_update()
+        .one_or_none()
+    )
+    if (
+        turn
+        and turn.phase == 2
+        and _count_completed_result_streams(turn_id)
+        == len(RESULT_STREAM_NAMES)
+    ):
+        turn.phase = 3
+        turn.phase_deadline = None
+        turn.collection_started_at = datetime.now(tz=timezone.utc)
         db.session.execute(
-            insert(CreditorGiving).execution_options(
-                insertmanyvalues_page_size=INSERT_BATCH_SIZE
-            ),
-            [
-                {
-                    "turn_id": turn_id,
-                    "creditor_id": ac.creditor_id,
-                    "debtor_id": ac.debtor_id,
-                    "creditor_hash": calc_hash(ac.creditor_id),
-                    "amount": ac.amount,
-                    "collector_id": ac.collector_id,
-                } for ac in account_changes
-            ],
+            delete(TurnCommitProgress)
+            .where(TurnCommitProgress.turn_id == turn_id)
         )
+        db.session.flush()
+
+        # The solver results become visible to the "worker" servers
+        # when the turn's staging partitions are attached.
+        attach_staging_partitions(turn_id, STAGED_MODELS)
+
+        # NOTE: The partitions for the given turn of the
+        # `CurrencyInfo`, `SellOffer`, and `BuyOffer` tables are not
+        # needed anymore. They will be dropped by
+        # `drop_obsolete_turn_partitions`, outside of this transaction.
+
+
+def _write_takings(account_changes, turn_id: int, threads: int) -> None:
+    creditor_ids, debtor_ids, amounts, collector_ids = _to_columns(
+        account_changes
+    )
+    amounts = array("q", [-x for x in amounts])
+    creditor_hashes = calc_hashes(creditor_ids, threads)
+    collector_hashes = calc_hashes(collector_ids, threads)
+    _copy_rows(
+        CreditorTaking,
+        turn_id,
+        {
+            "turn_id": ("i", turn_id),
+            "creditor_id": ("q", creditor_ids),
+            "debtor_id": ("q", debtor_ids),
+            "creditor_hash": ("h", creditor_hashes),
+            "amount": ("q", amounts),
+            "collector_id": ("q", collector_ids),
+        },
+    )
+    _copy_rows(
+        CollectorCollecting,
+        turn_id,
+        {
+            "turn_id": ("i", turn_id),
+            "debtor_id": ("q", debtor_ids),
+            "creditor_id": ("q", creditor_ids),
+            "amount": ("q", amounts),
+            "collector_id": ("q", collector_ids),
+            "collector_hash": ("h", collector_hashes),
+        },
+    )
+
+
+def _write_collector_transfers(
+        collector_transfers,
+        turn_id: int,
+        threads: int,
+) -> None:
+    debtor_ids, from_collector_ids, to_collector_ids, amounts = (
+        _to_columns(collector_transfers)
+    )
+    from_collector_hashes = calc_hashes(from_collector_ids, threads)
+    to_collector_hashes = calc_hashes(to_collector_ids, threads)
+    _copy_rows(
+        CollectorSending,
+        turn_id,
+        {
+            "turn_id": ("i", turn_id),
+            "debtor_id": ("q", debtor_ids),
+            "from_collector_id": ("q", from_collector_ids),
+            "to_collector_id": ("q", to_collector_ids),
+            "from_collector_hash": ("h", from_collector_hashes),
+            "amount": ("q", amounts),
+        },
+    )
+    _copy_rows(
+        CollectorReceiving,
+        turn_id,
+        {
+            "turn_id": ("i", turn_id),
+            "debtor_id": ("q", debtor_ids),
+            "to_collector_id": ("q", to_collector_ids),
+            "from_collector_id": ("q", from_collector_ids),
+            "to_collector_hash": ("h", to_collector_hashes),
+            "amount": ("q", amounts),
+        },
+    )
+
+
+def _write_givings(account_changes, turn_id: int, threads: int) -> None:
+    creditor_ids, debtor_ids, amounts, collector_ids = _to_columns(
+        account_changes
+    )
+    creditor_hashes = calc_hashes(creditor_ids, threads)
+    collector_hashes = calc_hashes(collector_ids, threads)
+    _copy_rows(
+        CollectorDispatching,
+        turn_id,
+        {
+            "turn_id": ("i", turn_id),
+            "debtor_id": ("q", debtor_ids),
+            "creditor_id": ("q", creditor_ids),
+            "amount": ("q", amounts),
+            "collector_id": ("q", collector_ids),
+            "collector_hash": ("h", collector_hashes),
+        },
+    )
+    _copy_rows(
+        CreditorGiving,
+        turn_id,
+        {
+            "turn_id": ("i", turn_id),
+            "creditor_id": ("q", creditor_ids),
+            "debtor_id": ("q", debtor_ids),
+            "creditor_hash": ("h", creditor_hashes),
+            "amount": ("q", amounts),
+            "collector_id": ("q", collector_ids),
+        },
+    )
+
+
+def _to_columns(rows: Tuple[tuple, ...]) -> List[array]:
+    return [array("q", column) for column in zip(*rows)]
+
+
+def _copy_rows(model, turn_id: int, columns: dict) -> None:
+    """Write rows to the staging partition of the given turn, in the
+    table of `model`, using PostgreSQL's binary `COPY` command.
+
+    `columns` maps the name of each column to a (format, value) tuple,
+    where `value` is an integer or an array (see
+    `swpt_trade.solver.encode_binary_copy`).
+    """
+    formats = "".join(f for f, _ in columns.values())
+    values = tuple(v for _, v in columns.values())
+    copy_binary(
+        db.session,
+        model,
+        list(columns),
+        encode_binary_copy(values, formats),
+        get_partition_name(model.__table__.name, turn_id),
+    )
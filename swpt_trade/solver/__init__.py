@@ -4,4 +4,13 @@ from .pricing import (  # noqa
     CandidateOfferAuxData,
     BidProcessor,
 )
-from .aggregation import AccountChange, CollectorTransfer, Solver  # noqa
+from .aggregation import (  # noqa
+    AccountChange,
+    CollectorTransfer,
+    Solver,
+    ENGINE_DFS,
+    ENGINE_FLOW,
+)
+from .pgcopy import encode_binary_copy  # noqa
+from .hashing import calc_hashes  # noqa
+from .dispatching import DispatchingStatuses  # noqa
@@ -1,19 +1,20 @@
 # distutils: language = c++
 from libcpp cimport bool
 from libcpp.unordered_set cimport unordered_set
-from libcpp.unordered_set cimport unordered_multiset
 from libcpp.unordered_map cimport unordered_map
 from libcpp.vector cimport vector
 from .pricing cimport distance, BidProcessor
 from .matching cimport Digraph
 
 
-cdef extern from *:
+cdef extern from * nogil:
     """
     #ifndef AGGREGATION_CLASSES_H
     #define AGGREGATION_CLASSES_H
 
     #include <unordered_map>
+    #include <vector>
+    #include <algorithm>
     #include <stdexcept>
     #include <climits>
     #include <cmath>
@@ -130,6 +131,124 @@ cdef extern from *:
       }
     };
 
+    class CollectorSelector {
+    public:
+      std::vector<i64> collector_ids;
+      std::vector<i64> loads;
+      std::unordered_map<i64, size_t> indexes;
+
+      void add(i64 collector_id) {
+        if (indexes.emplace(collector_id, collector_ids.size()).second) {
+          collector_ids.push_back(collector_id);
+          loads.push_back(0);
+        }
+      }
+      i64 select(i64 fallback_id) {
+        size_t n = collector_ids.size();
+        if (n == 0) {
+          return fallback_id;
+        }
+        // Select the least loaded collector. When several collectors
+        // are equally loaded, the one that has been added first wins.
+        size_t selected = 0;
+        for (size_t i = 1; i < n; ++i) {
+          if (loads[i] < loads[selected]) {
+            selected = i;
+          }
+        }
+        return collector_ids[selected];
+      }
+      void add_load(i64 collector_id, i64 amount) {
+        auto it = indexes.find(collector_id);
+        if (it != indexes.end() && amount > 0) {
+          i64& load = loads[it->second];
+          load = (load > LLONG_MAX - amount) ? LLONG_MAX : load + amount;
+        }
+      }
+    };
+
+    class AccountRecord {
+    public:
+      i64 creditor_id;
+      i64 debtor_id;
+      i64 amount_change;
+      i64 collector_id;
+
+      AccountRecord(
+        i64 creditor_id,
+        i64 debtor_id,
+        i64 amount_change,
+        i64 collector_id
+      ) : creditor_id(creditor_id),
+          debtor_id(debtor_id),
+          amount_change(amount_change),
+          collector_id(collector_id) {
+      }
+      bool operator< (const AccountRecord& other) const {
+        return (
+          debtor_id < other.debtor_id
+          || (debtor_id == other.debtor_id && creditor_id < other.creditor_id)
+        );
+      }
+    };
+
+    inline i64 find_collector_id(
+      const std::vector<AccountRecord>& records,
+      i64 creditor_id,
+      i64 debtor_id
+    ) {
+      // Searches the sorted `records` for the given account, and
+      // returns its `collector_id`, or `0` if the account is missing.
+      AccountRecord key(creditor_id, debtor_id, 0, 0);
+      auto it = std::lower_bound(records.begin(), records.end(), key);
+      if (
+        it != records.end()
+        && it->creditor_id == creditor_id
+        && it->debtor_id == debtor_id
+      ) {
+        return it->collector_id;
+      }
+      return 0;
+    }
+
+    class AccountRecordMerger {
+    private:
+      std::vector<const AccountRecord*> positions;
+      std::vector<const AccountRecord*> ends;
+      std::vector<size_t> heap;
+
+      struct Greater {
+        const AccountRecordMerger* merger;
+        bool operator()(size_t a, size_t b) const {
+          return *merger->positions[b] < *merger->positions[a];
+        }
+      };
+
+    public:
+      void add_run(const AccountRecord* data, size_t count) {
+        if (count > 0) {
+          positions.push_back(data);
+          ends.push_back(data + count);
+          heap.push_back(positions.size() - 1);
+          std::push_heap(heap.begin(), heap.end(), Greater{this});
+        }
+      }
+      const AccountRecord* next() {
+        if (heap.empty()) {
+          return NULL;
+        }
+        std::pop_heap(heap.begin(), heap.end(), Greater{this});
+        size_t run = heap.back();
+        const AccountRecord* record = positions[run]++;
+        if (positions[run] == ends[run]) {
+          heap.pop_back();
+        } else {
+          std::push_heap(heap.begin(), heap.end(), Greater{this});
+        }
+        return record;
+      }
+    };
+
     inline i64 check_add(i64 n, i64 amt)
     {
       // Returns the closest integer which can be added to `n` without
@@ -211,6 +330,52 @@ cdef extern from *:
         const i64 amount
         Transfer(i64, i64, i64, i64)
 
+    cdef cppclass CollectorSelector:
+        """Selects collector accounts for a given currency, so that
+        the amounts dispatched by the collectors are balanced.
+
+        Every collector has a load, which is the sum of all amounts
+        passed to the `add_load` method for the collector. The `select`
+        method returns the least loaded collector ID (the one that has
+        been added first, on a tie). When no collector IDs have been
+        added, the `fallback_id` passed to the `select` method is
+        returned.
+        """
+        vector[i64] collector_ids
+        vector[i64] loads
+        CollectorSelector() except +
+        void add(i64) except +
+        i64 select(i64) noexcept
+        void add_load(i64, i64) noexcept
+
+    cdef cppclass AccountRecord:
+        """A fixed-size record of account's pending change.
+
+        Account records are sorted by `debtor_id`, then by
+        `creditor_id`, and are written to spill files as they are.
+        """
+        i64 creditor_id
+        i64 debtor_id
+        i64 amount_change
+        i64 collector_id
+        AccountRecord(i64, i64, i64, i64) noexcept
+        bool operator<(const AccountRecord&) noexcept
+
+    cdef cppclass AccountRecordMerger:
+        """Merges sorted runs of account records.
+
+        Every run is an array of account records, sorted by
+        `debtor_id`, then by `creditor_id`. The arrays must not be
+        modified or released while the merger is being used. Every
+        call to the `next` method returns a pointer to the smallest
+        record which has not been returned yet, or NULL when all
+        records have been returned.
+        """
+        AccountRecordMerger() except +
+        void add_run(const AccountRecord*, size_t) except +
+        const AccountRecord* next() noexcept
+
+    cdef i64 find_collector_id(const vector[AccountRecord]&, i64, i64)
     cdef i64 check_add(i64, i64)
     cdef i64 calc_amt(double, float)
 
@@ -220,11 +385,27 @@ cdef class Solver:
     cdef readonly i64 base_debtor_id
     cdef readonly distance max_distance_to_base
     cdef readonly i64 min_trade_amount
+    cdef readonly size_t num_threads
+    cdef readonly str engine
+    cdef readonly str spill_dir
+    cdef readonly size_t spill_memory_limit
+    cdef readonly size_t preferred_cycle_length
+    cdef readonly dict cycle_length_histogram
+    cdef readonly size_t tradable_currencies_count
+    cdef readonly size_t graph_nodes_count
+    cdef readonly size_t graph_arcs_count
+    cdef tuple takings_records
+    cdef tuple givings_records
+    cdef tuple collector_transfers_records
+    cdef object spill_file
+    cdef list spill_runs
+    cdef vector[AccountRecord] seller_collectors
     cdef BidProcessor bid_processor
     cdef Digraph graph
     cdef unordered_set[i64] debtor_ids
+    cdef unordered_map[i64, float] currency_prices
     cdef unordered_map[Account, AccountData] changes
-    cdef unordered_multiset[CollectorAccount] collector_accounts
+    cdef unordered_map[i64, CollectorSelector] collector_selectors
     cdef unordered_map[Account, i64] collection_amounts
     cdef vector[Transfer] collector_transfers
     cdef bool currencies_analysis_done
@@ -232,7 +413,16 @@ cdef class Solver:
     cpdef void analyze_currencies(self)
     cpdef void analyze_offers(self)
     cdef void _process_cycle(self, double, i64[:])
+    cdef inline float _get_currency_price(self, i64) noexcept nogil
     cdef i64 _update_collector(self, i64, i64, i64)
     cdef i64 _update_collectors(self, i64, i64, i64, i64)
-    cdef i64 _get_random_collector_id(self, i64, i64)
+    cdef i64 _select_collector_id(self, i64, i64)
+    cdef void _add_collector_load(self, i64, i64, i64)
     cdef void _calc_collector_transfers(self)
+    cdef _move_seller_collectors(self)
+    cdef _spill_changes(self)
+    cdef _write_spill_run(self, vector[AccountRecord]&)
+    cdef _merge_spilled_changes(self)
+    cdef _spill_collector_transfers(self)
+    cdef _write_account_records(self, object, vector[AccountRecord]&)
+    cdef _write_changes_checkpoint(self, object, bool)
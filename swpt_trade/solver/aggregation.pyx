@@ -1,11 +1,13 @@
 # distutils: language = c++
-import cython
 from cython.operator cimport dereference as deref, postincrement
 from libcpp.utility cimport pair as Pair
 from libcpp.unordered_set cimport unordered_set
-from libcpp.unordered_map cimport unordered_multimap
-from libc.stdlib cimport rand
+from libcpp.unordered_map cimport unordered_map, unordered_multimap
+from libcpp.vector cimport vector
+from libcpp.algorithm cimport sort
 from libc.math cimport NAN
+from cpython cimport array
+from cpython.bytes cimport PyBytes_FromStringAndSize
 from libcpp cimport bool
 from .pricing cimport distance, BidProcessor
 from .pricing import (
@@ -14,6 +16,34 @@ from .pricing import (
 )
 from .matching cimport Digraph
 from collections import namedtuple
+import os
+import mmap
+import tempfile
+
+
+ENGINE_DFS = "dfs"
+ENGINE_FLOW = "flow"
+
+# The maximal number of account changes that will be sorted and
+# written to a spill file at once (a sorted run). Also, the maximal
+# number of collector transfers that will be written to a file at
+# once.
+SPILL_CHUNK_SIZE = 256 * 1024
+
+# The size of the header of a checkpoint, written by the
+# `Solver.write_checkpoint` method. The header contains the number of
+# takings, collector transfers, and givings (three 64-bit numbers).
+CHECKPOINT_HEADER_SIZE = 24
+
+# The maximal number of bytes that will be copied at once, when
+# records are copied from one file to another.
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# An estimate of the number of bytes that every account change
+# occupies in memory (the hash table node, and the bucket pointer).
+cdef size_t CHANGES_ENTRY_SIZE = (
+    sizeof(Account) + sizeof(AccountData) + 3 * sizeof(void*)
+)
 
 
 AccountChange = namedtuple('AccountChange', [
@@ -48,6 +78,48 @@ cdef class Solver:
     specified `min_trade_amount`. Possible trades for lesser amounts
     will be ignored.
 
+    When `num_threads` is bigger than one, the independent parts of
+    the trading graph will be analyzed in parallel, using the given
+    number of threads. Note that in this case, all found trading
+    cycles will be kept in memory until the analysis is completed.
+
+    The `engine` argument selects the algorithm which will be used to
+    find trading cycles. `ENGINE_DFS` ("dfs", the default) performs a
+    greedy depth-first search. `ENGINE_FLOW` ("flow") treats the
+    trading graph as a flow network, and tries to maximize the total
+    traded volume (see `Digraph.max_volume_cycles`). The "flow" engine
+    is slower, does not use multiple threads, and keeps all found
+    trading cycles in memory until the analysis is completed.
+
+    When `preferred_cycle_length` is not zero, the "dfs" engine will
+    try to find trading cycles containing at most
+    `preferred_cycle_length` nodes (currencies and traders) first,
+    and only then will continue with longer cycles (see
+    `Digraph.bounded_cycles`). Shorter trading cycles result in less
+    transfers. After the offers have been analyzed, the
+    `cycle_length_histogram` field will contain a dictionary, mapping
+    the lengths of the found trading cycles to their counts. Also,
+    the `tradable_currencies_count`, `graph_nodes_count`, and
+    `graph_arcs_count` fields will contain the number of tradable
+    currencies, and the size of the trading graph.
+
+    When `spill_dir` is not empty, during the analysis of the offers,
+    every time the memory occupied by the account changes reaches
+    `spill_memory_limit` bytes, the account changes will be written
+    to a temporary file in the `spill_dir` directory (as sorted runs
+    of at most `SPILL_CHUNK_SIZE` items), and the memory occupied by
+    them will be released. (In this case, the collector IDs of the
+    sellers are kept in a compact sorted array, so that the sellers'
+    account changes can be released too.) After the analysis, the
+    sorted runs will be merged into temporary files containing the
+    takings and the givings, the collector transfers will be written
+    to a temporary file too, and the `takings_iter`,
+    `collector_transfers_iter`, and `givings_iter` methods will
+    stream the results from memory-mapped files. Spilled account
+    changes will be sorted by debtor ID, then by creditor ID. Note
+    that the trading graph is not spilled to disk, and stays in
+    memory until the end of the analysis.
+
     Usage example:
 
     >>> s = Solver('https://example.com/101', 101)
@@ -124,14 +196,36 @@ cdef class Solver:
         i64 base_debtor_id,
         distance max_distance_to_base=DEFAULT_MAX_DISTANCE_TO_BASE,
         i64 min_trade_amount=DEFAULT_MIN_TRADE_AMOUNT,
+        size_t num_threads=1,
+        str engine=ENGINE_DFS,
+        str spill_dir='',
+        size_t spill_memory_limit=0,
+        size_t preferred_cycle_length=0,
     ):
         assert base_debtor_id != 0
         assert max_distance_to_base > 0
         assert min_trade_amount > 0
+        assert num_threads > 0
+        assert engine in (ENGINE_DFS, ENGINE_FLOW)
+        assert preferred_cycle_length != 1
         self.base_debtor_info_locator = base_debtor_info_locator
         self.base_debtor_id = base_debtor_id
         self.max_distance_to_base = max_distance_to_base
         self.min_trade_amount = min_trade_amount
+        self.num_threads = num_threads
+        self.engine = engine
+        self.spill_dir = spill_dir
+        self.spill_memory_limit = spill_memory_limit
+        self.preferred_cycle_length = preferred_cycle_length
+        self.cycle_length_histogram = {}
+        self.tradable_currencies_count = 0
+        self.graph_nodes_count = 0
+        self.graph_arcs_count = 0
+        self.takings_records = None
+        self.givings_records = None
+        self.collector_transfers_records = None
+        self.spill_file = None
+        self.spill_runs = []
         self.bid_processor = BidProcessor(
             base_debtor_info_locator,
             base_debtor_id,
@@ -199,9 +293,12 @@ cdef class Solver:
         account will be used for the corresponding trades.
 
         When more than one collector accounts are registered for a
-        given currency, the outgoing transfers to the buyers of this
-        currency will be evenly distributed between the registered
-        collector accounts.
+        given currency, every buyer of this currency will be assigned
+        to the collector account which (at the moment of the
+        assignment) has the smallest total amount to dispatch to its
+        buyers. This way, the outgoing transfers to the buyers will be
+        evenly distributed between the registered collector accounts,
+        even when the bought amounts differ a lot.
         """
         if self.currencies_analysis_done:
             raise RuntimeError(
@@ -209,9 +306,7 @@ cdef class Solver:
                 " analysis."
             )
 
-        self.collector_accounts.insert(
-            CollectorAccount(creditor_id, debtor_id)
-        )
+        self.collector_selectors[debtor_id].add(creditor_id)
 
     cpdef void analyze_currencies(self):
         """Analyze registered currencies.
@@ -229,6 +324,7 @@ cdef class Solver:
             for debtor_id in self.debtor_ids:
                 price = self.bid_processor.get_currency_price(debtor_id)
                 if price > 0.0:
+                    self.currency_prices[debtor_id] = price
                     self.graph.add_currency(
                         debtor_id,  min_trade_amount * price
                     )
@@ -236,6 +332,76 @@ cdef class Solver:
             self.debtor_ids.clear()
             self.currencies_analysis_done = True
 
+    def export_currency_prices(self):
+        """Return the prices of all tradable currencies.
+
+        Returns a (debtor_ids, prices) tuple of `array.array('q')` and
+        `array.array('f')` instances of equal lengths. The returned
+        arrays can be later passed to the `import_currency_prices`
+        method of another solver instance.
+        """
+        self.analyze_currencies()
+        cdef Py_ssize_t n = self.currency_prices.size()
+        cdef array.array debtor_ids = array.array('q')
+        cdef array.array prices = array.array('f')
+        array.resize(debtor_ids, n)
+        array.resize(prices, n)
+        cdef i64[:] d = debtor_ids
+        cdef float[:] p = prices
+        cdef Py_ssize_t i = 0
+
+        for pair in self.currency_prices:
+            d[i] = pair.first
+            p[i] = pair.second
+            i += 1
+
+        return debtor_ids, prices
+
+    def import_currency_prices(
+        self,
+        const i64[:] debtor_ids,
+        const float[:] prices,
+    ):
+        """Declare the prices of all tradable currencies.
+
+        This can be used instead of registering all currencies and
+        analyzing them, when the prices of tradable currencies are
+        already known (see the `export_currency_prices` method). The
+        currencies must not be registered in this case.
+
+        After this method has been called, no currencies or collector
+        accounts can be registered.
+        """
+        if self.currencies_analysis_done:
+            raise RuntimeError(
+                "Currency prices have been imported after currencies"
+                " analysis."
+            )
+        if self.debtor_ids.size() != 0:
+            raise RuntimeError(
+                "Currency prices have been imported after registering"
+                " currencies."
+            )
+        cdef Py_ssize_t n = len(debtor_ids)
+        if len(prices) != n:
+            raise ValueError("arrays of different lengths")
+
+        min_trade_amount = float(self.min_trade_amount)
+        cdef Py_ssize_t i
+
+        for i in range(n):
+            debtor_id = debtor_ids[i]
+            price = prices[i]
+            if not price > 0.0:
+                raise ValueError("invalid price")
+            if self.currency_prices.count(debtor_id) != 0:
+                raise ValueError("duplicated currency")
+
+            self.currency_prices[debtor_id] = price
+            self.graph.add_currency(debtor_id,  min_trade_amount * price)
+
+        self.currencies_analysis_done = True
+
     def register_sell_offer(
         self,
         i64 seller_creditor_id,
@@ -260,7 +426,7 @@ cdef class Solver:
         if not self.currencies_analysis_done:
             self.analyze_currencies()
 
-        price = self.bid_processor.get_currency_price(debtor_id)
+        price = self._get_currency_price(debtor_id)
         if price > 0.0:
             self.graph.add_supply(
                 amount * price, debtor_id, seller_creditor_id
@@ -286,10 +452,96 @@ cdef class Solver:
         if not self.currencies_analysis_done:
             self.analyze_currencies()
 
-        price = self.bid_processor.get_currency_price(debtor_id)
+        price = self._get_currency_price(debtor_id)
         if price > 0.0:
             self.graph.add_demand(amount * price, debtor_id, buyer_creditor_id)
 
+    def register_sell_offers_bulk(
+        self,
+        const i64[:] seller_creditor_ids,
+        const i64[:] debtor_ids,
+        const i64[:] amounts,
+        const i64[:] collector_ids,
+    ):
+        """Declares many sell offers at once.
+
+        This is equivalent to calling the `register_sell_offer` method
+        for each element of the passed arrays, but is much faster. The
+        arrays can be any objects that support the buffer protocol
+        with 64-bit signed integer items (NumPy arrays, or
+        `array.array('q')` for example), and must have equal lengths.
+        """
+        if self.offers_analysis_done:
+            raise RuntimeError(
+                "A sell offer has been registered after offer analysis."
+            )
+        cdef Py_ssize_t n = len(seller_creditor_ids)
+        if not (
+            len(debtor_ids) == n
+            and len(amounts) == n
+            and len(collector_ids) == n
+        ):
+            raise ValueError("arrays of different lengths")
+        if not self.currencies_analysis_done:
+            self.analyze_currencies()
+
+        cdef Digraph graph = self.graph
+        cdef Py_ssize_t i
+        cdef i64 seller_creditor_id
+        cdef i64 debtor_id
+        cdef double price
+
+        with nogil:
+            for i in range(n):
+                seller_creditor_id = seller_creditor_ids[i]
+                debtor_id = debtor_ids[i]
+                price = self._get_currency_price(debtor_id)
+                if price > 0.0:
+                    graph._add_supply(
+                        amounts[i] * price, debtor_id, seller_creditor_id
+                    )
+                    self.changes[Account(seller_creditor_id, debtor_id)] = (
+                        AccountData(0, collector_ids[i])
+                    )
+
+    def register_buy_offers_bulk(
+        self,
+        const i64[:] buyer_creditor_ids,
+        const i64[:] debtor_ids,
+        const i64[:] amounts,
+    ):
+        """Declares many buy offers at once.
+
+        This is equivalent to calling the `register_buy_offer` method
+        for each element of the passed arrays, but is much faster. The
+        arrays can be any objects that support the buffer protocol
+        with 64-bit signed integer items (NumPy arrays, or
+        `array.array('q')` for example), and must have equal lengths.
+        """
+        if self.offers_analysis_done:
+            raise RuntimeError(
+                "A buy offer has been registered after offer analysis."
+            )
+        cdef Py_ssize_t n = len(buyer_creditor_ids)
+        if not (len(debtor_ids) == n and len(amounts) == n):
+            raise ValueError("arrays of different lengths")
+        if not self.currencies_analysis_done:
+            self.analyze_currencies()
+
+        cdef Digraph graph = self.graph
+        cdef Py_ssize_t i
+        cdef i64 debtor_id
+        cdef double price
+
+        with nogil:
+            for i in range(n):
+                debtor_id = debtor_ids[i]
+                price = self._get_currency_price(debtor_id)
+                if price > 0.0:
+                    graph._add_demand(
+                        amounts[i] * price, debtor_id, buyer_creditor_ids[i]
+                    )
+
     cpdef void analyze_offers(self):
         """Analyze registered offers.
 
@@ -302,18 +554,54 @@ cdef class Solver:
         cdef tuple t
         cdef double amount
         cdef i64[:] cycle
+        cdef vector[AccountRecord] empty_seller_collectors
+        cdef bool spilling = len(self.spill_dir) > 0
+        cdef size_t max_changes_size = (
+            self.spill_memory_limit // CHANGES_ENTRY_SIZE
+        )
 
         if not self.offers_analysis_done:
             self.analyze_currencies()
+            self.tradable_currencies_count = self.currency_prices.size()
+            self.graph_nodes_count = self.graph.nodes_count()
+            self.graph_arcs_count = self.graph.arcs_count()
+
+            if spilling:
+                self._move_seller_collectors()
+
+            if self.engine == ENGINE_FLOW:
+                cycles = self.graph.max_volume_cycles()
+            elif self.num_threads > 1:
+                cycles = self.graph.parallel_cycles(
+                    self.num_threads, self.preferred_cycle_length
+                )
+            elif self.preferred_cycle_length != 0:
+                cycles = self.graph.bounded_cycles(
+                    self.preferred_cycle_length
+                )
+            else:
+                cycles = self.graph.cycles()
 
-            while True:
-                t = self.graph.find_cycle()
-                if t is None:
-                    break
+            histogram = self.cycle_length_histogram
+            for t in cycles:
                 amount, cycle = t
                 self._process_cycle(amount, cycle)
-
-            self._calc_collector_transfers()
+                length = len(cycle)
+                histogram[length] = histogram.get(length, 0) + 1
+                if spilling and self.changes.size() > max_changes_size:
+                    self._spill_changes()
+
+            if self.spill_runs:
+                # The trading graph is not needed anymore.
+                self.graph = Digraph()
+                self._spill_changes()
+                self._merge_spilled_changes()
+                self._calc_collector_transfers()
+                self._spill_collector_transfers()
+            else:
+                self._calc_collector_transfers()
+
+            self.seller_collectors.swap(empty_seller_collectors)
             self.offers_analysis_done = True
 
     def takings_iter(self):
@@ -328,6 +616,10 @@ cdef class Solver:
         self.analyze_offers()
         t = AccountChange
 
+        if self.takings_records is not None:
+            yield from _iter_records(t, *self.takings_records)
+            return
+
         for pair in self.changes:
             account = pair.first
             data = pair.second
@@ -351,6 +643,11 @@ cdef class Solver:
         """
         self.analyze_offers()
         t = CollectorTransfer
+
+        if self.collector_transfers_records is not None:
+            yield from _iter_records(t, *self.collector_transfers_records)
+            return
+
         it = self.collector_transfers.begin()
         end = self.collector_transfers.end()
 
@@ -375,6 +672,10 @@ cdef class Solver:
         self.analyze_offers()
         t = AccountChange
 
+        if self.givings_records is not None:
+            yield from _iter_records(t, *self.givings_records)
+            return
+
         for pair in self.changes:
             account = pair.first
             data = pair.second
@@ -386,6 +687,95 @@ cdef class Solver:
                     data.collector_id,
                 )
 
+    def write_checkpoint(self, f):
+        """Write the results of the analysis to a binary file.
+
+        The results (the takings, the collector transfers, and the
+        givings) will be written starting from the current position
+        of the file `f`. Later, the results can be loaded into another
+        solver instance, by calling its `read_checkpoint` method.
+
+        The items in the checkpoint are stored in exactly the same
+        order in which they are returned by the `takings_iter`,
+        `collector_transfers_iter`, and `givings_iter` methods.
+        """
+        self.analyze_offers()
+        cdef size_t takings_count = 0
+        cdef size_t givings_count = 0
+        cdef i64 amount_change
+
+        if self.takings_records is None:
+            for pair in self.changes:
+                amount_change = pair.second.amount_change
+                if amount_change < 0:
+                    takings_count += 1
+                elif amount_change > 0:
+                    givings_count += 1
+            transfers_count = self.collector_transfers.size()
+        else:
+            takings_count = _count_records(*self.takings_records)
+            givings_count = _count_records(*self.givings_records)
+            transfers_count = _count_records(
+                *self.collector_transfers_records
+            )
+
+        for count in [takings_count, transfers_count, givings_count]:
+            f.write(count.to_bytes(8, "little"))
+
+        if self.takings_records is None:
+            self._write_changes_checkpoint(f, True)
+            _write_transfers(f, self.collector_transfers)
+            self._write_changes_checkpoint(f, False)
+        else:
+            for records in [
+                self.takings_records,
+                self.collector_transfers_records,
+                self.givings_records,
+            ]:
+                _copy_records(f, *records)
+
+    def read_checkpoint(self, f):
+        """Load the results of an analysis from a binary file.
+
+        The results must have been written by the `write_checkpoint`
+        method of another solver instance, starting from the current
+        position of the file `f`. The file must remain open for as
+        long as the results are being used. Note that the cycle length
+        histogram is not saved in checkpoints.
+
+        This can be used instead of registering currencies and offers,
+        and analyzing them. No currencies, collector accounts, or
+        offers can be registered after this method has been called.
+        """
+        if self.currencies_analysis_done or self.debtor_ids.size() != 0:
+            raise RuntimeError(
+                "A checkpoint has been read after registering currencies."
+            )
+        offset = f.tell()
+        header = f.read(CHECKPOINT_HEADER_SIZE)
+        if len(header) != CHECKPOINT_HEADER_SIZE:
+            raise ValueError("invalid checkpoint")
+
+        counts = [
+            int.from_bytes(header[i:i + 8], "little")
+            for i in range(0, CHECKPOINT_HEADER_SIZE, 8)
+        ]
+        offsets = []
+        offset += CHECKPOINT_HEADER_SIZE
+        for count in counts:
+            offsets.append(offset)
+            offset += count * sizeof(AccountRecord)
+
+        if f.seek(0, os.SEEK_END) < offset:
+            raise ValueError("invalid checkpoint")
+
+        self.takings_records = (f, offsets[0], counts[0])
+        self.collector_transfers_records = (f, offsets[1], counts[1])
+        self.givings_records = (f, offsets[2], counts[2])
+        self.graph = Digraph()
+        self.currencies_analysis_done = True
+        self.offers_analysis_done = True
+
     cdef void _process_cycle(self, double amount, i64[:] cycle):
         cdef int n = len(cycle)
         cdef int i = 0
@@ -395,15 +785,20 @@ cdef class Solver:
             debtor_id = cycle[i]
             giver_data = &self.changes[Account(cycle[i - 1], debtor_id)]
             if giver_data.collector_id == 0:
-                raise RuntimeError("invalid collector_id")
+                # The seller's account change has been spilled to disk.
+                giver_data.collector_id = find_collector_id(
+                    self.seller_collectors, cycle[i - 1], debtor_id
+                )
+                if giver_data.collector_id == 0:
+                    raise RuntimeError("invalid collector_id")
 
             taker_data = &self.changes[Account(cycle[i + 1], debtor_id)]
             if taker_data.collector_id == 0:
-                taker_data.collector_id = self._get_random_collector_id(
+                taker_data.collector_id = self._select_collector_id(
                     giver_data.collector_id, debtor_id
                 )
 
-            price = self.bid_processor.get_currency_price(debtor_id)
+            price = self._get_currency_price(debtor_id)
             amt = calc_amt(amount, price)
 
             # If the transferring `amt` would cause an i64 overflow,
@@ -418,11 +813,16 @@ cdef class Solver:
                 debtor_id,
                 amt,
             )
+            self._add_collector_load(taker_data.collector_id, debtor_id, amt)
 
             giver_data.amount_change -= amt
             taker_data.amount_change += amt
             i += 2
 
+    cdef inline float _get_currency_price(self, i64 debtor_id) noexcept nogil:
+        it = self.currency_prices.find(debtor_id)
+        return NAN if it == self.currency_prices.end() else deref(it).second
+
     cdef i64 _update_collector(self, i64 creditor_id, i64 debtor_id, i64 amt):
         account = Account(creditor_id, debtor_id)
         amount_ptr = &self.collection_amounts[account]
@@ -522,34 +922,324 @@ cdef class Solver:
                     raise RuntimeError("can not equalize collectors")
                 postincrement(takers.first)
 
-    @cython.cdivision(True)
-    cdef i64 _get_random_collector_id(
+    cdef _move_seller_collectors(self):
+        """Move the collector IDs of the sellers to a sorted array,
+        and release the memory occupied by the account changes.
+
+        This must be done before any trading cycles have been
+        processed, when the account changes contain only the sellers.
+        """
+        cdef unordered_map[Account, AccountData] empty_changes
+
+        self.seller_collectors.reserve(self.changes.size())
+        it = self.changes.begin()
+        while it != self.changes.end():
+            self.seller_collectors.push_back(
+                AccountRecord(
+                    deref(it).first.creditor_id,
+                    deref(it).first.debtor_id,
+                    0,
+                    deref(it).second.collector_id,
+                )
+            )
+            it = self.changes.erase(it)
+
+        sort(self.seller_collectors.begin(), self.seller_collectors.end())
+        self.changes.swap(empty_changes)
+
+    cdef _spill_changes(self):
+        """Write the account changes to the spill file, and release the
+        memory occupied by them.
+        """
+        cdef vector[AccountRecord] records
+        cdef unordered_map[Account, AccountData] empty_changes
+        cdef size_t chunk_size = SPILL_CHUNK_SIZE
+
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(dir=self.spill_dir)
+
+        # Erase the account changes one by one, as they are being
+        # written, so that the memory consumption does not grow.
+        records.reserve(min(chunk_size, self.changes.size()))
+        it = self.changes.begin()
+        while it != self.changes.end():
+            if deref(it).second.amount_change != 0:
+                records.push_back(
+                    AccountRecord(
+                        deref(it).first.creditor_id,
+                        deref(it).first.debtor_id,
+                        deref(it).second.amount_change,
+                        deref(it).second.collector_id,
+                    )
+                )
+                if records.size() >= chunk_size:
+                    self._write_spill_run(records)
+            it = self.changes.erase(it)
+
+        self._write_spill_run(records)
+
+        # Swapping with an empty container guarantees that the memory
+        # will be actually released.
+        self.changes.swap(empty_changes)
+
+    cdef _write_spill_run(self, vector[AccountRecord]& records):
+        if records.size() > 0:
+            f = self.spill_file
+            offset = f.seek(0, os.SEEK_END)
+            self.spill_runs.append((f, offset, records.size()))
+            self._write_account_records(f, records)
+
+    cdef _merge_spilled_changes(self):
+        """Merge the sorted runs from the spill file, adding up the
+        changes of each account, and write the takings and the givings
+        to separate temporary files.
+        """
+        cdef AccountRecordMerger merger
+        cdef vector[AccountRecord] takings
+        cdef vector[AccountRecord] givings
+        cdef size_t chunk_size = SPILL_CHUNK_SIZE
+        cdef const unsigned char[::1] data
+        cdef const AccountRecord* r
+        cdef i64 creditor_id = 0
+        cdef i64 debtor_id = 0
+        cdef i64 amount_change = 0
+        cdef i64 collector_id = 0
+        cdef bool has_account = False
+
+        takings_file = tempfile.TemporaryFile(dir=self.spill_dir)
+        givings_file = tempfile.TemporaryFile(dir=self.spill_dir)
+        takings.reserve(chunk_size)
+        givings.reserve(chunk_size)
+
+        f = self.spill_file
+        size = f.seek(0, os.SEEK_END)
+        m = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+        view = memoryview(m)
+        try:
+            data = view
+            for _, offset, count in self.spill_runs:
+                merger.add_run(<const AccountRecord*>&data[offset], count)
+
+            while True:
+                r = merger.next()
+                if (
+                    r != NULL
+                    and has_account
+                    and r.debtor_id == debtor_id
+                    and r.creditor_id == creditor_id
+                ):
+                    if r.collector_id != collector_id:
+                        # After a spill, the buyer has been assigned
+                        # to another collector account. Reassign the
+                        # amount to the first collector account.
+                        from_ptr = &self.collection_amounts[
+                            Account(r.collector_id, debtor_id)
+                        ]
+                        to_ptr = &self.collection_amounts[
+                            Account(collector_id, debtor_id)
+                        ]
+                        from_ptr[0] = deref(from_ptr) + r.amount_change
+                        to_ptr[0] = deref(to_ptr) - r.amount_change
+                    amount_change += check_add(
+                        amount_change, r.amount_change
+                    )
+                    continue
+
+                if has_account and amount_change != 0:
+                    records = &takings if amount_change < 0 else &givings
+                    records.push_back(
+                        AccountRecord(
+                            creditor_id,
+                            debtor_id,
+                            amount_change,
+                            collector_id,
+                        )
+                    )
+                    if records.size() >= chunk_size:
+                        _write_records(
+                            takings_file if amount_change < 0
+                            else givings_file,
+                            deref(records),
+                        )
+                        records.clear()
+
+                if r == NULL:
+                    break
+
+                creditor_id = r.creditor_id
+                debtor_id = r.debtor_id
+                amount_change = r.amount_change
+                collector_id = r.collector_id
+                has_account = True
+        finally:
+            data = None
+            view.release()
+            m.close()
+
+        _write_records(takings_file, takings)
+        _write_records(givings_file, givings)
+        self.takings_records = (takings_file, 0, -1)
+        self.givings_records = (givings_file, 0, -1)
+        self.spill_runs = []
+        self.spill_file.close()
+        self.spill_file = None
+
+    cdef _spill_collector_transfers(self):
+        """Move the collector transfers to a temporary file, and
+        release the memory occupied by them, and by the collection
+        amounts.
+        """
+        cdef unordered_map[Account, i64] empty_collection_amounts
+        cdef vector[Transfer] empty_collector_transfers
+
+        f = tempfile.TemporaryFile(dir=self.spill_dir)
+        _write_transfers(f, self.collector_transfers)
+        self.collector_transfers_records = (f, 0, -1)
+
+        # Swapping with empty containers guarantees that the memory
+        # will be actually released.
+        self.collection_amounts.swap(empty_collection_amounts)
+        self.collector_transfers.swap(empty_collector_transfers)
+
+    cdef _write_account_records(self, f, vector[AccountRecord]& records):
+        sort(records.begin(), records.end())
+        _write_records(f, records)
+        records.clear()
+
+    cdef _write_changes_checkpoint(self, f, bool takings):
+        cdef vector[AccountRecord] records
+        cdef size_t chunk_size = SPILL_CHUNK_SIZE
+        cdef i64 amount_change
+
+        records.reserve(chunk_size)
+        for pair in self.changes:
+            amount_change = pair.second.amount_change
+            if (amount_change < 0) if takings else (amount_change > 0):
+                records.push_back(
+                    AccountRecord(
+                        pair.first.creditor_id,
+                        pair.first.debtor_id,
+                        amount_change,
+                        pair.second.collector_id,
+                    )
+                )
+                if records.size() >= chunk_size:
+                    _write_records(f, records)
+                    records.clear()
+
+        _write_records(f, records)
+
+    cdef i64 _select_collector_id(
         self,
         i64 giver_collector_id,
         i64 debtor_id
     ):
-        cdef size_t count
-        cdef int n
-
-        account = CollectorAccount(giver_collector_id, debtor_id)
-        count = self.collector_accounts.count(account)
-
-        if count == 1:
-            # There is only one matching collector account. (This
-            # should be by far the most common case.)
-            return deref(self.collector_accounts.find(account)).creditor_id
-        elif count > 1:
-            # Randomly select one of the matching collector accounts.
-            n = rand() % count
-            pair = self.collector_accounts.equal_range(account)
-            it = pair.first
-            while n > 0:
-                postincrement(it)
-                n -= 1
-            return deref(it).creditor_id
-        else:
+        # The least loaded collector account for the given currency
+        # is selected, so that every collector account gets roughly
+        # the same total amount to dispatch to its buyers.
+        it = self.collector_selectors.find(debtor_id)
+        if it == self.collector_selectors.end():
             # There are no matching collector accounts. Normally this
             # should never happen. Nevertheless, using the giver's
             # collector account to pay the taker seems to be a pretty
             # reliable fallback.
             return giver_collector_id
+
+        return deref(it).second.select(giver_collector_id)
+
+    cdef void _add_collector_load(
+        self,
+        i64 collector_id,
+        i64 debtor_id,
+        i64 amt,
+    ):
+        it = self.collector_selectors.find(debtor_id)
+        if it != self.collector_selectors.end():
+            deref(it).second.add_load(collector_id, amt)
+
+
+cdef _write_transfers(f, vector[Transfer]& transfers):
+    # The transfers are written in chunks, so as to avoid creating a
+    # huge `bytes` object.
+    cdef size_t n = transfers.size()
+    cdef size_t chunk_size = SPILL_CHUNK_SIZE
+    cdef size_t i = 0
+    cdef size_t count
+
+    while i < n:
+        count = min(chunk_size, n - i)
+        f.write(
+            PyBytes_FromStringAndSize(
+                <char*>&transfers[i],
+                count * sizeof(Transfer),
+            )
+        )
+        i += count
+
+
+cdef _write_records(f, vector[AccountRecord]& records):
+    f.write(
+        PyBytes_FromStringAndSize(
+            <char*>records.data(),
+            records.size() * sizeof(AccountRecord),
+        )
+    )
+
+
+def _count_records(f, Py_ssize_t offset=0, Py_ssize_t count=-1):
+    if count < 0:
+        count = (f.seek(0, os.SEEK_END) - offset) // sizeof(AccountRecord)
+    return count
+
+
+def _copy_records(dest, f, Py_ssize_t offset=0, Py_ssize_t count=-1):
+    """Copy the records stored in a spill file, or in a checkpoint
+    file, to the file `dest`.
+
+    The records start at the given byte `offset`. When `count` is
+    negative, all records until the end of the file will be copied.
+    """
+    cdef Py_ssize_t size = (
+        _count_records(f, offset, count) * sizeof(AccountRecord)
+    )
+    cdef Py_ssize_t chunk_size
+
+    f.seek(offset)
+    while size > 0:
+        chunk_size = min(size, COPY_CHUNK_SIZE)
+        chunk = f.read(chunk_size)
+        if len(chunk) != chunk_size:
+            raise ValueError("invalid checkpoint")
+        dest.write(chunk)
+        size -= chunk_size
+
+
+def _iter_records(t, f, Py_ssize_t offset=0, Py_ssize_t count=-1):
+    """Iterate over the records stored in a spill file, or in a
+    checkpoint file.
+
+    Each record consists of four `i64` numbers, which will be passed
+    to `t` to produce the returned item. The records start at the
+    given byte `offset`. When `count` is negative, all records until
+    the end of the file will be iterated over.
+    """
+    cdef const i64[:] data
+    cdef Py_ssize_t i
+
+    count = _count_records(f, offset, count)
+    if count == 0:
+        return
+
+    size = f.seek(0, os.SEEK_END)
+    m = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+    view = memoryview(m)[
+        offset:offset + count * sizeof(AccountRecord)
+    ].cast('q')
+    try:
+        data = view
+        for i in range(0, len(data), 4):
+            yield t(data[i], data[i + 1], data[i + 2], data[i + 3])
+    finally:
+        data = None
+        view.release()
+        m.close()
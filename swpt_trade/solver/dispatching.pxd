@@ -0,0 +1,184 @@
+# distutils: language = c++
+from libcpp cimport bool
+
+cdef extern from * nogil:
+    """
+    #ifndef DISPATCHING_CLASSES_H
+    #define DISPATCHING_CLASSES_H
+
+    #include <cstdint>
+    #include <cstddef>
+    #include <vector>
+
+    typedef long long i64;
+
+    #define DISPATCHING_MAX_I64 0x7fffffffffffffffLL
+
+    // Adds `b` to `a`, and returns the result, exactly like
+    // `swpt_trade.utils.contain_principal_overflow(a + b)` does.
+    inline i64 contain_principal_overflow_add(i64 a, i64 b) {
+      i64 result;
+      if (__builtin_add_overflow(a, b, &result)) {
+        return b > 0 ? DISPATCHING_MAX_I64 : -DISPATCHING_MAX_I64;
+      }
+      return result < -DISPATCHING_MAX_I64 ? -DISPATCHING_MAX_I64 : result;
+    }
+
+    class DispatchingStatusEntry {
+    public:
+      i64 collector_id;
+      i64 debtor_id;
+      i64 amount_to_collect;
+      i64 amount_to_send;
+      i64 amount_to_receive;
+      i64 number_to_receive;
+      i64 amount_to_dispatch;
+      bool used;
+
+      DispatchingStatusEntry()
+        : collector_id(0),
+          debtor_id(0),
+          amount_to_collect(0),
+          amount_to_send(0),
+          amount_to_receive(0),
+          number_to_receive(0),
+          amount_to_dispatch(0),
+          used(false) {
+      }
+    };
+
+    // A hash table with open addressing (linear probing), which
+    // stores `DispatchingStatusEntry`s, keyed by (collector_id,
+    // debtor_id) pairs. All entries are stored in a single flat
+    // array, whose size is always a power of 2.
+    class DispatchingStatusTable {
+    private:
+      std::vector<DispatchingStatusEntry> entries;
+      size_t count;
+      size_t mask;
+
+      static size_t calc_hash(i64 collector_id, i64 debtor_id) {
+        // Combine both numbers, and mix the bits (the finalizer of
+        // SplitMix64).
+        uint64_t h = (uint64_t)collector_id * 0x9e3779b97f4a7c15ULL;
+        h ^= (uint64_t)debtor_id + 0x7f4a7c159e3779b9ULL;
+        h = (h ^ (h >> 30)) * 0xbf58476d1ce4e5b9ULL;
+        h = (h ^ (h >> 27)) * 0x94d049bb133111ebULL;
+        return (size_t)(h ^ (h >> 31));
+      }
+
+      void grow() {
+        std::vector<DispatchingStatusEntry> old_entries(
+          entries.size() * 2
+        );
+        old_entries.swap(entries);
+        mask = entries.size() - 1;
+        for (const DispatchingStatusEntry& e : old_entries) {
+          if (e.used) {
+            size_t i = calc_hash(e.collector_id, e.debtor_id) & mask;
+            while (entries[i].used) {
+              i = (i + 1) & mask;
+            }
+            entries[i] = e;
+          }
+        }
+      }
+
+    public:
+      DispatchingStatusTable()
+        : entries(16), count(0), mask(15) {
+      }
+      size_t size() const {
+        return count;
+      }
+      size_t capacity() const {
+        return entries.size();
+      }
+      const DispatchingStatusEntry* entry_at(size_t i) const {
+        return &entries[i];
+      }
+      DispatchingStatusEntry& get(i64 collector_id, i64 debtor_id) {
+        // Keep the load factor at most 50%.
+        if (2 * (count + 1) > entries.size()) {
+          grow();
+        }
+        size_t i = calc_hash(collector_id, debtor_id) & mask;
+        while (entries[i].used) {
+          DispatchingStatusEntry& e = entries[i];
+          if (e.collector_id == collector_id && e.debtor_id == debtor_id) {
+            return e;
+          }
+          i = (i + 1) & mask;
+        }
+        DispatchingStatusEntry& e = entries[i];
+        e.collector_id = collector_id;
+        e.debtor_id = debtor_id;
+        e.used = true;
+        count++;
+        return e;
+      }
+      void add_collecting(i64 collector_id, i64 debtor_id, i64 amount) {
+        DispatchingStatusEntry& e = get(collector_id, debtor_id);
+        e.amount_to_collect = contain_principal_overflow_add(
+          e.amount_to_collect, amount
+        );
+      }
+      void add_sending(i64 collector_id, i64 debtor_id, i64 amount) {
+        DispatchingStatusEntry& e = get(collector_id, debtor_id);
+        e.amount_to_send = contain_principal_overflow_add(
+          e.amount_to_send, amount
+        );
+      }
+      void add_receiving(i64 collector_id, i64 debtor_id, i64 amount) {
+        DispatchingStatusEntry& e = get(collector_id, debtor_id);
+        e.amount_to_receive = contain_principal_overflow_add(
+          e.amount_to_receive, amount
+        );
+        e.number_to_receive++;
+      }
+      void add_dispatching(i64 collector_id, i64 debtor_id, i64 amount) {
+        DispatchingStatusEntry& e = get(collector_id, debtor_id);
+        e.amount_to_dispatch = contain_principal_overflow_add(
+          e.amount_to_dispatch, amount
+        );
+      }
+    };
+
+    #endif
+    """
+    ctypedef long long i64
+
+    i64 contain_principal_overflow_add(i64, i64) noexcept
+
+    cdef cppclass DispatchingStatusEntry:
+        i64 collector_id
+        i64 debtor_id
+        i64 amount_to_collect
+        i64 amount_to_send
+        i64 amount_to_receive
+        i64 number_to_receive
+        i64 amount_to_dispatch
+        bool used
+
+    cdef cppclass DispatchingStatusTable:
+        """A flat hash table of dispatching statuses.
+
+        The `add_*` methods find (or create) the entry for the given
+        (collector_id, debtor_id) pair, and add the given amount to
+        the corresponding field of the entry. To iterate over all
+        entries, call `entry_at` for every index less than `capacity`,
+        and skip the unused entries.
+        """
+        DispatchingStatusTable() except +
+        size_t size() noexcept
+        size_t capacity() noexcept
+        const DispatchingStatusEntry* entry_at(size_t) noexcept
+        void add_collecting(i64, i64, i64) except +
+        void add_sending(i64, i64, i64) except +
+        void add_receiving(i64, i64, i64) except +
+        void add_dispatching(i64, i64, i64) except +
+
+
+cdef class DispatchingStatuses:
+    cdef readonly int turn_id
+    cdef DispatchingStatusTable* table_ptr
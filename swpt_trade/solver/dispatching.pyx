@@ -0,0 +1,197 @@
+# distutils: language = c++
+from cpython cimport array
+import array
+
+cdef int MAX_I32 = 0x7fffffff
+cdef array.array I64_ARRAY = array.array('q')
+cdef array.array I32_ARRAY = array.array('i')
+
+
+cdef class DispatchingStatuses:
+    """Aggregates the amounts that a given trading turn's collector
+    accounts will collect, send, receive, and dispatch.
+
+    The amounts are aggregated per (collector_id, debtor_id) pair, in
+    a native hash table. The `register_*_bulk` methods accept
+    parallel arrays of collector IDs, debtor IDs, and amounts (any
+    objects supporting the buffer protocol, which contain signed
+    64-bit integers). Overflows are contained exactly like
+    `swpt_trade.utils.contain_principal_overflow` does.
+    """
+    def __cinit__(self, int turn_id):
+        self.turn_id = turn_id
+        self.table_ptr = new DispatchingStatusTable()
+
+    def __dealloc__(self):
+        del self.table_ptr
+
+    def __len__(self):
+        return self.table_ptr.size()
+
+    def register_collecting(self, i64 collector_id, int turn_id,
+                            i64 debtor_id, i64 amount):
+        assert turn_id == self.turn_id
+        self.table_ptr.add_collecting(collector_id, debtor_id, amount)
+
+    def register_sending(self, i64 collector_id, int turn_id,
+                         i64 debtor_id, i64 amount):
+        assert turn_id == self.turn_id
+        self.table_ptr.add_sending(collector_id, debtor_id, amount)
+
+    def register_receiving(self, i64 collector_id, int turn_id,
+                           i64 debtor_id, i64 amount):
+        assert turn_id == self.turn_id
+        self.table_ptr.add_receiving(collector_id, debtor_id, amount)
+
+    def register_dispatching(self, i64 collector_id, int turn_id,
+                             i64 debtor_id, i64 amount):
+        assert turn_id == self.turn_id
+        self.table_ptr.add_dispatching(collector_id, debtor_id, amount)
+
+    def register_collecting_bulk(
+        self,
+        const i64[:] collector_ids,
+        const i64[:] debtor_ids,
+        const i64[:] amounts,
+    ):
+        cdef Py_ssize_t n = _check_lengths(collector_ids, debtor_ids, amounts)
+        cdef Py_ssize_t i
+        with nogil:
+            for i in range(n):
+                self.table_ptr.add_collecting(
+                    collector_ids[i], debtor_ids[i], amounts[i]
+                )
+
+    def register_sending_bulk(
+        self,
+        const i64[:] collector_ids,
+        const i64[:] debtor_ids,
+        const i64[:] amounts,
+    ):
+        cdef Py_ssize_t n = _check_lengths(collector_ids, debtor_ids, amounts)
+        cdef Py_ssize_t i
+        with nogil:
+            for i in range(n):
+                self.table_ptr.add_sending(
+                    collector_ids[i], debtor_ids[i], amounts[i]
+                )
+
+    def register_receiving_bulk(
+        self,
+        const i64[:] collector_ids,
+        const i64[:] debtor_ids,
+        const i64[:] amounts,
+    ):
+        cdef Py_ssize_t n = _check_lengths(collector_ids, debtor_ids, amounts)
+        cdef Py_ssize_t i
+        with nogil:
+            for i in range(n):
+                self.table_ptr.add_receiving(
+                    collector_ids[i], debtor_ids[i], amounts[i]
+                )
+
+    def register_dispatching_bulk(
+        self,
+        const i64[:] collector_ids,
+        const i64[:] debtor_ids,
+        const i64[:] amounts,
+    ):
+        cdef Py_ssize_t n = _check_lengths(collector_ids, debtor_ids, amounts)
+        cdef Py_ssize_t i
+        with nogil:
+            for i in range(n):
+                self.table_ptr.add_dispatching(
+                    collector_ids[i], debtor_ids[i], amounts[i]
+                )
+
+    def statuses_iter(self, size_t batch_size=50000):
+        """Iterate over batches of aggregated statuses, in columnar
+        format.
+
+        Each returned item will be a batch of at most `batch_size`
+        statuses, represented as a (collector_ids, debtor_ids,
+        amounts_to_collect, amounts_to_send, amounts_to_receive,
+        numbers_to_receive, amounts_to_dispatch) tuple of parallel
+        `array.array` instances. The numbers to receive are signed
+        32-bit integers, all other items are signed 64-bit integers.
+        The batches are ready to be passed to `encode_binary_copy`.
+        """
+        if batch_size < 1:
+            raise ValueError("invalid batch_size")
+
+        cdef size_t i = 0
+        cdef size_t count
+        cdef size_t size = min(batch_size, self.table_ptr.size())
+        cdef array.array collector_ids
+        cdef array.array debtor_ids
+        cdef array.array amounts_to_collect
+        cdef array.array amounts_to_send
+        cdef array.array amounts_to_receive
+        cdef array.array numbers_to_receive
+        cdef array.array amounts_to_dispatch
+        cdef const DispatchingStatusEntry* e
+
+        if size == 0:
+            return
+
+        while i < self.table_ptr.capacity():
+            collector_ids = _create_array(I64_ARRAY, size)
+            debtor_ids = _create_array(I64_ARRAY, size)
+            amounts_to_collect = _create_array(I64_ARRAY, size)
+            amounts_to_send = _create_array(I64_ARRAY, size)
+            amounts_to_receive = _create_array(I64_ARRAY, size)
+            numbers_to_receive = _create_array(I32_ARRAY, size)
+            amounts_to_dispatch = _create_array(I64_ARRAY, size)
+            count = 0
+
+            while count < size and i < self.table_ptr.capacity():
+                e = self.table_ptr.entry_at(i)
+                i += 1
+                if e.used:
+                    collector_ids.data.as_longlongs[count] = e.collector_id
+                    debtor_ids.data.as_longlongs[count] = e.debtor_id
+                    amounts_to_collect.data.as_longlongs[count] = (
+                        e.amount_to_collect
+                    )
+                    amounts_to_send.data.as_longlongs[count] = (
+                        e.amount_to_send
+                    )
+                    amounts_to_receive.data.as_longlongs[count] = (
+                        e.amount_to_receive
+                    )
+                    numbers_to_receive.data.as_ints[count] = <int>min(
+                        e.number_to_receive, MAX_I32
+                    )
+                    amounts_to_dispatch.data.as_longlongs[count] = (
+                        e.amount_to_dispatch
+                    )
+                    count += 1
+
+            if count > 0:
+                columns = (
+                    collector_ids,
+                    debtor_ids,
+                    amounts_to_collect,
+                    amounts_to_send,
+                    amounts_to_receive,
+                    numbers_to_receive,
+                    amounts_to_dispatch,
+                )
+                for column in columns:
+                    array.resize(column, count)
+                yield columns
+
+
+cdef array.array _create_array(array.array template, size_t size):
+    return array.clone(template, size, zero=False)
+
+
+cdef Py_ssize_t _check_lengths(
+    const i64[:] collector_ids,
+    const i64[:] debtor_ids,
+    const i64[:] amounts,
+) except -1:
+    cdef Py_ssize_t n = collector_ids.shape[0]
+    if debtor_ids.shape[0] != n or amounts.shape[0] != n:
+        raise ValueError("the arrays differ in length")
+    return n
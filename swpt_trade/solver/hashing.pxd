@@ -0,0 +1,132 @@
+# distutils: language = c++
+
+cdef extern from * nogil:
+    """
+    #ifndef HASHING_CLASSES_H
+    #define HASHING_CLASSES_H
+
+    #include <cstdint>
+    #include <cstddef>
+
+    typedef long long i64;
+    typedef short i16;
+
+    #define MD5_ROTL(x, c) (((x) << (c)) | ((x) >> (32 - (c))))
+
+    static const uint32_t MD5_K[64] = {
+      0xd76aa478, 0xe8c7b756, 0x242070db, 0xc1bdceee,
+      0xf57c0faf, 0x4787c62a, 0xa8304613, 0xfd469501,
+      0x698098d8, 0x8b44f7af, 0xffff5bb1, 0x895cd7be,
+      0x6b901122, 0xfd987193, 0xa679438e, 0x49b40821,
+      0xf61e2562, 0xc040b340, 0x265e5a51, 0xe9b6c7aa,
+      0xd62f105d, 0x02441453, 0xd8a1e681, 0xe7d3fbc8,
+      0x21e1cde6, 0xc33707d6, 0xf4d50d87, 0x455a14ed,
+      0xa9e3e905, 0xfcefa3f8, 0x676f02d9, 0x8d2a4c8a,
+      0xfffa3942, 0x8771f681, 0x6d9d6122, 0xfde5380c,
+      0xa4beea44, 0x4bdecfa9, 0xf6bb4b60, 0xbebfbc70,
+      0x289b7ec6, 0xeaa127fa, 0xd4ef3085, 0x04881d05,
+      0xd9d4d039, 0xe6db99e5, 0x1fa27cf8, 0xc4ac5665,
+      0xf4292244, 0x432aff97, 0xab9423a7, 0xfc93a039,
+      0x655b59c3, 0x8f0ccc92, 0xffeff47d, 0x85845dd1,
+      0x6fa87e4f, 0xfe2ce6e0, 0xa3014314, 0x4e0811a1,
+      0xf7537e82, 0xbd3af235, 0x2ad7d2bb, 0xeb86d391,
+    };
+
+    static const int MD5_S[64] = {
+      7, 12, 17, 22, 7, 12, 17, 22, 7, 12, 17, 22, 7, 12, 17, 22,
+      5, 9, 14, 20, 5, 9, 14, 20, 5, 9, 14, 20, 5, 9, 14, 20,
+      4, 11, 16, 23, 4, 11, 16, 23, 4, 11, 16, 23, 4, 11, 16, 23,
+      6, 10, 15, 21, 6, 10, 15, 21, 6, 10, 15, 21, 6, 10, 15, 21,
+    };
+
+    // Calculates the MD5 hash of the 8-byte big-endian representation
+    // of `n`, and returns the highest 16 bits of the digest as a
+    // signed 16-bit integer.
+    inline i16 calc_i64_hash(i64 n) {
+      // The message fits in a single 64-byte block: 8 bytes of
+      // data, followed by the padding, and the message length in
+      // bits (64), stored as a little-endian 64-bit number.
+      uint32_t m[16] = {0};
+      uint64_t u = (uint64_t)n;
+      uint32_t hi = (uint32_t)(u >> 32);
+      uint32_t lo = (uint32_t)u;
+      m[0] = __builtin_bswap32(hi);
+      m[1] = __builtin_bswap32(lo);
+      m[2] = 0x80;
+      m[14] = 64;
+
+      uint32_t a0 = 0x67452301;
+      uint32_t a = a0;
+      uint32_t b = 0xefcdab89;
+      uint32_t c = 0x98badcfe;
+      uint32_t d = 0x10325476;
+
+      for (int i = 0; i < 64; i++) {
+        uint32_t f;
+        int g;
+        if (i < 16) {
+          f = (b & c) | (~b & d);
+          g = i;
+        } else if (i < 32) {
+          f = (d & b) | (~d & c);
+          g = (5 * i + 1) & 15;
+        } else if (i < 48) {
+          f = b ^ c ^ d;
+          g = (3 * i + 5) & 15;
+        } else {
+          f = c ^ (b | ~d);
+          g = (7 * i) & 15;
+        }
+        f = f + a + MD5_K[i] + m[g];
+        a = d;
+        d = c;
+        c = b;
+        b = b + MD5_ROTL(f, MD5_S[i]);
+      }
+
+      // Only the first two bytes of the digest are needed. They are
+      // the two lowest bytes of the first (little-endian) word.
+      uint32_t first_word = a0 + a;
+      return (i16)(
+        ((first_word & 0xff) << 8) | ((first_word >> 8) & 0xff)
+      );
+    }
+
+    // A small direct-mapped cache for hashes of numbers that repeat
+    // often (collector IDs for example).
+    class HashCache {
+    private:
+      static const size_t SIZE = 256;
+      i64 keys[SIZE];
+      i16 values[SIZE];
+      bool used[SIZE];
+
+    public:
+      HashCache() {
+        for (size_t i = 0; i < SIZE; i++) {
+          used[i] = false;
+        }
+      }
+      i16 calc_hash(i64 n) {
+        size_t i = (size_t)(((uint64_t)n * 0x9e3779b97f4a7c15ULL) >> 56);
+        if (!(used[i] && keys[i] == n)) {
+          keys[i] = n;
+          values[i] = calc_i64_hash(n);
+          used[i] = true;
+        }
+        return values[i];
+      }
+    };
+
+    #endif
+    """
+    ctypedef long long i64
+    ctypedef short i16
+
+    cdef i16 calc_i64_hash(i64) noexcept
+
+    cdef cppclass HashCache:
+        """A small direct-mapped cache of hash values.
+        """
+        HashCache() except +
+        i16 calc_hash(i64) noexcept
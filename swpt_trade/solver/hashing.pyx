@@ -0,0 +1,68 @@
+# distutils: language = c++
+from cpython cimport array
+from threading import Thread
+import array
+
+# When the work is split between several threads, each thread will
+# process at least this many numbers.
+MIN_NUMBERS_PER_THREAD = 50000
+
+
+def calc_hashes(const i64[:] numbers, size_t num_threads=1):
+    """Calculate the hashes of an array of signed 64-bit integers, and
+    return the result as an `array.array` of signed 16-bit integers.
+
+    The hash of each number is equal to the value returned by
+    `swpt_trade.utils.calc_hash` for this number (the highest 16 bits
+    of the MD5 digest of the number's 8-byte big-endian
+    representation). The work can be split between `num_threads`
+    threads.
+    """
+    if num_threads < 1:
+        raise ValueError("invalid num_threads")
+
+    cdef Py_ssize_t n = numbers.shape[0]
+    cdef array.array result = array.clone(array.array("h"), n, zero=False)
+    cdef i16[:] hashes = result
+    cdef Py_ssize_t threads_count = min(
+        <Py_ssize_t>num_threads, max(n // MIN_NUMBERS_PER_THREAD, 1)
+    )
+    cdef Py_ssize_t chunk_size = (n + threads_count - 1) // threads_count
+
+    threads = [
+        Thread(
+            target=_calc_hashes_in_thread,
+            args=(numbers, hashes, i * chunk_size, (i + 1) * chunk_size),
+        )
+        for i in range(1, threads_count)
+    ]
+    for thread in threads:
+        thread.start()
+    _calc_hashes_in_thread(numbers, hashes, 0, chunk_size)
+    for thread in threads:
+        thread.join()
+
+    return result
+
+
+def _calc_hashes_in_thread(
+    const i64[:] numbers,
+    i16[:] hashes,
+    Py_ssize_t start,
+    Py_ssize_t end,
+):
+    with nogil:
+        _calc_hashes(numbers, hashes, start, min(end, numbers.shape[0]))
+
+
+cdef void _calc_hashes(
+    const i64[:] numbers,
+    i16[:] hashes,
+    Py_ssize_t start,
+    Py_ssize_t end,
+) noexcept nogil:
+    cdef HashCache cache
+    cdef Py_ssize_t i
+
+    for i in range(start, end):
+        hashes[i] = cache.calc_hash(numbers[i])
@@ -1,8 +1,9 @@
 # distutils: language = c++
 from libcpp cimport bool
 from libcpp.vector cimport vector
+from libcpp.atomic cimport atomic
 
-cdef extern from *:
+cdef extern from * nogil:
     """
     #ifndef MATCHING_CLASSES_H
     #define MATCHING_CLASSES_H
@@ -12,157 +13,380 @@ cdef extern from *:
     #include <stdexcept>
     #include <limits>
     #include <algorithm>
+    #include <numeric>
 
     typedef long long i64;
     typedef size_t nodestatus;
+    typedef size_t nodeindex;
     const double INF_AMOUNT = std::numeric_limits<double>::infinity();
-
-    class Node;
+    const nodeindex NO_NODE = std::numeric_limits<nodeindex>::max();
 
 
     class Arc {
     public:
-      Node* node_ptr;
+      nodeindex node_index;
       double amount;
-      Arc(Node*, double);
-      Arc(const Arc&);
-      bool operator< (const Arc&) const;
-    };
 
+      Arc()
+        : node_index(NO_NODE), amount(0.0) {
+      }
+      Arc(nodeindex node_index, double amount)
+        : node_index(node_index), amount(amount) {
+      }
+    };
 
-    class Node {
-    private:
-      std::vector<Arc> arcs;
 
+    class CycleList {
     public:
-      const i64 id;
-      const double min_amount;
-      nodestatus status;
-      size_t sort_rank;
+      // The IDs of the nodes in the `i`-th cycle are stored in
+      // `ids[ends[i - 1]]` .. `ids[ends[i] - 1]`.
+      std::vector<double> amounts;
+      std::vector<size_t> ends;
+      std::vector<i64> ids;
 
-      Node(i64 id, double min_amount, nodestatus status)
-          : id(id), min_amount(min_amount) {
-        this->status = status;
-        this->sort_rank = 0;
-      }
-      size_t arcs_count() {
-        return arcs.size();
+      size_t cycles_count() {
+        return amounts.size();
       }
-      Arc& add_arc(Node* node_ptr, double amount) {
-        arcs.push_back(Arc(node_ptr, amount));
-        return arcs.back();
+      void add_cycle(double amount, const std::vector<i64>& cycle_ids) {
+        amounts.push_back(amount);
+        ids.insert(ids.end(), cycle_ids.begin(), cycle_ids.end());
+        ends.push_back(ids.size());
       }
-      Arc& get_arc(size_t index) {
-        return arcs.at(index);
+      void clear() {
+        std::vector<double>().swap(amounts);
+        std::vector<size_t>().swap(ends);
+        std::vector<i64>().swap(ids);
       }
-
-      friend class NodeRegistry;
     };
 
 
-    class NodeRegistry {
+    class CsrGraph {
     private:
-      std::unordered_map<i64, Node*> map;
+      std::unordered_map<i64, nodeindex> currency_indices;
+      std::unordered_map<i64, nodeindex> trader_indices;
+
+      // These are used only until the graph gets compacted.
+      std::vector<nodeindex> arc_sources;
+      std::vector<size_t> arc_counts;
+      bool compacted = false;
+
+      nodeindex add_node(i64 id, double min_amount) {
+        if (compacted) {
+          throw std::runtime_error("add_node called after compaction");
+        }
+        nodeindex node_index = ids.size();
+        ids.push_back(id);
+        min_amounts.push_back(min_amount);
+        statuses.push_back(0);
+        sort_ranks.push_back(0);
+        arc_counts.push_back(0);
+        return node_index;
+      }
+      static nodeindex find_index(
+        const std::unordered_map<i64, nodeindex>& indices,
+        i64 id
+      ) {
+        auto it = indices.find(id);
+        return (it == indices.end()) ? NO_NODE : it->second;
+      }
 
     public:
-      ~NodeRegistry() {
-        for (auto pair = map.begin(); pair != map.end(); ++pair) {
-          delete pair->second;
+      // Node data is kept in parallel arrays, indexed by node index.
+      std::vector<i64> ids;
+      std::vector<double> min_amounts;
+      std::vector<nodestatus> statuses;
+      std::vector<size_t> sort_ranks;
+
+      // After the compaction, the arcs of the node with index `i` are
+      // stored in `arcs[arc_offsets[i]]` .. `arcs[arc_offsets[i + 1] - 1]`.
+      std::vector<size_t> arc_offsets;
+      std::vector<Arc> arcs;
+
+      // After calling `calc_components`, the arcs of the root node
+      // will be grouped by weakly connected components, and the arcs
+      // pointing to the `i`-th component will be stored in
+      // `arcs[component_offsets[i]]` .. `arcs[component_offsets[i + 1] - 1]`.
+      std::vector<size_t> component_offsets;
+
+      bool is_compacted() {
+        return compacted;
+      }
+      size_t nodes_count() {
+        return ids.size();
+      }
+      nodeindex add_currency(i64 id, double min_amount) {
+        nodeindex node_index = add_node(id, min_amount);
+        currency_indices[id] = node_index;
+        return node_index;
+      }
+      nodeindex add_trader(i64 id) {
+        nodeindex node_index = add_node(id, 0.0);
+        trader_indices[id] = node_index;
+        return node_index;
+      }
+      nodeindex get_currency_index(i64 id) {
+        return find_index(currency_indices, id);
+      }
+      nodeindex get_trader_index(i64 id) {
+        return find_index(trader_indices, id);
+      }
+      void add_arc(nodeindex from, nodeindex to, double amount) {
+        if (compacted) {
+          throw std::runtime_error("add_arc called after compaction");
         }
+        if (from >= ids.size() || to >= ids.size()) {
+          throw std::out_of_range("invalid node index");
+        }
+        arc_sources.push_back(from);
+        arcs.push_back(Arc(to, amount));
+        arc_counts[from]++;
       }
-      Node* create_node(i64 id, double min_amount, nodestatus status) {
-        return map[id] = new Node(id, min_amount, status);
+      size_t arcs_count(nodeindex node_index) {
+        if (node_index >= ids.size()) {
+          throw std::out_of_range("invalid node index");
+        }
+        if (compacted) {
+          return arc_offsets[node_index + 1] - arc_offsets[node_index];
+        }
+        return arc_counts[node_index];
       }
-      Node* get_node(i64 id) {
-        try {
-            return map.at(id);
-        } catch (const std::out_of_range& oor) {
-            return NULL;
+      Arc& get_arc(nodeindex node_index, size_t arc_index) {
+        if (!compacted) {
+          throw std::runtime_error("get_arc called before compaction");
+        }
+        if (arc_index >= arcs_count(node_index)) {
+          throw std::out_of_range("invalid arc index");
+        }
+        return arcs[arc_offsets[node_index] + arc_index];
+      }
+      void compact() {
+        // Arrange all arcs in a single contiguous array, so that the
+        // arcs of each node occupy a continuous range. The relative
+        // order of each node's arcs is preserved.
+        if (!compacted) {
+          size_t n = ids.size();
+          arc_offsets.resize(n + 1);
+          arc_offsets[0] = 0;
+          for (nodeindex i = 0; i < n; ++i) {
+            arc_offsets[i + 1] = arc_offsets[i] + arc_counts[i];
+          }
+          std::vector<size_t> positions(arc_offsets.begin(), arc_offsets.end() - 1);
+          std::vector<Arc> sorted_arcs(arcs.size());
+          for (size_t k = 0; k < arcs.size(); ++k) {
+            sorted_arcs[positions[arc_sources[k]]++] = arcs[k];
+          }
+          arcs.swap(sorted_arcs);
+
+          // Free the memory that is not needed anymore.
+          std::vector<nodeindex>().swap(arc_sources);
+          std::vector<size_t>().swap(arc_counts);
+          compacted = true;
         }
       }
       void calc_ranks() {
-        for (auto pair = map.begin(); pair != map.end(); ++pair) {
-          Node* node = pair->second;
-          if (node->min_amount > 0.0) {
+        if (!compacted) {
+          throw std::runtime_error("calc_ranks called before compaction");
+        }
+        size_t n = ids.size();
+        for (nodeindex i = 0; i < n; ++i) {
+          if (min_amounts[i] > 0.0) {
             // This is a currency node. Currencies with high supply
             // should be prioritised.
-            size_t number_of_sellers = node->arcs_count();
-            node->sort_rank = number_of_sellers;
+            size_t number_of_sellers = arc_offsets[i + 1] - arc_offsets[i];
+            sort_ranks[i] = number_of_sellers;
           } else {
             // This is a trader node. Traders that buy currencies
             // with high supply should be prioritised.
             size_t total_number_of_sellers = 0;
-            for (auto it = node->arcs.begin(); it != node->arcs.end(); ++it) {
-              Node* currency = it->node_ptr;
-              total_number_of_sellers += currency->arcs_count();
+            for (size_t k = arc_offsets[i]; k < arc_offsets[i + 1]; ++k) {
+              nodeindex currency = arcs[k].node_index;
+              total_number_of_sellers += (
+                arc_offsets[currency + 1] - arc_offsets[currency]
+              );
             }
-            node->sort_rank = total_number_of_sellers;
+            sort_ranks[i] = total_number_of_sellers;
           }
         }
       }
       void sort_arcs() {
-        for (auto pair = map.begin(); pair != map.end(); ++pair) {
-          Node* node = pair->second;
-          std::sort(node->arcs.begin(), node->arcs.end());
+        if (!compacted) {
+          throw std::runtime_error("sort_arcs called before compaction");
+        }
+        const std::vector<size_t>& ranks = sort_ranks;
+        auto compare = [&ranks](const Arc& a, const Arc& b) {
+          return ranks[a.node_index] > ranks[b.node_index];
+        };
+        size_t n = ids.size();
+        for (nodeindex i = 0; i < n; ++i) {
+          std::stable_sort(
+            arcs.begin() + arc_offsets[i],
+            arcs.begin() + arc_offsets[i + 1],
+            compare
+          );
         }
       }
-    };
-
-
-    inline Arc::Arc(Node* node_ptr, double amount) {
-      this->node_ptr = node_ptr;
-      this->amount = amount;
-    }
+      void sort_arcs_by_amount() {
+        if (!compacted) {
+          throw std::runtime_error("sort_arcs_by_amount called before compaction");
+        }
+        auto compare = [](const Arc& a, const Arc& b) {
+          return a.amount > b.amount;
+        };
+        size_t n = ids.size();
+        for (nodeindex i = 0; i < n; ++i) {
+          std::stable_sort(
+            arcs.begin() + arc_offsets[i],
+            arcs.begin() + arc_offsets[i + 1],
+            compare
+          );
+        }
+      }
+      void calc_components(nodeindex root) {
+        if (!compacted) {
+          throw std::runtime_error("calc_components called before compaction");
+        }
+        size_t n = ids.size();
+        std::vector<nodeindex> parents(n);
+        std::iota(parents.begin(), parents.end(), 0);
+        auto find = [&parents](nodeindex i) {
+          while (parents[i] != i) {
+            parents[i] = parents[parents[i]];
+            i = parents[i];
+          }
+          return i;
+        };
 
-    inline Arc::Arc(const Arc& other) {
-      node_ptr = other.node_ptr;
-      amount = other.amount;
-    }
+        // Ignoring the root node (it is connected to all currencies),
+        // join the nodes connected by arcs.
+        for (nodeindex i = 0; i < n; ++i) {
+          if (i != root) {
+            for (size_t k = arc_offsets[i]; k < arc_offsets[i + 1]; ++k) {
+              nodeindex a = find(i);
+              nodeindex b = find(arcs[k].node_index);
+              if (a != b) {
+                parents[std::max(a, b)] = std::min(a, b);
+              }
+            }
+          }
+        }
 
-    inline bool Arc::operator< (const Arc& other) const {
-      return node_ptr->sort_rank > other.node_ptr->sort_rank;
-    }
+        // Number the components in the order in which the root's arcs
+        // point to them, and then group root's arcs by component,
+        // preserving their relative order.
+        size_t root_begin = arc_offsets[root];
+        size_t root_end = arc_offsets[root + 1];
+        std::vector<size_t> numbers(n, NO_NODE);
+        std::vector<size_t> arc_components(root_end - root_begin);
+        std::vector<size_t> counts;
+        for (size_t k = root_begin; k < root_end; ++k) {
+          nodeindex component_root = find(arcs[k].node_index);
+          if (numbers[component_root] == NO_NODE) {
+            numbers[component_root] = counts.size();
+            counts.push_back(0);
+          }
+          size_t number = numbers[component_root];
+          arc_components[k - root_begin] = number;
+          counts[number]++;
+        }
+        component_offsets.resize(counts.size() + 1);
+        component_offsets[0] = root_begin;
+        for (size_t c = 0; c < counts.size(); ++c) {
+          component_offsets[c + 1] = component_offsets[c] + counts[c];
+        }
+        std::vector<size_t> positions(
+          component_offsets.begin(), component_offsets.end() - 1
+        );
+        std::vector<Arc> root_arcs(arcs.begin() + root_begin, arcs.begin() + root_end);
+        for (size_t k = 0; k < root_arcs.size(); ++k) {
+          arcs[positions[arc_components[k]]++] = root_arcs[k];
+        }
+      }
+    };
 
     #endif
     """
     ctypedef long long i64
     ctypedef size_t nodestatus
+    ctypedef size_t nodeindex
     cdef double INF_AMOUNT
+    cdef nodeindex NO_NODE
 
     cdef cppclass Arc:
-        Node* node_ptr
+        nodeindex node_index
         double amount
-        Arc(Node*, double) except +
-        Arc(const Arc&) except +
-
-    cdef cppclass Node:
-        const i64 id
-        const double min_amount
-        nodestatus status
-        size_t sort_rank
-        Node(i64, double, nodestatus) except +
-        size_t arcs_count() noexcept
-        Arc& add_arc(Node*, double) except +
-        Arc& get_arc(size_t) except +
-
-    cdef cppclass NodeRegistry:
-        NodeRegistry() except +
-        Node* create_node(i64, double, nodestatus) except +
-        Node* get_node(i64) noexcept
-        void calc_ranks() noexcept
+        Arc() noexcept
+        Arc(nodeindex, double) noexcept
+
+    cdef cppclass CycleList:
+        """A list of trading cycles, stored in contiguous arrays.
+        """
+        vector[double] amounts
+        vector[size_t] ends
+        vector[i64] ids
+        size_t cycles_count() noexcept
+        void add_cycle(double, const vector[i64]&) except +
+        void clear() noexcept
+
+    cdef cppclass CsrGraph:
+        """A graph stored in compressed sparse row (CSR) format.
+
+        Nodes are identified by dense indices. The data for each node
+        is stored in several parallel arrays (`ids`, `min_amounts`,
+        `statuses`, `sort_ranks`). Currency nodes always have positive
+        `min_amounts`, and trader nodes always have zero
+        `min_amounts`.
+
+        Arcs can be added to the graph only before the graph has been
+        compacted (by calling the `compact` method). Once compacted,
+        all arcs will be stored in a single contiguous array (`arcs`),
+        and the arcs of each node will occupy a continuous range of
+        this array (determined by the `arc_offsets` array).
+
+        Calling the `calc_components` method finds the weakly connected
+        components of the graph (ignoring the root node), and groups
+        root's arcs by component (see the `component_offsets` array).
+        """
+        vector[i64] ids
+        vector[double] min_amounts
+        vector[nodestatus] statuses
+        vector[size_t] sort_ranks
+        vector[size_t] arc_offsets
+        vector[Arc] arcs
+        vector[size_t] component_offsets
+        CsrGraph() except +
+        bool is_compacted() noexcept
+        size_t nodes_count() noexcept
+        nodeindex add_currency(i64, double) except +
+        nodeindex add_trader(i64) except +
+        nodeindex get_currency_index(i64) noexcept
+        nodeindex get_trader_index(i64) noexcept
+        void add_arc(nodeindex, nodeindex, double) except +
+        size_t arcs_count(nodeindex) except +
+        Arc& get_arc(nodeindex, size_t) except +
+        void compact() except +
+        void calc_ranks() except +
         void sort_arcs() except +
+        void sort_arcs_by_amount() except +
+        void calc_components(nodeindex) except +
 
 
 cdef class Digraph:
-    cdef NodeRegistry currencies
-    cdef NodeRegistry traders
-    cdef vector[Node*] path
-    cdef (Node*, Node*) _ensure_nodes(self, i64, i64)
-    cdef inline bool _is_pristine(self) noexcept
+    cdef CsrGraph csr
+    cdef vector[nodeindex] path
+    cdef vector[CycleList] component_cycles
+    cdef atomic[size_t] next_component
+    cdef size_t max_length
+    cdef int _ensure_nodes(
+        self, i64, i64, nodeindex*, nodeindex*
+    ) except -1 nogil
+    cdef inline bool _is_pristine(self) noexcept nogil
     cdef bool _find_cycle(self) except? False
     cdef object _process_cycle(self)
     cdef void _sort_arcs(self)
+    cdef int _search_components(self) except -1 nogil
     cpdef void add_currency(self, i64, double)
     cpdef void add_supply(self, double, i64, i64)
     cpdef void add_demand(self, double, i64, i64)
+    cdef int _add_supply(self, double, i64, i64) except -1 nogil
+    cdef int _add_demand(self, double, i64, i64) except -1 nogil
     cpdef object find_cycle(self)
@@ -1,6 +1,8 @@
 # distutils: language = c++
 from libcpp.vector cimport vector
+from libcpp.algorithm cimport fill
 from cpython cimport array
+from threading import Thread
 
 # To ensure that we will traverse all the nodes in the graph, we
 # create an artificial node called "the root trader", which wants to
@@ -29,15 +31,306 @@ cdef i64 ROOT_TRADER_ID = 0
 cdef nodestatus NODE_INITIAL_STATUS = 0
 cdef nodestatus NODE_PATH_FLAG = 1
 
+# The default maximum number of Bellman-Ford relaxation passes, which
+# `Digraph.max_volume_cycles` will perform, trying to improve the
+# solution found by the depth-first search.
+DEFAULT_MAX_PASSES = 100
+
+cdef size_t NO_ARC = NO_NODE
+
+# Passed to `search_cycle` when the length of the found cycles should
+# not be limited.
+cdef size_t UNLIMITED_LENGTH = <size_t>-1
+
+
+cdef bool search_cycle(
+    CsrGraph* csr,
+    vector[nodeindex]* path,
+    nodestatus* root_status,
+    size_t root_arcs_begin,
+    size_t root_arcs_end,
+    size_t max_length=UNLIMITED_LENGTH,
+    vector[nodeindex]* visited=NULL,
+) noexcept nogil:
+    # Continues the depth-first traversal of the graph, until a cycle
+    # is found. The first node in the path is the root trader. Only
+    # the root's arcs in the range from `root_arcs_begin` to
+    # `root_arcs_end` will be traversed, and the root's status will
+    # be kept in `root_status`. This allows different parts of the
+    # graph to be traversed independently.
+    #
+    # The path (not counting the root) will not be allowed to grow
+    # longer than `max_length` nodes, so that the found cycles will
+    # not be longer than that. Note that the arcs which have been
+    # skipped because of this, will be skipped until the statuses of
+    # the nodes are reset. When `visited` is not NULL, all nodes that
+    # are added to the path will be also added to `visited`, so that
+    # their statuses can be reset later.
+    cdef size_t* arc_offsets = csr.arc_offsets.data()
+    cdef Arc* arcs = csr.arcs.data()
+    cdef nodestatus* statuses = csr.statuses.data()
+    cdef double* min_amounts = csr.min_amounts.data()
+    cdef nodeindex current_node
+    cdef nodeindex next_node
+    cdef nodestatus* current_status
+    cdef double current_min_amount
+    cdef double amount
+    cdef size_t arcs_start
+    cdef size_t arcs_count
+    cdef size_t next_arc_index
+    cdef Arc* next_arc
+    cdef nodestatus path_flag = NODE_PATH_FLAG
+
+    while path.size() > 0:
+        current_node = path.back()
+        current_min_amount = min_amounts[current_node]
+        if path.size() == 1:
+            current_status = root_status
+            arcs_start = root_arcs_begin
+            arcs_count = root_arcs_end - root_arcs_begin
+        else:
+            current_status = &statuses[current_node]
+            arcs_start = arc_offsets[current_node]
+            arcs_count = arc_offsets[current_node + 1] - arcs_start
+        next_arc_index = (
+            (current_status[0] >> 1)
+            # If the "path" flag of the current node is set, this
+            # means that the arc that we followed turned out to be
+            # a dead end. Therefore, now we must skip it.
+            + (current_status[0] & path_flag)
+        )
+        next_node = NO_NODE
+
+        while next_arc_index < arcs_count:
+            next_arc = &arcs[arcs_start + next_arc_index]
+            amount = next_arc.amount
+            if (
+                amount >= current_min_amount
+                and amount >= min_amounts[next_arc.node_index]
+                and (
+                    path.size() <= max_length
+                    or statuses[next_arc.node_index] & path_flag != 0
+                )
+            ):
+                next_node = next_arc.node_index
+                break
+            next_arc_index += 1  # Invalid (or too far) arc. Skip it.
+
+        if next_node == NO_NODE:
+            # The current node is a dead end.
+            current_status[0] = next_arc_index << 1
+            path.pop_back()
+        elif statuses[next_node] & path_flag == 0:
+            # We follow the arc, moving to the next node.
+            current_status[0] = (next_arc_index << 1) | path_flag
+            path.push_back(next_node)
+            if visited != NULL:
+                visited.push_back(next_node)
+        else:
+            # We've got a cycle!
+            current_status[0] = next_arc_index << 1
+            return True
+
+    # There are no cycles.
+    return False
+
+
+cdef double take_cycle(
+    CsrGraph* csr,
+    vector[nodeindex]* path,
+    vector[i64]* cycle_ids,
+) noexcept nogil:
+    # Removes the cycle that has just been found from the path,
+    # subtracts cycle's amount from cycle's arcs, and writes the IDs
+    # of cycle's nodes to `cycle_ids` (starting with a currency).
+    # Returns cycle's amount.
+    cdef size_t* arc_offsets = csr.arc_offsets.data()
+    cdef Arc* all_arcs = csr.arcs.data()
+    cdef nodestatus* statuses = csr.statuses.data()
+    cdef i64* ids = csr.ids.data()
+    cdef nodeindex current_node = path.back()
+    cdef size_t offset = 1 if csr.min_amounts[current_node] > 0.0 else 0
+    cdef size_t arc_index = statuses[current_node] >> 1
+    cdef nodeindex last_node = (
+        all_arcs[arc_offsets[current_node] + arc_index].node_index
+    )
+    cdef vector[Arc*] arcs
+    arcs.reserve(1000)
+
+    cdef Arc* arc
+    cdef double cycle_amount = INF_AMOUNT
+
+    while True:
+        arc = &all_arcs[arc_offsets[current_node] + arc_index]
+        arcs.push_back(arc)
+
+        if arc.amount < cycle_amount:
+            cycle_amount = arc.amount
+
+        if current_node == last_node:
+            break
+
+        path.pop_back()
+        current_node = path.back()
+        arc_index = statuses[current_node] >> 1
+        statuses[current_node] = arc_index << 1  # Clears the "path" flag.
+
+    cdef size_t cycle_length  = arcs.size()
+    cdef size_t i
+    cycle_ids.resize(cycle_length)
+
+    for i in range(cycle_length):
+        arc = arcs[i]
+        arc.amount -= cycle_amount
+        cycle_ids[0][(i + offset) % cycle_length] = ids[arc.node_index]
+
+    return cycle_amount
+
+
+cdef void reset_statuses(
+    CsrGraph* csr,
+    vector[nodeindex]* nodes,
+) noexcept nogil:
+    # Resets the statuses of the given nodes, and clears the vector.
+    cdef nodestatus* statuses = csr.statuses.data()
+    cdef size_t i
+
+    for i in range(nodes.size()):
+        statuses[nodes[0][i]] = NODE_INITIAL_STATUS
+    nodes.clear()
+
+
+cdef size_t cancel_negative_cycles(
+    CsrGraph* csr,
+    nodeindex root,
+    const double* capacities,
+    double* flows,
+    size_t max_passes,
+) noexcept nogil:
+    # Tries to increase the total flow of the given circulation, by
+    # finding and cancelling negative cycles in the residual graph.
+    # Each forward residual arc costs -1, and each backward residual
+    # arc costs +1, so that a negative cycle always increases the
+    # total flow. Residual capacities smaller than arc's currency
+    # `min_amount` are ignored, because trades for lesser amounts
+    # would not be arranged anyway. The root node and its arcs are
+    # ignored. Returns the number of performed relaxation passes.
+    cdef size_t n = csr.ids.size()
+    cdef size_t m = csr.arcs.size()
+    cdef size_t* arc_offsets = csr.arc_offsets.data()
+    cdef Arc* arcs = csr.arcs.data()
+    cdef double* min_amounts = csr.min_amounts.data()
+    cdef vector[nodeindex] sources = vector[nodeindex](m, root)
+    cdef vector[double] thresholds = vector[double](m, INF_AMOUNT)
+    cdef vector[i64] distances = vector[i64](n, 0)
+    cdef vector[size_t] predecessors = vector[size_t](n, NO_ARC)
+    cdef vector[size_t] stamps = vector[size_t](n, 0)
+    cdef vector[size_t] cycle_arcs
+    cdef size_t passes = 0
+    cdef size_t k, r, pred
+    cdef nodeindex u, v, w, tail
+    cdef double threshold, delta
+    cdef bool changed, cycles_found
+
+    for u in range(n):
+        if u != root:
+            for k in range(arc_offsets[u], arc_offsets[u + 1]):
+                v = arcs[k].node_index
+                sources[k] = u
+                threshold = max(min_amounts[u], min_amounts[v])
+                if capacities[k] >= threshold:
+                    thresholds[k] = threshold
+
+    while passes < max_passes:
+        passes += 1
+        changed = False
+
+        # A Bellman-Ford relaxation pass. The residual arc `k` in the
+        # forward direction is denoted as `2 * k`, and in the backward
+        # direction -- as `2 * k + 1`.
+        for k in range(m):
+            u = sources[k]
+            if u != root:
+                v = arcs[k].node_index
+                threshold = thresholds[k]
+                if (
+                    capacities[k] - flows[k] >= threshold
+                    and distances[u] - 1 < distances[v]
+                ):
+                    distances[v] = distances[u] - 1
+                    predecessors[v] = 2 * k
+                    changed = True
+                if (
+                    flows[k] >= threshold
+                    and distances[v] + 1 < distances[u]
+                ):
+                    distances[u] = distances[v] + 1
+                    predecessors[u] = 2 * k + 1
+                    changed = True
+
+        if not changed:
+            break  # There are no negative cycles.
+
+        # Any cycle formed by the predecessor arcs is a negative
+        # cycle. To find such cycles, we follow the predecessor arcs
+        # from each node, stamping the visited nodes. All found cycles
+        # are node-disjoint, and therefore can be cancelled together.
+        cycles_found = False
+        fill(stamps.begin(), stamps.end(), 0)
+        for w in range(n):
+            v = w
+            while stamps[v] == 0 and predecessors[v] != NO_ARC:
+                stamps[v] = w + 1
+                pred = predecessors[v]
+                k = pred >> 1
+                v = sources[k] if pred & 1 == 0 else arcs[k].node_index
+            if stamps[v] == w + 1:
+                # Found a cycle, which contains the node `v`.
+                cycles_found = True
+                cycle_arcs.clear()
+                tail = v
+                while True:
+                    pred = predecessors[tail]
+                    cycle_arcs.push_back(pred)
+                    k = pred >> 1
+                    tail = sources[k] if pred & 1 == 0 else arcs[k].node_index
+                    if tail == v:
+                        break
+
+                # Cancel the cycle.
+                delta = INF_AMOUNT
+                for r in range(cycle_arcs.size()):
+                    pred = cycle_arcs[r]
+                    k = pred >> 1
+                    delta = min(
+                        delta,
+                        capacities[k] - flows[k] if pred & 1 == 0 else flows[k],
+                    )
+                for r in range(cycle_arcs.size()):
+                    pred = cycle_arcs[r]
+                    k = pred >> 1
+                    if pred & 1 == 0:
+                        flows[k] += delta
+                    else:
+                        flows[k] -= delta
+
+        if cycles_found:
+            fill(distances.begin(), distances.end(), 0)
+            fill(predecessors.begin(), predecessors.end(), NO_ARC)
+
+    return passes
+
 
 cdef class Digraph:
     """A directed graph of trading offers.
+
+    The graph is stored in compressed sparse row (CSR) format: nodes
+    are identified by dense indices, and all arcs are stored in a
+    single contiguous array. The root trader always has index 0.
     """
 
     def __cinit__(self):
-        root_trader = self.traders.create_node(
-            ROOT_TRADER_ID, 0.0, NODE_INITIAL_STATUS
-        )
+        root_trader = self.csr.add_trader(ROOT_TRADER_ID)
         self.path.push_back(root_trader)
 
     cpdef void add_currency(self, i64 currency_id, double min_amount):
@@ -49,16 +342,14 @@ cdef class Digraph:
         """
         if not self._is_pristine():
             raise RuntimeError("The graph traversal has already started.")
-        if self.currencies.get_node(currency_id) != NULL:
+        if self.csr.get_currency_index(currency_id) != NO_NODE:
             raise ValueError("duplicated currency")
         if not min_amount > 0.0:
             raise ValueError("invalid min_amount")
 
-        currency = self.currencies.create_node(
-            currency_id, min_amount, NODE_INITIAL_STATUS
-        )
+        currency = self.csr.add_currency(currency_id, min_amount)
         root_trader = self.path.front()
-        root_trader.add_arc(currency, INF_AMOUNT)
+        self.csr.add_arc(root_trader, currency, INF_AMOUNT)
 
     def get_min_amount(self, i64 currency_id):
         """Return the `min_amount` set for a given currency.
@@ -66,33 +357,39 @@ cdef class Digraph:
         Raises a `ValueError` if the passed currency ID does not
         correspond to a known currency.
         """
-        currency = self.currencies.get_node(currency_id)
-        if currency == NULL:
+        currency = self.csr.get_currency_index(currency_id)
+        if currency == NO_NODE:
             raise ValueError("invalid currency")
 
-        return currency.min_amount
+        return self.csr.min_amounts[currency]
+
+    def nodes_count(self):
+        """Return the number of nodes in the graph (currencies and
+        traders, including the root trader).
+        """
+        return self.csr.nodes_count()
+
+    def arcs_count(self):
+        """Return the number of arcs in the graph (including the arcs
+        from the root trader to the currencies).
+
+        Note that arcs are not removed when trading cycles are found,
+        so the returned number does not change after the traversal of
+        the graph has started.
+        """
+        return self.csr.arcs.size()
 
     cpdef void add_supply(self, double amount, i64 currency_id, i64 seller_id):
         """Declares that a given seller wants to sell a given amount
         of a given currency.
         """
-        if not self._is_pristine():
-            raise RuntimeError("The graph traversal has already started.")
-        if seller_id == ROOT_TRADER_ID:
-            raise ValueError("invalid seller ID")
-
-        currency, seller = self._ensure_nodes(currency_id, seller_id)
-        currency.add_arc(seller, amount)
+        self._add_supply(amount, currency_id, seller_id)
 
     cpdef void add_demand(self, double amount, i64 currency_id, i64 buyer_id):
         """Declares that a given buyer wants to buy a given amount of
         a given currency.
         """
-        if not self._is_pristine():
-            raise RuntimeError("The graph traversal has already started.")
-
-        currency, buyer = self._ensure_nodes(currency_id, buyer_id)
-        buyer.add_arc(currency, amount)
+        self._add_demand(amount, currency_id, buyer_id)
 
     cpdef object find_cycle(self):
         """Try to find a trading cycle in the graph.
@@ -151,113 +448,348 @@ cdef class Digraph:
         while cycle := self.find_cycle():
             yield cycle
 
-    cdef object _process_cycle(self):
-        cdef Node* current_node = self.path.back()
-        cdef size_t offset = 1 if current_node.min_amount > 0.0 else 0
-        cdef size_t arc_index = current_node.status >> 1
-        cdef Node* last_node = current_node.get_arc(arc_index).node_ptr
-        cdef vector[Arc*] arcs
-        arcs.reserve(1000)
+    def bounded_cycles(self, size_t max_length):
+        """Iterate over all trading cycles in the graph, yielding
+        short cycles first.
+
+        First, a depth-limited search is performed, which yields only
+        cycles containing at most `max_length` nodes (currencies and
+        traders). Then, the search continues without limits, yielding
+        the remaining (longer) cycles. Note that the depth-limited
+        search is greedy, and therefore it is not guaranteed to find
+        all possible short cycles.
+
+        Note that this method can not be called after the graph
+        traversal has been started by calling `find_cycle()`. Once the
+        returned iterator has been exhausted, next calls to
+        `graph.bounded_cycles()` or `graph.cycles()` will return an
+        empty iterator.
+        """
+        if max_length < 2:
+            raise ValueError("invalid max_length")
+        if self.path.size() == 0:
+            return
+        if not self._is_pristine():
+            raise RuntimeError("The graph traversal has already started.")
+
+        cdef nodeindex root = 0
+        cdef CsrGraph* csr = &self.csr
+        cdef vector[nodeindex] visited
+        self._sort_arcs()
+
+        while search_cycle(
+                csr,
+                &self.path,
+                &csr.statuses[root],
+                csr.arc_offsets[root],
+                csr.arc_offsets[root + 1],
+                max_length,
+                &visited,
+        ):
+            yield self._process_cycle()
+
+        visited.push_back(root)
+        reset_statuses(csr, &visited)
+        self.path.push_back(root)
+        yield from self.cycles()
+
+    def max_volume_cycles(self, size_t max_passes=DEFAULT_MAX_PASSES):
+        """Iterate over trading cycles in the graph, trying to
+        maximize the total traded volume.
+
+        The trading graph is treated as a flow network, where every
+        offer is an arc with capacity equal to the offered amount.
+        First, a depth-first search finds a feasible set of trading
+        cycles (exactly like the `find_cycle()` method does). Then,
+        the resulting circulation is improved by cancelling
+        negative cycles in the residual graph (each trade costs -1),
+        performing at most `max_passes` Bellman-Ford relaxation
+        passes. Finally, the improved circulation is decomposed into
+        trading cycles. If the improved solution turns out to trade a
+        smaller total volume than the initial one (this may happen,
+        because flows for amounts smaller than the currencies'
+        `min_amount` are ignored during the decomposition), the
+        initial solution will be used.
+
+        Note that this method can not be called after the graph
+        traversal has been started by calling `find_cycle()`. Once the
+        returned iterator has been exhausted, next calls to
+        `graph.max_volume_cycles()` or `graph.cycles()` will return an
+        empty iterator.
+        """
+        if self.path.size() == 0:
+            return
+        if not self._is_pristine():
+            raise RuntimeError("The graph traversal has already started.")
 
-        cdef Arc* arc
-        cdef double cycle_amount = INF_AMOUNT
+        cdef nodeindex root = 0
+        cdef CsrGraph* csr = &self.csr
+        self._sort_arcs()
 
-        while True:
-            arc = &current_node.get_arc(arc_index)
-            arcs.push_back(arc)
+        cdef size_t m = csr.arcs.size()
+        cdef vector[double] capacities = vector[double](m)
+        cdef vector[double] flows = vector[double](m, 0.0)
+        cdef size_t k
+        for k in range(m):
+            capacities[k] = csr.arcs[k].amount
 
-            if arc.amount < cycle_amount:
-                cycle_amount = arc.amount
+        initial_cycles, initial_volume = _collect_cycles(self.cycles())
 
-            if current_node == last_node:
-                break
+        cdef size_t root_end = csr.arc_offsets[root + 1]
+        for k in range(root_end, m):
+            flows[k] = capacities[k] - csr.arcs[k].amount
+
+        with nogil:
+            cancel_negative_cycles(
+                csr, root, capacities.data(), flows.data(), max_passes
+            )
 
-            self.path.pop_back()
-            current_node = self.path.back()
-            arc_index = current_node.status >> 1
-            current_node.status = arc_index << 1  # Clears the "path" flag.
+        # Decompose the improved circulation into trading cycles,
+        # doing a depth-first search over the flows. Following bigger
+        # flows first, results in less undecomposed flows.
+        for k in range(root_end, m):
+            csr.arcs[k].amount = flows[k]
+        csr.sort_arcs_by_amount()
+        fill(csr.statuses.begin(), csr.statuses.end(), NODE_INITIAL_STATUS)
+        self.path.clear()
+        self.path.push_back(root)
+
+        improved_cycles, improved_volume = _collect_cycles(self.cycles())
+
+        if improved_volume > initial_volume:
+            yield from improved_cycles
+        else:
+            yield from initial_cycles
+
+    def parallel_cycles(self, size_t num_threads=1, size_t max_length=0):
+        """Iterate over all trading cycles in the graph, searching
+        for cycles in several threads.
+
+        When `max_length` is not zero, short cycles will be searched
+        first in each component (see the `bounded_cycles` method).
+
+        The graph's weakly connected components (there are no
+        trading cycles spanning more than one component) are
+        distributed between `num_threads` threads, which search for
+        cycles in parallel. The found cycles are yielded grouped by
+        component, in a deterministic order, which does not depend on
+        the number of threads. Within each component, the found
+        cycles will be exactly the same as those found by calling
+        `find_cycle()` repeatedly.
+
+        Note that this method can not be called after the graph
+        traversal has been started by calling `find_cycle()`. Once the
+        returned iterator has been exhausted, next calls to
+        `graph.parallel_cycles()` or `graph.cycles()` will return an
+        empty iterator.
+        """
+        if self.path.size() == 0:
+            return
+        if not self._is_pristine():
+            raise RuntimeError("The graph traversal has already started.")
+        if num_threads < 1:
+            raise ValueError("invalid num_threads")
+        if max_length == 1:
+            raise ValueError("invalid max_length")
+
+        self._sort_arcs()
+        self.csr.calc_components(0)
+        components_count = self.csr.component_offsets.size() - 1
+        self.component_cycles.resize(components_count)
+        self.next_component.store(0)
+        self.max_length = max_length
+
+        errors = []
+        threads = [
+            Thread(target=self._search_components_in_thread, args=(errors,))
+            for _ in range(min(num_threads, components_count) - 1)
+        ]
+        for thread in threads:
+            thread.start()
+        self._search_components_in_thread(errors)
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+        # All possible cycles have been found.
+        self.path.clear()
+
+        cdef CycleList* cycles
+        cdef size_t c, i, k, start, end
+        cdef array.array cycle_array
+        cdef i64[:] ca
+
+        for c in range(components_count):
+            cycles = &self.component_cycles[c]
+            start = 0
+            for i in range(cycles.cycles_count()):
+                end = cycles.ends[i]
+                cycle_array = array.array('q')
+                array.resize(cycle_array, end - start)
+                ca = cycle_array
+                for k in range(end - start):
+                    ca[k] = cycles.ids[start + k]
+                yield cycles.amounts[i], cycle_array
+                start = end
+            cycles.clear()
 
-        cdef size_t cycle_length  = arcs.size()
+    cdef object _process_cycle(self):
+        cdef vector[i64] cycle_ids
+        cdef double cycle_amount = take_cycle(&self.csr, &self.path, &cycle_ids)
+        cdef size_t cycle_length = cycle_ids.size()
         cdef array.array cycle_array = array.array('q')
         array.resize(cycle_array, cycle_length)
         cdef i64[:] ca = cycle_array
         cdef size_t i
 
         for i in range(cycle_length):
-            arc = arcs[i]
-            arc.amount -= cycle_amount
-            ca[(i + offset) % cycle_length] = arc.node_ptr.id
+            ca[i] = cycle_ids[i]
 
         return cycle_amount, cycle_array
 
     cdef bool _find_cycle(self) except? False:
-        cdef Node* current_node
-        cdef Node* next_node
-        cdef size_t arcs_count
-        cdef size_t next_arc_index
-        cdef Arc* next_arc
-        cdef nodestatus path_flag = NODE_PATH_FLAG
-
-        while self.path.size() > 0:
-            current_node = self.path.back()
-            arcs_count = current_node.arcs_count()
-            next_arc_index = (
-                (current_node.status >> 1)
-                # If the "path" flag of the current node is set, this
-                # means that the arc that we followed turned out to be
-                # a dead end. Therefore, now we must skip it.
-                + (current_node.status & path_flag)
-            )
-            next_node = NULL
+        # NOTE: Normally, the graph will be compacted by
+        # `_sort_arcs()`. Here we ensure that the graph is compacted
+        # even if the arcs have not been sorted.
+        self.csr.compact()
+
+        cdef nodeindex root_trader = 0
+        return search_cycle(
+            &self.csr,
+            &self.path,
+            &self.csr.statuses[root_trader],
+            self.csr.arc_offsets[root_trader],
+            self.csr.arc_offsets[root_trader + 1],
+        )
 
-            while next_arc_index < arcs_count:
-                next_arc = &current_node.get_arc(next_arc_index)
-                amount = next_arc.amount
-                if (
-                    amount >= current_node.min_amount
-                    and amount >= next_arc.node_ptr.min_amount
+    cdef int _search_components(self) except -1 nogil:
+        cdef CsrGraph* csr = &self.csr
+        cdef size_t* component_offsets = csr.component_offsets.data()
+        cdef size_t components_count = csr.component_offsets.size() - 1
+        cdef vector[nodeindex] path
+        cdef vector[nodeindex] visited
+        cdef vector[i64] cycle_ids
+        cdef nodestatus root_status
+        cdef double cycle_amount
+        cdef CycleList* cycles
+        cdef size_t c
+
+        while True:
+            c = self.next_component.fetch_add(1)
+            if c >= components_count:
+                break
+
+            cycles = &self.component_cycles[c]
+            root_status = NODE_INITIAL_STATUS
+            path.clear()
+            path.push_back(0)  # the root trader
+
+            if self.max_length != 0:
+                # Search for short cycles first.
+                while search_cycle(
+                        csr,
+                        &path,
+                        &root_status,
+                        component_offsets[c],
+                        component_offsets[c + 1],
+                        self.max_length,
+                        &visited,
                 ):
-                    next_node = next_arc.node_ptr
-                    break
-                next_arc_index += 1  # Invalid arc. Skip it.
-
-            if next_node == NULL:
-                # The current node is a dead end.
-                current_node.status = next_arc_index << 1
-                self.path.pop_back()
-            elif next_node.status & path_flag == 0:
-                # We follow the arc, moving to the next node.
-                current_node.status = (next_arc_index << 1) | path_flag
-                self.path.push_back(next_node)
-            else:
-                # We've got a cycle!
-                current_node.status = next_arc_index << 1
-                return True
-
-        # There are no cycles.
-        return False
-
-    cdef inline bool _is_pristine(self) noexcept:
-        return (
-            self.path.size() == 1
-            and self.path[0].status == NODE_INITIAL_STATUS
-        )
+                    cycle_amount = take_cycle(csr, &path, &cycle_ids)
+                    cycles.add_cycle(cycle_amount, cycle_ids)
+
+                reset_statuses(csr, &visited)
+                root_status = NODE_INITIAL_STATUS
+                path.push_back(0)
+
+            while search_cycle(
+                    csr,
+                    &path,
+                    &root_status,
+                    component_offsets[c],
+                    component_offsets[c + 1],
+            ):
+                cycle_amount = take_cycle(csr, &path, &cycle_ids)
+                cycles.add_cycle(cycle_amount, cycle_ids)
+
+        return 0
+
+    def _search_components_in_thread(self, list errors):
+        try:
+            with nogil:
+                self._search_components()
+        except BaseException as e:  # pragma: no cover
+            errors.append(e)
+
+    cdef int _add_supply(
+        self,
+        double amount,
+        i64 currency_id,
+        i64 seller_id,
+    ) except -1 nogil:
+        cdef nodeindex currency, seller
 
-    cdef (Node*, Node*) _ensure_nodes(self, i64 currency_id, i64 trader_id):
-        currency = self.currencies.get_node(currency_id)
-        if currency == NULL:
-            raise ValueError("invalid currency")
+        if seller_id == ROOT_TRADER_ID:
+            with gil:
+                raise ValueError("invalid seller ID")
+
+        self._ensure_nodes(currency_id, seller_id, &currency, &seller)
+        self.csr.add_arc(currency, seller, amount)
+        return 0
+
+    cdef int _add_demand(
+        self,
+        double amount,
+        i64 currency_id,
+        i64 buyer_id,
+    ) except -1 nogil:
+        cdef nodeindex currency, buyer
+
+        self._ensure_nodes(currency_id, buyer_id, &currency, &buyer)
+        self.csr.add_arc(buyer, currency, amount)
+        return 0
+
+    cdef inline bool _is_pristine(self) noexcept nogil:
+        return not self.csr.is_compacted()
+
+    cdef int _ensure_nodes(
+        self,
+        i64 currency_id,
+        i64 trader_id,
+        nodeindex* currency,
+        nodeindex* trader,
+    ) except -1 nogil:
+        if not self._is_pristine():
+            with gil:
+                raise RuntimeError("The graph traversal has already started.")
 
-        trader = self.traders.get_node(trader_id)
-        if trader == NULL:
-            trader = self.traders.create_node(
-                trader_id, 0.0, NODE_INITIAL_STATUS
-            )
-        return currency, trader
+        currency[0] = self.csr.get_currency_index(currency_id)
+        if currency[0] == NO_NODE:
+            with gil:
+                raise ValueError("invalid currency")
+
+        trader[0] = self.csr.get_trader_index(trader_id)
+        if trader[0] == NO_NODE:
+            trader[0] = self.csr.add_trader(trader_id)
+        return 0
 
     cdef void _sort_arcs(self):
-        self.currencies.calc_ranks()
-        self.traders.calc_ranks()
+        self.csr.compact()
+        self.csr.calc_ranks()
+        self.csr.sort_arcs()
+
+
+cdef tuple _collect_cycles(cycles):
+    # Returns a list of the given trading cycles, and their total
+    # traded volume, which is calculated while iterating over them.
+    cdef list collected = []
+    cdef double volume = 0.0
+    cdef double amount
+
+    for t in cycles:
+        amount = t[0]
+        volume += amount * len(t[1])
+        collected.append(t)
 
-        self.currencies.sort_arcs()
-        self.traders.sort_arcs()
+    return collected, volume
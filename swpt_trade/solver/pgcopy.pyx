@@ -0,0 +1,154 @@
+# distutils: language = c++
+from libc.stdint cimport (
+    int8_t, int16_t, int32_t, int64_t, uint8_t, uint64_t,
+)
+from libc.string cimport memcpy
+from libcpp.vector cimport vector
+from cpython.bytes cimport PyBytes_FromStringAndSize, PyBytes_AS_STRING
+
+# The PostgreSQL epoch (2000-01-01) is 10957 days, or 946684800000000
+# microseconds after the Unix epoch (1970-01-01).
+cdef int64_t PG_EPOCH_DAYS = 10957
+cdef int64_t PG_EPOCH_MICROSECONDS = 946684800000000
+
+cdef bytes COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + bytes(8)
+
+
+cdef struct Column:
+    int size  # the size of the binary field in bytes
+    int64_t scalar  # the value for all rows, if `data` is NULL
+    int64_t offset  # will be subtracted from every value
+    const uint8_t* data
+
+
+cdef inline uint8_t* write_be(
+    uint8_t* p,
+    uint64_t value,
+    int size,
+) noexcept nogil:
+    cdef int i
+    for i in range(size - 1, -1, -1):
+        p[i] = value & 0xff
+        value >>= 8
+    return p + size
+
+
+cdef inline int64_t get_value(
+    const Column* c,
+    Py_ssize_t row,
+) noexcept nogil:
+    if c.data == NULL:
+        return c.scalar
+    if c.size == 1:
+        return (<const int8_t*>c.data)[row]
+    if c.size == 2:
+        return (<const int16_t*>c.data)[row]
+    if c.size == 4:
+        return (<const int32_t*>c.data)[row]
+    return (<const int64_t*>c.data)[row]
+
+
+def encode_binary_copy(tuple columns, str formats):
+    """Encode rows in PostgreSQL's binary `COPY` format, and return a
+    `bytes` object.
+
+    `columns` must contain one item for each column. An item can be
+    an integer (the same value will be used for all rows), or an
+    object supporting the buffer protocol (an `array.array` for
+    example), which contains one value for each row. All buffers must
+    have the same length, and at least one of the items must be a
+    buffer.
+
+    `formats` must contain one character for each column, specifying
+    the type of the column:
+
+    '?' -- BOOLEAN (8-bit buffer items, which must be 0 or 1)
+
+    'h' -- SMALLINT (16-bit buffer items)
+
+    'i' -- INTEGER (32-bit buffer items)
+
+    'q' -- BIGINT (64-bit buffer items)
+
+    'D' -- DATE, given as a number of days since 1970-01-01 (32-bit
+           buffer items)
+
+    'T' -- TIMESTAMP WITH TIME ZONE, given as a number of microseconds
+           since 1970-01-01 00:00:00 UTC (64-bit buffer items)
+    """
+    if len(columns) != len(formats):
+        raise ValueError("the number of formats differs from the columns")
+    if len(columns) > 0x7fff:
+        raise ValueError("too many columns")
+
+    cdef vector[Column] cols
+    cdef Column c
+    cdef const uint8_t[::1] view
+    cdef list views = []
+    cdef Py_ssize_t rows = -1
+    cdef Py_ssize_t row_size = 2
+
+    for value, f in zip(columns, formats):
+        if f == "?":
+            c.size = 1
+        elif f == "h":
+            c.size = 2
+        elif f == "i" or f == "D":
+            c.size = 4
+        elif f == "q" or f == "T":
+            c.size = 8
+        else:
+            raise ValueError(f"invalid format: {f}")
+
+        c.offset = (
+            PG_EPOCH_DAYS if f == "D"
+            else PG_EPOCH_MICROSECONDS if f == "T"
+            else 0
+        )
+        c.scalar = 0
+        c.data = NULL
+
+        if isinstance(value, int):
+            c.scalar = value
+        else:
+            m = memoryview(value)
+            if m.ndim != 1 or m.itemsize != c.size or not m.c_contiguous:
+                raise ValueError(f"invalid buffer for format: {f}")
+            if rows != -1 and len(m) != rows:
+                raise ValueError("buffers differ in length")
+            rows = len(m)
+            view = m.cast("B")
+            views.append(view)
+            if rows > 0:
+                c.data = &view[0]
+
+        row_size += 4 + c.size
+        cols.push_back(c)
+
+    if rows == -1:
+        raise ValueError("at least one column must be a buffer")
+
+    cdef Py_ssize_t header_size = len(COPY_HEADER)
+    cdef bytes result = PyBytes_FromStringAndSize(
+        NULL, header_size + rows * row_size + 2
+    )
+    cdef uint8_t* p = <uint8_t*>PyBytes_AS_STRING(result)
+    cdef size_t columns_count = cols.size()
+    cdef const Column* col
+    cdef Py_ssize_t i
+    cdef size_t j
+
+    memcpy(p, PyBytes_AS_STRING(COPY_HEADER), header_size)
+    p += header_size
+
+    with nogil:
+        for i in range(rows):
+            p = write_be(p, columns_count, 2)
+            for j in range(columns_count):
+                col = &cols[j]
+                p = write_be(p, col.size, 4)
+                p = write_be(p, get_value(col, i) - col.offset, col.size)
+
+        write_be(p, <uint64_t>-1, 2)
+
+    return result
@@ -1,14 +1,19 @@
 # distutils: language = c++
 from libcpp cimport bool
 from libcpp.unordered_set cimport unordered_set
+from libcpp.vector cimport vector
 
-cdef extern from *:
+cdef extern from * nogil:
     """
     #ifndef PRICING_CLASSES_H
     #define PRICING_CLASSES_H
 
     #include <unordered_map>
     #include <stdexcept>
+    #include <cstdint>
+    #include <vector>
+    #include <new>
+    #include <utility>
 
     typedef long long i64;
     typedef unsigned short bitflags;
@@ -65,6 +70,126 @@ cdef extern from *:
       return std::hash<Key128>()(*this);
     }
 
+    #define SIPHASH_ROTL(x, b) (uint64_t)(((x) << (b)) | ((x) >> (64 - (b))))
+    #define SIPHASH_ROUND \
+      do { \
+        v0 += v1; v1 = SIPHASH_ROTL(v1, 13); v1 ^= v0; \
+        v0 = SIPHASH_ROTL(v0, 32); \
+        v2 += v3; v3 = SIPHASH_ROTL(v3, 16); v3 ^= v2; \
+        v0 += v3; v3 = SIPHASH_ROTL(v3, 21); v3 ^= v0; \
+        v2 += v1; v1 = SIPHASH_ROTL(v1, 17); v1 ^= v2; \
+        v2 = SIPHASH_ROTL(v2, 32); \
+      } while (0)
+
+    inline uint64_t siphash_load64(const unsigned char* p, size_t n) {
+      // Load `n` (at most 8) bytes in little-endian order.
+      uint64_t x = 0;
+      for (size_t i = 0; i < n; i++) {
+        x |= ((uint64_t)p[i]) << (8 * i);
+      }
+      return x;
+    }
+
+    inline Key128 calc_key128(
+      const char* data,
+      size_t len,
+      uint64_t k0,
+      uint64_t k1
+    ) {
+      // Calculate the keyed SipHash-2-4 128-bit hash of the given
+      // data. The first 8 bytes of the hash (interpreted as a
+      // little-endian number) go in `first`, the last 8 bytes go in
+      // `second`.
+      const unsigned char* p = (const unsigned char*)data;
+      const unsigned char* end = p + (len - len % 8);
+      uint64_t v0 = 0x736f6d6570736575ULL ^ k0;
+      uint64_t v1 = 0x646f72616e646f6dULL ^ k1 ^ 0xee;
+      uint64_t v2 = 0x6c7967656e657261ULL ^ k0;
+      uint64_t v3 = 0x7465646279746573ULL ^ k1;
+      uint64_t m;
+
+      for (; p != end; p += 8) {
+        m = siphash_load64(p, 8);
+        v3 ^= m;
+        SIPHASH_ROUND;
+        SIPHASH_ROUND;
+        v0 ^= m;
+      }
+      m = (((uint64_t)len) << 56) | siphash_load64(p, len % 8);
+      v3 ^= m;
+      SIPHASH_ROUND;
+      SIPHASH_ROUND;
+      v0 ^= m;
+
+      v2 ^= 0xee;
+      SIPHASH_ROUND;
+      SIPHASH_ROUND;
+      SIPHASH_ROUND;
+      SIPHASH_ROUND;
+      uint64_t first = v0 ^ v1 ^ v2 ^ v3;
+
+      v1 ^= 0xdd;
+      SIPHASH_ROUND;
+      SIPHASH_ROUND;
+      SIPHASH_ROUND;
+      SIPHASH_ROUND;
+      uint64_t second = v0 ^ v1 ^ v2 ^ v3;
+
+      return Key128((i64)first, (i64)second);
+    }
+
+
+    template <class T, size_t BLOCK_SIZE>
+    class Arena {
+      // Allocates objects in big blocks, and destroys them all at once.
+      // The allocated blocks are kept for reuse until the arena itself
+      // is destroyed.
+    private:
+      std::vector<T*> blocks;
+      size_t block_index = 0;  // the index of the block being filled
+      size_t used = 0;  // the number of objects in the block being filled
+
+    public:
+      Arena() {
+      }
+      Arena(const Arena&) = delete;
+      Arena& operator= (const Arena&) = delete;
+      ~Arena() {
+        clear();
+        for (auto it = blocks.begin(); it != blocks.end(); ++it) {
+          ::operator delete(*it);
+        }
+      }
+      template <class... Args>
+      T* create(Args&&... args) {
+        if (used == BLOCK_SIZE) {
+          block_index++;
+          used = 0;
+        }
+        if (block_index == blocks.size()) {
+          blocks.push_back(
+            static_cast<T*>(::operator new(BLOCK_SIZE * sizeof(T)))
+          );
+        }
+        T* ptr = new (blocks[block_index] + used) T(
+          std::forward<Args>(args)...
+        );
+        used++;
+        return ptr;
+      }
+      void clear() {
+        for (size_t i = 0; i <= block_index && i < blocks.size(); i++) {
+          T* block = blocks[i];
+          size_t n = (i == block_index) ? used : BLOCK_SIZE;
+          for (size_t j = 0; j < n; j++) {
+            block[j].~T();
+          }
+        }
+        block_index = 0;
+        used = 0;
+      }
+    };
+
 
     class Currency {
     private:
@@ -116,6 +241,7 @@ cdef extern from *:
     private:
       std::unordered_map<Key128, Currency*> currencies;
       std::unordered_map<i64, Currency*> tradables;
+      Arena<Currency, 1024> currency_arena;
       bool prepared_for_queries = false;
 
       distance calc_distance_to_base(Currency* currency) {
@@ -199,10 +325,8 @@ cdef extern from *:
           base_debtor_id(base_debtor_id),
           max_distance_to_base(max_distance_to_base) {
       }
-      ~CurrencyRegistry() {
-        for (auto it = currencies.begin(); it != currencies.end(); ++it) {
-          delete it->second;
-        }
+      void reserve(size_t n) {
+        currencies.reserve(n);
       }
       void add_currency(
         bool confirmed,
@@ -223,7 +347,7 @@ cdef extern from *:
           if (currency_ptr_ref != NULL) {
             throw std::runtime_error("duplicated debtor_key");
           }
-          currency_ptr_ref = new Currency(
+          currency_ptr_ref = currency_arena.create(
             debtor_id, peg_debtor_key, peg_debtor_id, peg_exchange_rate
           );
           if (debtor_key == base_debtor_key && debtor_id == base_debtor_id) {
@@ -309,6 +433,7 @@ cdef extern from *:
       std::unordered_map<Key128, Bid*> bids;
       std::unordered_map<Key128, Bid*>::const_iterator iter_curr, iter_stop;
       std::unordered_set<i64> traders;
+      Arena<Bid, 256> bid_arena;
       bool iter_started = false;
 
       static bool calc_currency_price(Bid* bid) {
@@ -369,10 +494,14 @@ cdef extern from *:
       BidRegistry(i64 base_debtor_id)
         : base_debtor_id(base_debtor_id) {
       }
-      ~BidRegistry() {
-        for (auto it = bids.begin(); it != bids.end(); ++it) {
-          delete it->second;
-        }
+      void clear() {
+        // Discard all registered bids, so that the registry can be
+        // reused. The allocated memory (including the hash table
+        // buckets) will be reused too.
+        bids.clear();
+        traders.clear();
+        bid_arena.clear();
+        iter_started = false;
       }
       void add_bid(
         i64 creditor_id,
@@ -393,7 +522,7 @@ cdef extern from *:
           if (bid_ptr_ref != NULL) {
             throw std::runtime_error("duplicated bid");
           }
-          bid_ptr_ref = new Bid(
+          bid_ptr_ref = bid_arena.create(
             creditor_id,
             debtor_id,
             amount,
@@ -425,6 +554,7 @@ cdef extern from *:
     #endif
     """
     ctypedef long long i64
+    ctypedef unsigned long long u64 "uint64_t"
     ctypedef unsigned short distance
 
     cdef bool compare_prices(float, float) noexcept
@@ -438,6 +568,8 @@ cdef extern from *:
         Key128(i64, i64) noexcept
         size_t calc_hash() noexcept
 
+    cdef Key128 calc_key128(const char*, size_t, u64, u64) noexcept
+
     cdef cppclass Currency:
         """Contains information about a currency.
 
@@ -485,6 +617,7 @@ cdef extern from *:
         const distance max_distance_to_base
         CurrencyRegistry(Key128, i64, distance) except +
         void add_currency(bool, Key128, i64, Key128, i64, float) except +
+        void reserve(size_t) except +
         void prepare_for_queries() except +
         Currency* get_tradable_currency(i64) except +
         float get_currency_price(i64) except +
@@ -532,13 +665,16 @@ cdef extern from *:
         tree.
 
         To obtain all the bids in the generated tree, continue calling
-        the `get_priceable_bid` method, until it returns NULL.
+        the `get_priceable_bid` method, until it returns NULL. After
+        that, the `clear` method can be called to discard all bids, and
+        start registering a new set of bids.
         """
         const i64 base_debtor_id
         BidRegistry(i64) except +
         void add_bid(i64, i64, i64, i64, float) except +
         void add_bid(i64, i64, i64, i64, float, AuxData) except +
         Bid* get_priceable_bid() noexcept
+        void clear() noexcept
 
 
 cdef class CandidateOfferAuxData:
@@ -563,7 +699,12 @@ cdef class BidProcessor:
     cdef unordered_set[i64] buyers
     cdef unordered_set[i64] sellers
     cdef unordered_set[i64] to_be_confirmed
+    cdef dict interned_keys
     cdef Currency* _find_tradable_currency(self, Bid*)
     cdef void _add_candidate_offer(self, Bid*)
+    cdef object _collect_next_trader_offers(
+        self, BidRegistry*, object, object, vector[Bid*]*
+    )
+    cdef void _collect_trader_offers(self, BidRegistry*, vector[Bid*]*)
     cdef Key128 _calc_key128(self, str)
     cpdef float get_currency_price(self, i64)
@@ -1,6 +1,7 @@
 # distutils: language = c++
-import hashlib
+import os
 from cpython cimport array
+from cpython.unicode cimport PyUnicode_AsUTF8AndSize
 from libc.math cimport NAN
 from libcpp cimport bool
 from datetime import date
@@ -10,6 +11,12 @@ DEFAULT_MAX_DISTANCE_TO_BASE = 10
 
 cdef i64 MIN_I64 = -0x7fffffffffffffff
 
+# A random key for the SipHash function which calculates the debtor
+# info locators' 128-bit keys. Using a secret key guarantees that no
+# one can deliberately craft colliding locators.
+cdef u64 KEY128_K0 = int.from_bytes(os.urandom(8), 'little')
+cdef u64 KEY128_K1 = int.from_bytes(os.urandom(8), 'little')
+
 
 cdef class CandidateOffer:
     """A trader bid, that may eventually become a confirmed offer.
@@ -47,6 +54,72 @@ cdef class CandidateOfferAuxData:
         return self.data.last_transfer_number
 
 
+cdef class _CandidateOfferColumns:
+    # Accumulates candidate offers in parallel arrays. The space for
+    # `capacity` offers is allocated in advance, so that appending
+    # offers does not need to resize the arrays. When more offers are
+    # appended, the arrays grow as needed.
+    cdef array.array amounts
+    cdef array.array debtor_ids
+    cdef array.array creditor_ids
+    cdef array.array creation_dates
+    cdef array.array last_transfer_numbers
+    cdef Py_ssize_t size
+    cdef Py_ssize_t capacity
+
+    def __cinit__(self, Py_ssize_t capacity):
+        self.amounts = array.array('q')
+        self.debtor_ids = array.array('q')
+        self.creditor_ids = array.array('q')
+        self.creation_dates = array.array('i')
+        self.last_transfer_numbers = array.array('q')
+        self.size = 0
+        self.capacity = 0
+        self.reserve(capacity)
+
+    cdef int reserve(self, Py_ssize_t capacity) except -1:
+        if capacity > self.capacity:
+            array.resize(self.amounts, capacity)
+            array.resize(self.debtor_ids, capacity)
+            array.resize(self.creditor_ids, capacity)
+            array.resize(self.creation_dates, capacity)
+            array.resize(self.last_transfer_numbers, capacity)
+            self.capacity = capacity
+        return 0
+
+    cdef int append(self, Bid* bid) except -1:
+        cdef Py_ssize_t i = self.size
+        if i == self.capacity:
+            self.reserve(2 * i + 16)
+
+        self.amounts.data.as_longlongs[i] = bid.amount
+        self.debtor_ids.data.as_longlongs[i] = bid.debtor_id
+        self.creditor_ids.data.as_longlongs[i] = bid.creditor_id
+        self.creation_dates.data.as_ints[i] = bid.aux_data.creation_date
+        self.last_transfer_numbers.data.as_longlongs[i] = (
+            bid.aux_data.last_transfer_number
+        )
+        self.size = i + 1
+        return 0
+
+    cdef tuple columns(self):
+        # Truncates the arrays to the number of appended offers, and
+        # returns them.
+        array.resize(self.amounts, self.size)
+        array.resize(self.debtor_ids, self.size)
+        array.resize(self.creditor_ids, self.size)
+        array.resize(self.creation_dates, self.size)
+        array.resize(self.last_transfer_numbers, self.size)
+        self.capacity = self.size
+        return (
+            self.amounts,
+            self.debtor_ids,
+            self.creditor_ids,
+            self.creation_dates,
+            self.last_transfer_numbers,
+        )
+
+
 cdef object _create_candidate_offer_aux_data(AuxData data):
     cdef CandidateOfferAuxData obj = CandidateOfferAuxData.__new__(
         CandidateOfferAuxData
@@ -113,6 +186,7 @@ cdef class BidProcessor:
         self.base_debtor_id = base_debtor_id
         self.max_distance_to_base = max_distance_to_base
         self.min_trade_amount = min_trade_amount
+        self.interned_keys = {}
         self.bid_registry_ptr = new BidRegistry(base_debtor_id)
         self.currency_registry_ptr = new CurrencyRegistry(
             self._calc_key128(base_debtor_info_locator),
@@ -161,6 +235,15 @@ cdef class BidProcessor:
             peg_exchange_rate,
         )
 
+    def reserve_currencies(self, size_t n):
+        """Prepare for the registration of `n` currencies.
+
+        Calling this method is not required, but when the number of
+        currencies is known in advance, it allows the registration of
+        the currencies to be faster.
+        """
+        self.currency_registry_ptr.reserve(n)
+
     cpdef float get_currency_price(self, i64 debtor_id):
         """Return the price of a tradable currency, expressed in base
         currency's tokens.
@@ -228,10 +311,19 @@ cdef class BidProcessor:
                 aux_data.data,
             )
 
-    def analyze_bids(self):
+    def analyze_bids(self, bool columnar=False):
         """Analyze registered bids and return a list of candidate
         offers.
 
+        When `columnar` is `True`, instead of a list of
+        `CandidateOffer` instances, an (amounts, debtor_ids,
+        creditor_ids, creation_dates, last_transfer_numbers) tuple of
+        parallel `array.array` instances will be returned. The
+        `creation_dates` array contains 32-bit integers (the number of
+        days since 1970-01-01), and all other arrays contain 64-bit
+        integers. This avoids creating Python objects for every
+        candidate offer.
+
         This method should be called only after all the participating
         currencies have been registered (by calling the
         `register_currency` method for each one of them).
@@ -255,6 +347,8 @@ cdef class BidProcessor:
         """
         self.currency_registry_ptr.prepare_for_queries()
         bid_registry = self.bid_registry_ptr
+        cdef vector[Bid*] bids
+        cdef _CandidateOfferColumns columns
 
         while (bid := bid_registry.get_priceable_bid()) != NULL:
             currency = self._find_tradable_currency(bid)
@@ -263,19 +357,37 @@ cdef class BidProcessor:
                 and compare_prices(bid.currency_price, currency.price)
                 and abs(bid.amount) >= self.min_trade_amount
             ):
-                self._add_candidate_offer(bid)
+                if columnar:
+                    if bid.amount > 0:
+                        self.buyers.insert(bid.creditor_id)
+                    else:
+                        self.sellers.insert(bid.creditor_id)
+                    bids.push_back(bid)
+                else:
+                    self._add_candidate_offer(bid)
 
         # Obviously, no deals can be arranged for traders which do not
         # have at least one buy offer, and at least one sell offer.
         # Therefore, we eliminate offers from such traders.
         cdef CandidateOffer o
-        candidate_offers = [
-            o for o in self.candidate_offers if (
-                self.buyers.count(o.creditor_id)
-                if o.amount < 0
-                else self.sellers.count(o.creditor_id)
-            ) != 0
-        ]
+        if columnar:
+            columns = _CandidateOfferColumns(bids.size())
+            for bid in bids:
+                if (
+                    self.buyers.count(bid.creditor_id)
+                    if bid.amount < 0
+                    else self.sellers.count(bid.creditor_id)
+                ) != 0:
+                    columns.append(bid)
+            candidate_offers = columns.columns()
+        else:
+            candidate_offers = [
+                o for o in self.candidate_offers if (
+                    self.buyers.count(o.creditor_id)
+                    if o.amount < 0
+                    else self.sellers.count(o.creditor_id)
+                ) != 0
+            ]
 
         # Free unused memory.
         del bid_registry
@@ -286,6 +398,94 @@ cdef class BidProcessor:
 
         return candidate_offers
 
+    def candidate_offers_iter(self, bids):
+        """Analyze a stream of bids and iterate over the candidate
+        offers.
+
+        This method should be called only after all the participating
+        currencies have been registered (by calling the
+        `register_currency` method for each one of them).
+
+        Each item of `bids` should be a (creditor_id, debtor_id,
+        amount, peg_debtor_id, peg_exchange_rate, creation_date,
+        last_transfer_number) tuple, where `creation_date` is a
+        `datetime.date` instance. The meaning of the fields is the
+        same as in the `register_bid` method. Each returned item will
+        be an (amount, debtor_id, creditor_id, creation_date,
+        last_transfer_number) tuple.
+
+        This is equivalent to registering all the bids and calling
+        `analyze_bids`, but the bids of each trader are analyzed as
+        soon as they have been received, and no Python objects are
+        created for the candidate offers. Therefore, the bids must be
+        ordered by `creditor_id` (or at least, all bids coming from
+        one trader must be adjacent).
+        """
+        cdef BidRegistry* bid_registry = new BidRegistry(self.base_debtor_id)
+        cdef vector[Bid*] offers
+
+        try:
+            self.currency_registry_ptr.prepare_for_queries()
+            bids = iter(bids)
+            t = next(bids, None)
+
+            while t is not None:
+                t = self._collect_next_trader_offers(
+                    bid_registry, bids, t, &offers
+                )
+                yield from [
+                    (
+                        bid.amount,
+                        bid.debtor_id,
+                        bid.creditor_id,
+                        date.fromordinal(719163 + bid.aux_data.creation_date),
+                        bid.aux_data.last_transfer_number,
+                    )
+                    for bid in offers
+                ]
+        finally:
+            del bid_registry
+
+    def candidate_offer_columns_iter(self, bids, size_t batch_size=50000):
+        """Analyze a stream of bids and iterate over batches of
+        candidate offers, in columnar format.
+
+        This method works exactly like the `candidate_offers_iter`
+        method, but each returned item will be a batch of at most
+        `batch_size` candidate offers, represented as an (amounts,
+        debtor_ids, creditor_ids, creation_dates,
+        last_transfer_numbers) tuple of parallel `array.array`
+        instances (see the `analyze_bids` method).
+        """
+        if batch_size < 1:
+            raise ValueError("invalid batch_size")
+
+        cdef BidRegistry* bid_registry = new BidRegistry(self.base_debtor_id)
+        cdef _CandidateOfferColumns columns = _CandidateOfferColumns(
+            batch_size
+        )
+        cdef vector[Bid*] offers
+
+        try:
+            self.currency_registry_ptr.prepare_for_queries()
+            bids = iter(bids)
+            t = next(bids, None)
+
+            while t is not None:
+                t = self._collect_next_trader_offers(
+                    bid_registry, bids, t, &offers
+                )
+                for bid in offers:
+                    columns.append(bid)
+                    if columns.size >= batch_size:
+                        yield columns.columns()
+                        columns = _CandidateOfferColumns(batch_size)
+
+            if columns.size > 0:
+                yield columns.columns()
+        finally:
+            del bid_registry
+
     def currencies_to_be_confirmed(self):
         """Return an iterator over debtor IDs of non-confirmed,
         on-sale currencies.
@@ -311,10 +511,20 @@ cdef class BidProcessor:
         self.to_be_confirmed.erase(debtor_id)
 
     cdef Key128 _calc_key128(self, str uri):
-        m = hashlib.sha256()
-        m.update(uri.encode('utf8'))
-        cdef i64[:] data = array.array('q', m.digest())
-        return Key128(data[0], data[1])
+        # The same few locators (the base currency's, and the popular
+        # peg currencies' locators) are used over and over again, so
+        # the calculated keys are interned.
+        cdef Py_ssize_t size
+        cdef const char* data
+        cdef tuple t = self.interned_keys.get(uri)
+
+        if t is None:
+            data = PyUnicode_AsUTF8AndSize(uri, &size)
+            key = calc_key128(data, size, KEY128_K0, KEY128_K1)
+            self.interned_keys[uri] = (key.first, key.second)
+            return key
+
+        return Key128(t[0], t[1])
 
     cdef Currency* _find_tradable_currency(self, Bid* bid):
         tc = self.currency_registry_ptr.get_tradable_currency(bid.debtor_id)
@@ -337,3 +547,69 @@ cdef class BidProcessor:
         o.creditor_id = bid.creditor_id
         o.aux_data = _create_candidate_offer_aux_data(bid.aux_data)
         self.candidate_offers.append(o)
+
+    cdef object _collect_next_trader_offers(
+        self,
+        BidRegistry* bid_registry,
+        object bids,
+        object t,
+        vector[Bid*]* offers,
+    ):
+        # Registers the bid `t`, followed by the bids from the same
+        # trader taken from the `bids` iterator, and writes the
+        # trader's candidate offers to `offers` (see the
+        # `candidate_offers_iter` method). Returns the first bid of
+        # the next trader, or `None` if there are no more bids.
+        cdef AuxData aux_data
+        cdef i64 creditor_id = t[0]
+        cdef i64 amount
+        bid_registry.clear()
+
+        while t is not None:
+            if <i64>t[0] != creditor_id:
+                break
+
+            # Make sure that `abs(amount)` will work correctly.
+            amount = t[2]
+            if amount < MIN_I64:
+                amount = MIN_I64
+
+            aux_data.creation_date = t[5].toordinal() - 719163
+            aux_data.last_transfer_number = t[6]
+            bid_registry.add_bid(
+                creditor_id, t[1], amount, t[3], t[4], aux_data
+            )
+            t = next(bids, None)
+
+        self._collect_trader_offers(bid_registry, offers)
+        return t
+
+    cdef void _collect_trader_offers(
+        self,
+        BidRegistry* bid_registry,
+        vector[Bid*]* offers,
+    ):
+        # Writes the candidate offers of the trader whose bids are in
+        # `bid_registry` to `offers`. The written pointers are valid
+        # until the registry is cleared.
+        cdef bool is_buyer = False
+        cdef bool is_seller = False
+        offers.clear()
+
+        while (bid := bid_registry.get_priceable_bid()) != NULL:
+            currency = self._find_tradable_currency(bid)
+            if (
+                currency != NULL
+                and compare_prices(bid.currency_price, currency.price)
+                and abs(bid.amount) >= self.min_trade_amount
+            ):
+                if bid.amount > 0:
+                    is_buyer = True
+                else:
+                    is_seller = True
+                offers.push_back(bid)
+
+        # Obviously, no deals can be arranged for traders which do not
+        # have at least one buy offer, and at least one sell offer.
+        if not (is_buyer and is_seller):
+            offers.clear()
@@ -1,14 +1,17 @@
 from __future__ import annotations
 import re
 import math
-import array
-from typing import Self
+import threading
+from typing import Self, TypeVar, Callable, Iterable, Iterator
+from queue import Queue, Full, Empty
 from enum import Enum
 from dataclasses import dataclass
 from hashlib import md5
 from datetime import datetime, timedelta, timezone
 from itertools import islice
-from collections import defaultdict
+from psycopg import sql
+from sqlalchemy import String, Integer, cast, func, literal, true
+from sqlalchemy.dialects.postgresql import BIT
 from swpt_pythonlib.utils import i64_to_u64, u64_to_i64
 
 RE_PERIOD = re.compile(r"^([\d.eE+-]+)([smhdw]?)\s*$")
@@ -18,10 +21,15 @@ RE_TRANSFER_NOTE = re.compile(
     r'(Seller|To|Buyer): ([0-9A-Fa-f]{1,16})(?:\r?\n)?$'
 )
 DATETIME0 = datetime(2024, 1, 1, tzinfo=timezone.utc)  # 2024-01-01 is Monday.
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
 MIN_INT64 = -1 << 63
 MAX_INT64 = (1 << 63) - 1
 SECONDS_IN_DAY = 24 * 60 * 60
 SECONDS_IN_YEAR = 365.25 * SECONDS_IN_DAY
+QUEUE_POLL_INTERVAL = 0.1  # seconds
+_END_OF_QUEUE = object()
+
+T = TypeVar("T")
 
 
 @dataclass
@@ -87,63 +95,6 @@ class TransferNote:
         )
 
 
-class DispatchingData:
-    def __init__(self, turn_id):
-        self._turn_id = turn_id
-        self._empty_value_tuple = (0, 0, 0, 0, 0)
-        self._data = defaultdict(self._create_empty_value)
-
-    def _create_empty_value(self):
-        return array.array("q", self._empty_value_tuple)
-
-    def _get_value(self, *args):
-        return self._data[*args]
-
-    def register_collecting(self, collector_id, turn_id, debtor_id, amount):
-        assert turn_id == self._turn_id
-        value = self._get_value(collector_id, turn_id, debtor_id)
-        value[0] = contain_principal_overflow(value[0] + amount)
-
-    def register_sending(self, collector_id, turn_id, debtor_id, amount):
-        assert turn_id == self._turn_id
-        value = self._get_value(collector_id, turn_id, debtor_id)
-        value[1] = contain_principal_overflow(value[1] + amount)
-
-    def register_receiving(self, collector_id, turn_id, debtor_id, amount):
-        assert turn_id == self._turn_id
-        value = self._get_value(collector_id, turn_id, debtor_id)
-        value[2] = contain_principal_overflow(value[2] + amount)
-        value[3] += 1
-
-    def register_dispatching(self, collector_id, turn_id, debtor_id, amount):
-        assert turn_id == self._turn_id
-        value = self._get_value(collector_id, turn_id, debtor_id)
-        value[4] = contain_principal_overflow(value[4] + amount)
-
-    def statuses_iter(self):
-        current_ts = datetime.now(tz=timezone.utc)
-
-        for key, value in self._data.items():
-            yield {
-                "collector_id": key[0],
-                "turn_id": key[1],
-                "debtor_id": key[2],
-                "inserted_at": current_ts,
-                "amount_to_collect": value[0],
-                "total_collected_amount": None,
-                "amount_to_send": value[1],
-                "started_sending": False,
-                "all_sent": False,
-                "amount_to_receive": value[2],
-                "number_to_receive": value[3],
-                "total_received_amount": None,
-                "all_received": False,
-                "amount_to_dispatch": value[4],
-                "started_dispatching": False,
-                "awaiting_signal_flag": False,
-            }
-
-
 def parse_timedelta(s: str) -> timedelta:
     """Parse a string to a timedelta object.
 
@@ -210,6 +161,280 @@ def batched(iterable, n):
         yield batch
 
 
+def iter_in_thread(
+        make_iterator: Callable[[], Iterable[T]],
+        queue_size: int,
+) -> Iterator[T]:
+    """Iterate over the items produced by a separate thread.
+
+    `make_iterator` will be called in a new thread, and the items
+    from the returned iterable will be passed to the caller via a
+    queue which holds at most `queue_size` items. Exceptions raised
+    in the thread will be re-raised in the caller. When the caller
+    stops the iteration early, the returned generator should be closed
+    (using `contextlib.closing` for example), so that the thread will
+    be stopped too.
+    """
+    if queue_size < 1:
+        raise ValueError("queue_size must be at least one")
+
+    q = Queue(maxsize=queue_size)
+    stopped = threading.Event()
+
+    def put(item) -> bool:
+        while not stopped.is_set():
+            try:
+                q.put(item, timeout=QUEUE_POLL_INTERVAL)
+                return True
+            except Full:
+                pass
+        return False
+
+    def produce() -> None:
+        try:
+            for item in make_iterator():
+                if not put(item):
+                    return
+        except BaseException as e:
+            put(_ThreadFailure(e))
+        else:
+            put(_END_OF_QUEUE)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while (item := q.get()) is not _END_OF_QUEUE:
+            if isinstance(item, _ThreadFailure):
+                raise item.error
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
+
+
+class ThreadedConsumer:
+    """Pass items to a function which is called in a separate thread.
+
+    The items are passed via a queue which holds at most `queue_size`
+    items, so that the producer and the consumer can work at the same
+    time. `ThreadedConsumer` instances must be used as context
+    managers. On exit, the context manager waits until all items have
+    been consumed. Exceptions raised by `consume` will be re-raised
+    in the producer (by `put`, or on exit).
+    """
+
+    def __init__(self, consume: Callable[[T], None], queue_size: int):
+        if queue_size < 1:
+            raise ValueError("queue_size must be at least one")
+
+        self._consume = consume
+        self._queue = Queue(maxsize=queue_size)
+        self._stopped = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self) -> Self:
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self._put(_END_OF_QUEUE)
+        else:
+            self._stopped.set()
+
+        self._thread.join()
+        if exc_type is None:
+            self._raise_error()
+
+    def put(self, item: T) -> None:
+        """Add an item to the queue, waiting for a free slot if
+        necessary.
+        """
+        self._put(item)
+        self._raise_error()
+
+    def _put(self, item) -> None:
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=QUEUE_POLL_INTERVAL)
+                break
+            except Full:
+                pass
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    def _run(self) -> None:
+        try:
+            while not self._stopped.is_set():
+                try:
+                    item = self._queue.get(timeout=QUEUE_POLL_INTERVAL)
+                except Empty:
+                    continue
+                if item is _END_OF_QUEUE:
+                    break
+                self._consume(item)
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._stopped.set()
+
+
+class _ThreadFailure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def to_microseconds(ts: datetime) -> int:
+    """Return the number of microseconds since 1970-01-01 UTC.
+    """
+    return (ts - EPOCH) // timedelta(microseconds=1)
+
+
+def copy_binary(
+        session,
+        model,
+        column_names,
+        data: bytes,
+        table_name: str = None,
+) -> None:
+    """Write rows to the table of `model`, using PostgreSQL's `COPY`
+    command.
+
+    `data` must contain the rows in PostgreSQL's binary `COPY` format
+    (see `swpt_trade.solver.encode_binary_copy`), in the order given
+    by `column_names`. The rows will be written in the current
+    transaction of `session`. When `table_name` is given, the rows
+    will be written to this table (a partition of the model's table,
+    for example), instead of to the model's table.
+    """
+    connection = session.connection(bind_arguments={"mapper": model})
+    copy_binary_to_connection(
+        connection, model, column_names, data, table_name
+    )
+
+
+def copy_binary_to_connection(
+        connection,
+        model,
+        column_names,
+        data: bytes,
+        table_name: str = None,
+) -> None:
+    """Write rows to the table of `model`, using PostgreSQL's `COPY`
+    command.
+
+    This function works exactly like `copy_binary`, but the rows will
+    be written in the current transaction of the given SQLAlchemy
+    `connection`. Unlike sessions, connections can be used from
+    threads that do not have an application context.
+    """
+    statement = sql.SQL("COPY {} ({}) FROM STDIN (FORMAT BINARY)").format(
+        sql.Identifier(table_name or model.__table__.name),
+        sql.SQL(", ").join(sql.Identifier(name) for name in column_names),
+    )
+    with connection.connection.cursor() as cursor:
+        with cursor.copy(statement) as copy:
+            copy.write(data)
+
+
+def copy_query_results(source_connection, query, target_connection, model):
+    """Copy the rows returned by `query` from one database to the
+    table of `model` in another database, using PostgreSQL's binary
+    `COPY` command.
+
+    The rows are streamed from the source database server to the
+    target database server, without being decoded. The labels of the
+    columns selected by `query` must be the names of the columns in
+    the target table, and the types of the selected columns must be
+    exactly the same as the types of the target columns. The rows
+    will be written in the current transaction of `target_connection`.
+    """
+    compiled_query = query.compile(
+        dialect=source_connection.dialect,
+        compile_kwargs={"literal_binds": True},
+    )
+    copy_to = sql.SQL("COPY ({}) TO STDOUT (FORMAT BINARY)").format(
+        sql.SQL(str(compiled_query)),
+    )
+    copy_from = sql.SQL("COPY {} ({}) FROM STDIN (FORMAT BINARY)").format(
+        sql.Identifier(model.__table__.name),
+        sql.SQL(", ").join(
+            sql.Identifier(column.name) for column in query.selected_columns
+        ),
+    )
+    with (
+            source_connection.connection.cursor() as source_cursor,
+            target_connection.connection.cursor() as target_cursor,
+    ):
+        with (
+                source_cursor.copy(copy_to) as source,
+                target_cursor.copy(copy_from) as target,
+        ):
+            for data in source:
+                target.write(data)
+
+
+def calc_sql_hash(column):
+    """Return an SQL expression which calculates the MD5 hash of the
+    values in `column`, and returns the highest 32 bits as a signed
+    32-bits integer.
+
+    Integers are hashed in the same way as `calc_hash` does. Strings
+    are hashed as UTF-8 encoded bytes, which requires the database
+    encoding to be UTF8.
+    """
+    if isinstance(column.type, String):
+        hex_digest = func.md5(column)
+    else:
+        hex_digest = func.md5(func.int8send(column))
+
+    return cast(
+        cast(literal("x").concat(func.substr(hex_digest, 1, 8)), BIT(32)),
+        Integer,
+    )
+
+
+def sharding_realm_filter(column, sharding_realm):
+    """Return an SQL expression which is true for the rows in which
+    the value of `column` belongs to the given sharding realm.
+
+    This is the SQL equivalent of `sharding_realm.match(value)` for
+    integer columns, and of `sharding_realm.match_str(value)` for
+    string columns.
+    """
+    return sharding_realm_hash_filter(calc_sql_hash(column), sharding_realm)
+
+
+def sharding_realm_hash_filter(hash_column, sharding_realm):
+    """Return an SQL expression which is true for the rows in which
+    the value of `hash_column` (which must have been calculated with
+    `calc_sql_hash`) belongs to the given sharding realm.
+
+    When the realm mask consists of leading bits only (which is
+    always the case for realms created from routing keys), the
+    returned expression is a range condition, which can be satisfied
+    by using a B-tree index on `hash_column`.
+    """
+    realm_mask = sharding_realm.realm_mask
+    realm = sharding_realm.realm & realm_mask
+    unmasked_bits = ~realm_mask & 0xffffffff
+
+    if unmasked_bits == 0xffffffff:
+        return true()
+
+    if unmasked_bits & (unmasked_bits + 1) == 0:
+        return hash_column.between(
+            u32_to_i32(realm), u32_to_i32(realm | unmasked_bits)
+        )
+
+    return (
+        hash_column.op("&")(u32_to_i32(realm_mask)) == u32_to_i32(realm)
+    )
+
+
 def calc_hash(n: int) -> int:
     """Calculate the MD5 hash of `n`, and return the highest 16 bits
     as a signed 16-bits integer.
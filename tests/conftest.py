@@ -89,6 +89,7 @@ def db_session(app):
         "TRUNCATE TABLE collector_receiving",
         "TRUNCATE TABLE collector_dispatching",
         "TRUNCATE TABLE creditor_giving",
+        "TRUNCATE TABLE turn_commit_progress",
     ]:
         db.session.execute(
             sqlalchemy.text(cmd),
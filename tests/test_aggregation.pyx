@@ -2,6 +2,7 @@
 
 import pytest
 import math
+import array
 from . import cytest
 from swpt_trade.solver.aggregation cimport (
     check_add,
@@ -10,6 +11,7 @@ from swpt_trade.solver.aggregation cimport (
     CollectorAccount,
     Solver,
 )
+from swpt_trade.solver.aggregation import ENGINE_DFS, ENGINE_FLOW
 
 
 @cytest
@@ -40,27 +42,111 @@ def test_collector_account_calc_hash():
 
 
 @cytest
-def test_get_random_collector_id():
+def test_select_collector_id():
     s = Solver('https://example.com/base', 666)
-    assert s._get_random_collector_id(123, 666) == 123
+    assert s._select_collector_id(123, 666) == 123
 
     s.register_collector_account(1, 666)
     s.register_collector_account(2, 666)
     s.register_collector_account(3, 666)
     s.register_collector_account(1, 777)
 
-    all_ids = [1, 2, 3]
-    seen_ids = set()
-    for _ in range(10000):
-        x = s._get_random_collector_id(123, 666)
-        assert x in all_ids
-        seen_ids.add(x)
-        if all([x in seen_ids for x in all_ids]):
-            break
-    else:
-        assert 0, "non-random collector ids"
+    selected = []
+    for _ in range(7):
+        collector_id = s._select_collector_id(123, 666)
+        s._add_collector_load(collector_id, 666, 1000)
+        selected.append(collector_id)
+    assert selected == [1, 2, 3, 1, 2, 3, 1]
 
-    assert s._get_random_collector_id(123, 777) == 1
+    assert s._select_collector_id(123, 777) == 1
+    s._add_collector_load(1, 777, 1000)
+    assert s._select_collector_id(123, 777) == 1
+    assert s._select_collector_id(123, 888) == 123
+
+    # Loads for unknown collectors and currencies are ignored.
+    s._add_collector_load(123, 666, 1000000)
+    s._add_collector_load(123, 888, 1000000)
+    assert s._select_collector_id(123, 888) == 123
+
+
+@cytest
+def test_select_collector_id_with_skewed_amounts():
+    s = Solver('https://example.com/base', 666)
+    for collector_id in [1, 2, 3]:
+        s.register_collector_account(collector_id, 666)
+
+    totals = {1: 0, 2: 0, 3: 0}
+    amounts = [90000, 10000, 10000, 10000, 10000, 10000, 10000] * 6
+    for amount in amounts:
+        collector_id = s._select_collector_id(123, 666)
+        s._add_collector_load(collector_id, 666, amount)
+        totals[collector_id] += amount
+
+    # Plain round-robin would give 540000 to collector `1`, and
+    # only 120000 to each of the other two.
+    assert sum(totals.values()) == sum(amounts)
+    assert max(totals.values()) - min(totals.values()) <= max(amounts)
+
+
+@cytest
+def test_collectors_are_balanced():
+    s = Solver('https://example.com/101', 101)
+    s.register_currency(True, 'https://example.com/101', 101)
+    s.register_currency(
+        True,
+        'https://example.com/102', 102,
+        'https://example.com/101', 101,
+        1.0,
+    )
+    for collector_id in [997, 998, 999]:
+        s.register_collector_account(collector_id, 101)
+    s.register_collector_account(999, 102)
+
+    for i in range(1, 31):
+        s.register_sell_offer(1000 + i, 102, 10000, 999)
+        s.register_buy_offer(1000 + i, 101, 10000)
+        s.register_sell_offer(i, 101, 10000, 999)
+        s.register_buy_offer(i, 102, 10000)
+
+    counts = {}
+    for giving in s.givings_iter():
+        if giving.debtor_id == 101:
+            counts[giving.collector_id] = counts.get(giving.collector_id, 0) + 1
+
+    assert counts == {997: 10, 998: 10, 999: 10}
+
+
+@cytest
+def test_collectors_are_balanced_with_skewed_amounts():
+    s = Solver('https://example.com/101', 101)
+    s.register_currency(True, 'https://example.com/101', 101)
+    s.register_currency(
+        True,
+        'https://example.com/102', 102,
+        'https://example.com/101', 101,
+        1.0,
+    )
+    for collector_id in [997, 998, 999]:
+        s.register_collector_account(collector_id, 101)
+    s.register_collector_account(999, 102)
+
+    amounts = [90000 if i % 7 == 0 else 10000 for i in range(1, 43)]
+    for i, amount in enumerate(amounts, start=1):
+        s.register_sell_offer(1000 + i, 101, amount, 999)
+        s.register_buy_offer(1000 + i, 102, amount)
+        s.register_sell_offer(i, 102, amount, 999)
+        s.register_buy_offer(i, 101, amount)
+
+    totals = {}
+    for giving in s.givings_iter():
+        if giving.debtor_id == 101:
+            totals[giving.collector_id] = (
+                totals.get(giving.collector_id, 0) + giving.amount
+            )
+
+    assert sum(totals.values()) == sum(amounts)
+    assert len(totals) == 3
+    assert max(totals.values()) - min(totals.values()) <= max(amounts)
 
 
 @cytest
@@ -115,6 +201,9 @@ def test_register_offers():
         key=lambda x: (x.debtor_id, x.creditor_id),
     )
     assert len(takings) == 3
+    assert s.tradable_currencies_count == 3
+    assert s.graph_nodes_count == 7
+    assert s.graph_arcs_count == 10
     assert takings[0] == (1, 101, -75000, 999)
     assert takings[1] == (2, 102, -25000, 999)
     assert takings[2] == (3, 103, -50000, 999)
@@ -140,6 +229,444 @@ def test_register_offers():
     assert s.collection_amounts.at(Account(999, 103)) == 0
 
 
+@cytest
+def test_register_offers_bulk():
+    s = Solver('https://example.com/101', 101)
+    s.register_currency(True, 'https://example.com/101', 101)
+    s.register_currency(
+        True,
+        'https://example.com/102', 102,
+        'https://example.com/101', 101,
+        2.0,
+    )
+    s.register_currency(
+        True,
+        'https://example.com/103', 103,
+        'https://example.com/101', 101,
+        0.5,
+    )
+    assert not s.currencies_analysis_done
+
+    with pytest.raises(ValueError):
+        s.register_sell_offers_bulk(
+            array.array('q', [1, 2]),
+            array.array('q', [101]),
+            array.array('q', [200000]),
+            array.array('q', [999]),
+        )
+    with pytest.raises(ValueError):
+        s.register_buy_offers_bulk(
+            array.array('q', [1]),
+            array.array('q', [101]),
+            array.array('q', []),
+        )
+
+    s.register_sell_offers_bulk(
+        array.array('q', [1, 2, 3, 4]),
+        array.array('q', [101, 102, 103, 666]),
+        array.array('q', [200000, 50000, 50000, 50000]),
+        array.array('q', [999, 999, 999, 999]),
+    )
+    assert s.currencies_analysis_done
+    s.register_buy_offers_bulk(
+        array.array('q', [1, 1, 2, 3, 4]),
+        array.array('q', [102, 103, 101, 101, 666]),
+        array.array('q', [50000, 50000, 50000, 50000, 50000]),
+    )
+    s.register_buy_offers_bulk(
+        array.array('q', []),
+        array.array('q', []),
+        array.array('q', []),
+    )
+
+    takings = sorted(
+        list(s.takings_iter()),
+        key=lambda x: (x.debtor_id, x.creditor_id),
+    )
+    assert len(takings) == 3
+    assert takings[0] == (1, 101, -75000, 999)
+    assert takings[1] == (2, 102, -25000, 999)
+    assert takings[2] == (3, 103, -50000, 999)
+
+    givings = sorted(
+        list(s.givings_iter()),
+        key=lambda x: (x.debtor_id, x.creditor_id),
+    )
+    assert len(givings) == 4
+    assert givings[0] == (2, 101, 50000, 999)
+    assert givings[1] == (3, 101, 25000, 999)
+    assert givings[2] == (1, 102, 25000, 999)
+    assert givings[3] == (1, 103, 50000, 999)
+
+    with pytest.raises(RuntimeError):
+        s.register_sell_offers_bulk(
+            array.array('q', [5]),
+            array.array('q', [101]),
+            array.array('q', [1000]),
+            array.array('q', [999]),
+        )
+    with pytest.raises(RuntimeError):
+        s.register_buy_offers_bulk(
+            array.array('q', [5]),
+            array.array('q', [101]),
+            array.array('q', [1000]),
+        )
+
+
+@cytest
+def test_analyze_offers_in_parallel():
+    def solve(num_threads):
+        s = Solver('https://example.com/101', 101, num_threads=num_threads)
+        for debtor_id in range(101, 111):
+            s.register_currency(
+                True,
+                f'https://example.com/{debtor_id}', debtor_id,
+                'https://example.com/101', 101,
+                1.0,
+            )
+        s.register_collector_account(999, 101)
+        for i in range(1, 200):
+            s.register_sell_offer(i, 101 + i % 10, 10000 * i, 999)
+            s.register_buy_offer(i, 101 + (i * 7) % 10, 20000 * i)
+
+        return (
+            sorted(s.takings_iter()),
+            sorted(s.givings_iter()),
+            sorted(s.collector_transfers_iter()),
+        )
+
+    takings, givings, transfers = solve(1)
+    assert len(takings) > 0
+    assert len(givings) > 0
+    assert solve(4) == (takings, givings, transfers)
+
+
+@cytest
+def test_preferred_cycle_length():
+    def solve(**kwargs):
+        s = Solver('https://example.com/101', 101, **kwargs)
+        for debtor_id in range(101, 111):
+            s.register_currency(
+                True,
+                f'https://example.com/{debtor_id}', debtor_id,
+                'https://example.com/101', 101,
+                1.0,
+            )
+            s.register_collector_account(999, debtor_id)
+        for i in range(1, 200):
+            s.register_sell_offer(i, 101 + i % 10, 10000 * i, 999)
+            s.register_buy_offer(i, 101 + (i * 7) % 10, 20000 * i)
+            s.register_buy_offer(i, 101 + (i * 3) % 10, 20000 * i)
+
+        s.analyze_offers()
+        assert all(length % 2 == 0 for length in s.cycle_length_histogram)
+        return s.cycle_length_histogram
+
+    def avg_length(histogram):
+        total = sum(histogram.values())
+        return sum(k * v for k, v in histogram.items()) / total
+
+    h0 = solve()
+    assert sum(h0.values()) > 0
+    h1 = solve(preferred_cycle_length=4)
+    assert sum(h1.values()) > 0
+    assert avg_length(h1) < avg_length(h0)
+    assert solve(preferred_cycle_length=4, num_threads=3) == h1
+
+
+@cytest
+def test_spill_to_disk(tmp_path):
+    def solve(spill_dir):
+        s = Solver('https://example.com/101', 101, spill_dir=spill_dir)
+        for debtor_id in range(101, 111):
+            s.register_currency(
+                True,
+                f'https://example.com/{debtor_id}', debtor_id,
+                'https://example.com/101', 101,
+                1.0,
+            )
+            s.register_collector_account(998, debtor_id)
+        for i in range(1, 200):
+            s.register_sell_offer(i, 101 + i % 10, 10000 * i, 999)
+            s.register_buy_offer(i, 101 + (i * 7) % 10, 20000 * i)
+
+        s.analyze_offers()
+        if spill_dir:
+            assert s.changes.size() == 0
+            assert s.collection_amounts.size() == 0
+            assert s.collector_transfers.size() == 0
+        return (
+            sorted(s.takings_iter()),
+            sorted(s.givings_iter()),
+            sorted(s.collector_transfers_iter()),
+        )
+
+    takings, givings, transfers = solve('')
+    assert len(takings) > 0
+    assert len(givings) > 0
+    assert len(transfers) > 0
+    assert solve(str(tmp_path)) == (takings, givings, transfers)
+
+    s = Solver('https://example.com/101', 101, spill_dir=str(tmp_path))
+    assert list(s.takings_iter()) == []
+    assert list(s.collector_transfers_iter()) == []
+    assert list(s.givings_iter()) == []
+
+    # When the memory limit is not reached, nothing is spilled.
+    s = Solver(
+        'https://example.com/101', 101,
+        spill_dir=str(tmp_path),
+        spill_memory_limit=1000000,
+    )
+    s.register_currency(True, 'https://example.com/101', 101)
+    s.register_currency(
+        True,
+        'https://example.com/102', 102,
+        'https://example.com/101', 101,
+        1.0,
+    )
+    s.register_sell_offer(1, 101, 10000, 999)
+    s.register_buy_offer(1, 102, 10000)
+    s.register_sell_offer(2, 102, 10000, 999)
+    s.register_buy_offer(2, 101, 10000)
+    s.analyze_offers()
+    assert s.takings_records is None
+    assert s.changes.size() == 4
+    assert len(list(s.takings_iter())) == 2
+
+
+@cytest
+def test_spill_to_disk_with_many_collectors(tmp_path):
+    cdef Solver s
+
+    def solve(spill_dir, spill_memory_limit=0):
+        s = Solver(
+            'https://example.com/101', 101,
+            spill_dir=spill_dir,
+            spill_memory_limit=spill_memory_limit,
+        )
+        for debtor_id in range(101, 106):
+            s.register_currency(
+                True,
+                f'https://example.com/{debtor_id}', debtor_id,
+                'https://example.com/101', 101,
+                1.0,
+            )
+            for collector_id in range(990, 995):
+                s.register_collector_account(collector_id, debtor_id)
+        for i in range(1, 300):
+            s.register_sell_offer(i, 101 + i % 5, 10000 * i, 990 + i % 5)
+            s.register_buy_offer(i, 101 + (i * 3) % 5, 7000 * i)
+        s.analyze_offers()
+        return s
+
+    def changes(items):
+        return sorted((x.creditor_id, x.debtor_id, x.amount) for x in items)
+
+    def balances(s):
+        # Every collector account must give exactly the amount that
+        # it receives.
+        amounts = {}
+        for x in s.takings_iter():
+            key = (x.collector_id, x.debtor_id)
+            amounts[key] = amounts.get(key, 0) - x.amount
+        for x in s.givings_iter():
+            key = (x.collector_id, x.debtor_id)
+            amounts[key] = amounts.get(key, 0) - x.amount
+        for x in s.collector_transfers_iter():
+            key = (x.from_creditor_id, x.debtor_id)
+            amounts[key] = amounts.get(key, 0) - x.amount
+            key = (x.to_creditor_id, x.debtor_id)
+            amounts[key] = amounts.get(key, 0) + x.amount
+        return set(amounts.values())
+
+    s = solve('')
+    takings = changes(s.takings_iter())
+    givings = changes(s.givings_iter())
+    assert len(takings) > 0
+    assert len(givings) > 0
+    assert balances(s) == {0}
+
+    for spill_memory_limit in [0, 2000, 20000]:
+        s = solve(str(tmp_path), spill_memory_limit)
+        assert s.takings_records is not None
+        assert s.changes.size() == 0
+        assert changes(s.takings_iter()) == takings
+        assert changes(s.givings_iter()) == givings
+        assert balances(s) == {0}
+
+        # The spilled account changes are sorted.
+        assert [(x.debtor_id, x.creditor_id) for x in s.givings_iter()] == (
+            sorted((x.debtor_id, x.creditor_id) for x in s.givings_iter())
+        )
+
+
+@cytest
+def test_checkpoint(tmp_path):
+    def solve(spill_dir=''):
+        s = Solver('https://example.com/101', 101, spill_dir=spill_dir)
+        for debtor_id in range(101, 111):
+            s.register_currency(
+                True,
+                f'https://example.com/{debtor_id}', debtor_id,
+                'https://example.com/101', 101,
+                1.0,
+            )
+            s.register_collector_account(998, debtor_id)
+        for i in range(1, 200):
+            s.register_sell_offer(i, 101 + i % 10, 10000 * i, 999)
+            s.register_buy_offer(i, 101 + (i * 7) % 10, 20000 * i)
+        return s
+
+    def results(s):
+        return (
+            list(s.takings_iter()),
+            list(s.collector_transfers_iter()),
+            list(s.givings_iter()),
+        )
+
+    for spill_dir in ['', str(tmp_path)]:
+        s = solve(spill_dir)
+        expected = results(s)
+        assert all(len(items) > 0 for items in expected)
+
+        with open(tmp_path / 'checkpoint', 'w+b') as f:
+            f.write(b'header')
+            s.write_checkpoint(f)
+            f.write(b'trailer')
+            f.seek(6)
+            c = Solver('https://example.com/101', 101)
+            c.read_checkpoint(f)
+            assert results(c) == expected
+            assert results(c) == results(s)
+            with pytest.raises(RuntimeError):
+                c.read_checkpoint(f)
+
+            # Write the loaded checkpoint again, and read it back.
+            checkpoint_size = f.seek(0, 2) - len(b'headertrailer')
+            with open(tmp_path / 'checkpoint2', 'w+b') as f2:
+                f2.write(b'x')
+                c.write_checkpoint(f2)
+                assert f2.tell() == 1 + checkpoint_size
+                f2.seek(1)
+                c2 = Solver('https://example.com/101', 101)
+                c2.read_checkpoint(f2)
+                assert results(c2) == expected
+
+    s = Solver('https://example.com/101', 101)
+    with open(tmp_path / 'checkpoint', 'w+b') as f:
+        s.write_checkpoint(f)
+        f.seek(0)
+        c = Solver('https://example.com/101', 101)
+        c.read_checkpoint(f)
+        assert results(c) == ([], [], [])
+
+    with open(tmp_path / 'checkpoint', 'w+b') as f:
+        f.write((1).to_bytes(8, 'little') + bytes(16))
+        f.seek(0)
+        with pytest.raises(ValueError):
+            Solver('https://example.com/101', 101).read_checkpoint(f)
+
+    s = Solver('https://example.com/101', 101)
+    s.register_currency(True, 'https://example.com/101', 101)
+    with pytest.raises(RuntimeError):
+        with open(tmp_path / 'checkpoint', 'rb') as f:
+            s.read_checkpoint(f)
+
+
+@cytest
+def test_import_currency_prices():
+    def register_offers(s):
+        s.register_sell_offer(1, 101, 200000, 999)
+        s.register_buy_offer(1, 102, 50000)
+        s.register_buy_offer(1, 103, 50000)
+        s.register_sell_offer(2, 102, 50000, 999)
+        s.register_buy_offer(2, 101, 50000)
+        s.register_sell_offer(3, 103, 50000, 999)
+        s.register_buy_offer(3, 101, 50000)
+
+    s1 = Solver('https://example.com/101', 101)
+    s1.register_currency(True, 'https://example.com/101', 101)
+    s1.register_currency(
+        True,
+        'https://example.com/102', 102,
+        'https://example.com/101', 101,
+        2.0,
+    )
+    s1.register_currency(
+        True,
+        'https://example.com/103', 103,
+        'https://example.com/101', 101,
+        0.5,
+    )
+    s1.register_currency(False, 'https://example.com/104', 104)
+    debtor_ids, prices = s1.export_currency_prices()
+    assert isinstance(debtor_ids, array.array)
+    assert isinstance(prices, array.array)
+    assert sorted(zip(debtor_ids, prices)) == [
+        (101, 1.0), (102, 2.0), (103, 0.5),
+    ]
+    register_offers(s1)
+
+    s2 = Solver('https://example.com/101', 101)
+    with pytest.raises(ValueError):
+        s2.import_currency_prices(debtor_ids, array.array('f'))
+
+    s2.register_collector_account(999, 101)
+    s2.import_currency_prices(debtor_ids, prices)
+    assert s2.currencies_analysis_done
+    assert sorted(zip(*s2.export_currency_prices())) == sorted(
+        zip(debtor_ids, prices)
+    )
+    with pytest.raises(RuntimeError):
+        s2.import_currency_prices(debtor_ids, prices)
+    with pytest.raises(RuntimeError):
+        s2.register_currency(True, 'https://example.com/101', 101)
+    register_offers(s2)
+
+    assert sorted(s1.takings_iter()) == sorted(s2.takings_iter())
+    assert sorted(s1.givings_iter()) == sorted(s2.givings_iter())
+
+    s3 = Solver('https://example.com/101', 101)
+    s3.register_currency(True, 'https://example.com/101', 101)
+    with pytest.raises(RuntimeError):
+        s3.import_currency_prices(debtor_ids, prices)
+
+    s4 = Solver('https://example.com/101', 101)
+    with pytest.raises(ValueError):
+        s4.import_currency_prices(
+            array.array('q', [101]), array.array('f', [0.0])
+        )
+
+
+@cytest
+def test_flow_engine():
+    with pytest.raises(AssertionError):
+        Solver('https://example.com/101', 101, engine='unknown')
+
+    def solve(engine):
+        s = Solver('https://example.com/101', 101, engine=engine)
+        for debtor_id in range(101, 106):
+            s.register_currency(
+                True,
+                f'https://example.com/{debtor_id}', debtor_id,
+                'https://example.com/101', 101,
+                1.0,
+            )
+        s.register_collector_account(999, 101)
+        for i in range(1, 100):
+            s.register_sell_offer(i, 101 + i % 5, 10000 * (i % 7 + 1), 999)
+            s.register_buy_offer(i, 101 + (i * 3) % 5, 10000 * (i % 4 + 1))
+
+        takings = list(s.takings_iter())
+        givings = list(s.givings_iter())
+        assert sum(x.amount for x in takings) == -sum(x.amount for x in givings)
+        assert all(x.collector_id == 999 for x in takings + givings)
+        return sum(x.amount for x in givings)
+
+    assert solve(ENGINE_FLOW) >= solve(ENGINE_DFS) > 0
+
+
 @cytest
 def test_self_trade():
     s = Solver('https://example.com/101', 101)
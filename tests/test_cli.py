@@ -6,6 +6,12 @@ from flask import current_app
 from swpt_pythonlib.utils import ShardingRealm
 from swpt_trade.utils import calc_hash
 from swpt_trade.extensions import db
+from swpt_trade.partitions import (
+    STAGED_MODELS,
+    create_turn_partitions,
+    create_staging_partitions,
+    attach_staging_partitions,
+)
 from swpt_trade import models as m
 
 D_ID = -1
@@ -1573,6 +1579,7 @@ def test_update_worker_turns(app, db_session, current_ts):
     assert wts[3].collection_deadline == t2.collection_deadline
 
 
+@pytest.mark.parametrize("use_copy_pipe", [False, True])
 @pytest.mark.parametrize("populated_confirmed_debtors", [True, False])
 @pytest.mark.parametrize("populated_debtor_infos", [True, False])
 def test_run_phase1_subphase0(
@@ -1582,10 +1589,11 @@ def test_run_phase1_subphase0(
         current_ts,
         populated_debtor_infos,
         populated_confirmed_debtors,
+        use_copy_pipe,
 ):
     mocker.patch("swpt_trade.run_turn_subphases.INSERT_BATCH_SIZE", new=1)
     mocker.patch("swpt_trade.run_turn_subphases.SELECT_BATCH_SIZE", new=1)
-    mocker.patch("swpt_trade.run_turn_subphases.BID_COUNTER_THRESHOLD", new=1)
+    mocker.patch.dict(app.config, {"UPLOAD_WITH_COPY_PIPE": use_copy_pipe})
 
     t1 = m.Turn(
         base_debtor_info_locator="https://example.com/666",
@@ -1598,6 +1606,7 @@ def test_run_phase1_subphase0(
     )
     db.session.add(t1)
     db.session.flush()
+    create_turn_partitions(t1.turn_id)
 
     if populated_confirmed_debtors:
         db.session.add(
@@ -1727,7 +1736,6 @@ def test_run_phase2_subphase0(
 ):
     mocker.patch("swpt_trade.run_turn_subphases.INSERT_BATCH_SIZE", new=1)
     mocker.patch("swpt_trade.run_turn_subphases.SELECT_BATCH_SIZE", new=1)
-    mocker.patch("swpt_trade.run_turn_subphases.BID_COUNTER_THRESHOLD", new=1)
 
     t1 = m.Turn(
         base_debtor_info_locator="https://example.com/666",
@@ -1740,6 +1748,7 @@ def test_run_phase2_subphase0(
     )
     db.session.add(t1)
     db.session.flush()
+    create_turn_partitions(t1.turn_id)
     db.session.add(
         m.CurrencyInfo(
             turn_id=t1.turn_id,
@@ -1901,6 +1910,7 @@ def test_run_phase2_subphase0(
     assert acs[0].account_id == "TestCollectorAccountId"
 
 
+@pytest.mark.parametrize("use_copy_pipe", [False, True])
 @pytest.mark.parametrize("has_sell_offers", [True, False])
 @pytest.mark.parametrize("has_buy_offers", [True, False])
 def test_run_phase2_subphase5(
@@ -1910,10 +1920,11 @@ def test_run_phase2_subphase5(
         current_ts,
         has_buy_offers,
         has_sell_offers,
+        use_copy_pipe,
 ):
     mocker.patch("swpt_trade.run_turn_subphases.INSERT_BATCH_SIZE", new=1)
     mocker.patch("swpt_trade.run_turn_subphases.SELECT_BATCH_SIZE", new=1)
-    mocker.patch("swpt_trade.run_turn_subphases.BID_COUNTER_THRESHOLD", new=1)
+    mocker.patch.dict(app.config, {"UPLOAD_WITH_COPY_PIPE": use_copy_pipe})
 
     phase_deadline = (
         current_ts
@@ -1931,6 +1942,7 @@ def test_run_phase2_subphase5(
     )
     db.session.add(t1)
     db.session.flush()
+    create_turn_partitions(t1.turn_id)
 
     if has_sell_offers:
         db.session.add(
@@ -2104,18 +2116,23 @@ def test_run_phase2_subphase5(
     assert bos[1].amount == 30001
 
 
+@pytest.mark.parametrize("aggregate_in_sql", [False, True])
 def test_run_phase3_subphase0(
         mocker,
         app,
         db_session,
         current_ts,
         restore_sharding_realm,
+        aggregate_in_sql,
 ):
     app.config["SHARDING_REALM"] = ShardingRealm("1.#")
     app.config["DELETE_PARENT_SHARD_RECORDS"] = True
 
     mocker.patch("swpt_trade.run_turn_subphases.INSERT_BATCH_SIZE", new=1)
     mocker.patch("swpt_trade.run_turn_subphases.SELECT_BATCH_SIZE", new=1)
+    mocker.patch.dict(
+        app.config, {"AGGREGATE_DISPATCHING_STATUSES_IN_SQL": aggregate_in_sql}
+    )
 
     t1 = m.Turn(
         base_debtor_info_locator="https://example.com/666",
@@ -2130,6 +2147,9 @@ def test_run_phase3_subphase0(
     )
     db.session.add(t1)
     db.session.flush()
+    create_turn_partitions(t1.turn_id)
+    create_staging_partitions(t1.turn_id, STAGED_MODELS)
+    attach_staging_partitions(t1.turn_id, STAGED_MODELS)
 
     wt1 = m.WorkerTurn(
         turn_id=t1.turn_id,
@@ -2436,6 +2456,9 @@ def test_run_phase3_subphase5(
     )
     db.session.add(t1)
     db.session.flush()
+    create_turn_partitions(t1.turn_id)
+    create_staging_partitions(t1.turn_id, STAGED_MODELS)
+    attach_staging_partitions(t1.turn_id, STAGED_MODELS)
 
     wt1 = m.WorkerTurn(
         turn_id=t1.turn_id,
@@ -0,0 +1,104 @@
+# distutils: language = c++
+
+import pytest
+import array
+from . import cytest
+from swpt_trade.solver.dispatching cimport contain_principal_overflow_add
+from swpt_trade.solver.dispatching import DispatchingStatuses
+
+MAX_I64 = 0x7fffffffffffffff
+
+
+def get_rows(statuses, batch_size=50000):
+    rows = []
+    for columns in statuses.statuses_iter(batch_size):
+        assert len(columns) == 7
+        assert [c.typecode for c in columns] == list('qqqqqiq')
+        rows.extend(zip(*columns))
+    rows.sort()
+    return rows
+
+
+@cytest
+def test_contain_principal_overflow_add():
+    assert contain_principal_overflow_add(1, 2) == 3
+    assert contain_principal_overflow_add(-1, -2) == -3
+    assert contain_principal_overflow_add(MAX_I64, 1) == MAX_I64
+    assert contain_principal_overflow_add(MAX_I64, MAX_I64) == MAX_I64
+    assert contain_principal_overflow_add(-MAX_I64, -1) == -MAX_I64
+    assert contain_principal_overflow_add(-MAX_I64, -MAX_I64) == -MAX_I64
+    assert contain_principal_overflow_add(-MAX_I64 - 1, 0) == -MAX_I64
+    assert contain_principal_overflow_add(MAX_I64, -MAX_I64) == 0
+
+
+@cytest
+def test_dispatching_statuses():
+    ds = DispatchingStatuses(2)
+    assert ds.turn_id == 2
+    assert len(ds) == 0
+    assert get_rows(ds) == []
+
+    ds.register_collecting(1, 2, 3, 100)
+    ds.register_collecting(1, 2, 3, 150)
+    ds.register_collecting(1, 2, 4, 300)
+    ds.register_sending(1, 2, 3, 500)
+    ds.register_receiving(1, 2, 3, 1000)
+    ds.register_dispatching(1, 2, 3, 2000)
+    assert len(ds) == 2
+    assert get_rows(ds) == [
+        (1, 3, 250, 500, 1000, 1, 2000),
+        (1, 4, 300, 0, 0, 0, 0),
+    ]
+
+    with pytest.raises(AssertionError):
+        ds.register_collecting(1, 3, 3, 100)
+
+
+@cytest
+def test_dispatching_statuses_bulk():
+    n = 10000
+    collector_ids = array.array('q', [i % 7 for i in range(n)])
+    debtor_ids = array.array('q', [i % 100 for i in range(n)])
+    amounts = array.array('q', [i for i in range(n)])
+
+    ds = DispatchingStatuses(1)
+    ds.register_collecting_bulk(collector_ids, debtor_ids, amounts)
+    ds.register_sending_bulk(collector_ids, debtor_ids, amounts)
+    ds.register_receiving_bulk(collector_ids, debtor_ids, amounts)
+    ds.register_dispatching_bulk(collector_ids, debtor_ids, amounts)
+    ds.register_dispatching_bulk(
+        array.array('q'), array.array('q'), array.array('q')
+    )
+
+    expected = {}
+    for c, d, a in zip(collector_ids, debtor_ids, amounts):
+        total, count = expected.get((c, d), (0, 0))
+        expected[(c, d)] = (total + a, count + 1)
+
+    assert len(ds) == len(expected) == 700
+    assert get_rows(ds, 33) == get_rows(ds) == sorted(
+        (c, d, total, total, total, count, total)
+        for (c, d), (total, count) in expected.items()
+    )
+    assert all(
+        len(columns[0]) <= 33 for columns in ds.statuses_iter(33)
+    )
+
+    with pytest.raises(ValueError):
+        ds.register_collecting_bulk(collector_ids, debtor_ids, amounts[1:])
+    with pytest.raises(ValueError):
+        list(ds.statuses_iter(0))
+
+
+@cytest
+def test_dispatching_statuses_overflow():
+    ds = DispatchingStatuses(1)
+    ds.register_collecting_bulk(
+        array.array('q', [1, 1, 2, 2]),
+        array.array('q', [1, 1, 1, 1]),
+        array.array('q', [MAX_I64, 1, -MAX_I64, -5]),
+    )
+    assert get_rows(ds) == [
+        (1, 1, MAX_I64, 0, 0, 0, 0),
+        (2, 1, -MAX_I64, 0, 0, 0, 0),
+    ]
@@ -0,0 +1,46 @@
+# distutils: language = c++
+
+import pytest
+import array
+import hashlib
+from . import cytest
+from swpt_trade.solver.hashing cimport calc_i64_hash, HashCache
+from swpt_trade.solver.hashing import calc_hashes
+
+
+def md5_hash(n):
+    m = hashlib.md5(n.to_bytes(8, byteorder="big", signed=True))
+    return int.from_bytes(m.digest()[:2], byteorder="big", signed=True)
+
+
+NUMBERS = [
+    0, 1, -1, 123, -123, 0x7fffffffffffffff, -0x8000000000000000,
+    *range(-5000000000, 5000000000, 7919999),
+]
+
+
+@cytest
+def test_calc_i64_hash():
+    for n in NUMBERS:
+        assert calc_i64_hash(n) == md5_hash(n)
+
+
+@cytest
+def test_hash_cache():
+    cdef HashCache cache
+    for _ in range(3):
+        for n in NUMBERS:
+            assert cache.calc_hash(n) == md5_hash(n)
+
+
+@cytest
+def test_calc_hashes():
+    numbers = array.array('q', NUMBERS * 200)
+    expected = array.array('h', [md5_hash(n) for n in numbers])
+    assert calc_hashes(numbers) == expected
+    assert calc_hashes(numbers, 3) == expected
+    assert calc_hashes(numbers[:5], 100) == expected[:5]
+    assert calc_hashes(array.array('q')) == array.array('h')
+
+    with pytest.raises(ValueError):
+        calc_hashes(numbers, 0)
@@ -5,11 +5,12 @@ import math
 import array
 from . import cytest
 from swpt_trade.solver.matching cimport (
+    i64,
     Arc,
-    Node,
-    NodeRegistry,
+    CsrGraph,
     Digraph,
     INF_AMOUNT,
+    NO_NODE,
 )
 
 @cytest
@@ -19,69 +20,103 @@ def test_infinity():
 
 @cytest
 def test_arc():
-    cdef Arc* arc = new Arc(<Node*>123, 50.0)
+    cdef Arc* arc = new Arc(123, 50.0)
     assert arc != NULL
-    assert arc.node_ptr == <Node*>123
+    assert arc.node_index == 123
     assert arc.amount == 50.0
     del arc
 
 
 @cytest
-def test_node():
-    cdef Node* node = new Node(1, 100.0, 3)
-    assert node != NULL
-    assert node.id == 1
-    assert node.min_amount == 100.0
-    assert node.status == 3
-    assert node.arcs_count() == 0
+def test_csr_graph():
+    cdef CsrGraph g
+    assert g.nodes_count() == 0
+    assert not g.is_compacted()
+    assert g.get_currency_index(666) == NO_NODE
+    assert g.get_trader_index(1) == NO_NODE
+
+    assert g.add_currency(666, 100.0) == 0
+    assert g.add_trader(1) == 1
+    assert g.add_trader(2) == 2
+    assert g.nodes_count() == 3
+    assert g.get_currency_index(666) == 0
+    assert g.get_currency_index(1) == NO_NODE
+    assert g.get_trader_index(1) == 1
+    assert g.get_trader_index(2) == 2
+    assert g.get_trader_index(666) == NO_NODE
+    assert g.ids[0] == 666
+    assert g.min_amounts[0] == 100.0
+    assert g.ids[1] == 1
+    assert g.min_amounts[1] == 0.0
+    assert g.statuses[1] == 0
 
     with pytest.raises(IndexError):
-        node.get_arc(0)
-
-    cdef Arc* added_arc = &node.add_arc(node, 50.0)
-    assert node.arcs_count() == 1
-    assert added_arc.node_ptr == node
-    assert added_arc.amount == 50.0
-
-    cdef Arc* arc_ptr = &node.get_arc(0)
-    assert node.arcs_count() == 1
-    assert arc_ptr.node_ptr == node
-    assert arc_ptr.amount == 50.0
-    arc_ptr.node_ptr = NULL
-    arc_ptr.amount = 49.0
-
-    cdef Arc* updated_arc = &node.get_arc(0)
-    assert node.arcs_count() == 1
-    assert updated_arc.node_ptr == NULL
-    assert updated_arc.amount == 49.0
-    assert node.arcs_count() == 1
+        g.add_arc(0, 3, 10.0)
+
+    g.add_arc(1, 0, 10.0)
+    g.add_arc(0, 2, 20.0)
+    g.add_arc(2, 0, 30.0)
+    g.add_arc(0, 1, 40.0)
+    assert g.arcs_count(0) == 2
+    assert g.arcs_count(1) == 1
+    assert g.arcs_count(2) == 1
 
     with pytest.raises(IndexError):
-        node.get_arc(1)
+        g.arcs_count(3)
 
-    del node
+    with pytest.raises(RuntimeError):
+        g.get_arc(0, 0)
+
+    g.compact()
+    assert g.is_compacted()
+    assert list(g.arc_offsets) == [0, 2, 3, 4]
+    assert g.arcs_count(0) == 2
+    assert g.arcs_count(1) == 1
+    assert g.arcs_count(2) == 1
+
+    # The relative order of arcs is preserved.
+    assert g.get_arc(0, 0).node_index == 2
+    assert g.get_arc(0, 0).amount == 20.0
+    assert g.get_arc(0, 1).node_index == 1
+    assert g.get_arc(0, 1).amount == 40.0
+    assert g.get_arc(1, 0).node_index == 0
+    assert g.get_arc(1, 0).amount == 10.0
+    assert g.get_arc(2, 0).node_index == 0
+    assert g.get_arc(2, 0).amount == 30.0
+
+    cdef Arc* arc_ptr = &g.get_arc(2, 0)
+    arc_ptr.amount = 29.0
+    assert g.get_arc(2, 0).amount == 29.0
 
+    with pytest.raises(IndexError):
+        g.get_arc(1, 1)
 
-@cytest
-def test_node_registry():
-    cdef NodeRegistry nodes
-    assert nodes.get_node(1) == NULL
-    assert nodes.create_node(1, 100.0, 3) != NULL
-    node_ptr = nodes.get_node(1)
-    assert node_ptr != NULL
-    assert node_ptr.id == 1
-    assert node_ptr.min_amount == 100.0
-    assert node_ptr.status == 3
+    with pytest.raises(RuntimeError):
+        g.add_arc(1, 0, 10.0)
+
+    with pytest.raises(RuntimeError):
+        g.add_trader(3)
+
+    g.calc_ranks()
+    assert g.sort_ranks[0] == 2
+    assert g.sort_ranks[1] == 2
+    assert g.sort_ranks[2] == 2
+
+    g.sort_arcs_by_amount()
+    assert g.get_arc(0, 0).node_index == 1
+    assert g.get_arc(0, 0).amount == 40.0
+    assert g.get_arc(0, 1).node_index == 2
+    assert g.get_arc(0, 1).amount == 20.0
 
 
 @cytest
 def test_digraph_construction():
     g = Digraph()
     assert g.path.size() == 1
-    cdef Node* root = g.path.back()
-    assert root != NULL
-    assert root.arcs_count() == 0
-    assert root.status == 0
+    root = g.path.back()
+    assert root == 0
+    assert g.csr.arcs_count(root) == 0
+    assert g.csr.statuses[root] == 0
 
     with pytest.raises(ValueError):
         g.add_supply(100.0, 666, 2)
@@ -92,9 +127,9 @@ def test_digraph_construction():
     with pytest.raises(ValueError):
         g.get_min_amount(666)
 
-    assert root.arcs_count() == 0
+    assert g.csr.arcs_count(root) == 0
     g.add_currency(666, 100.0)
-    assert root.arcs_count() == 1
+    assert g.csr.arcs_count(root) == 1
     assert g.get_min_amount(666) == 100.0
 
     with pytest.raises(ValueError):
@@ -103,30 +138,35 @@ def test_digraph_construction():
     g.add_supply(1000.0, 666, 1)
     g.add_supply(2000.0, 666, 2)
     g.add_demand(500.0, 666, 2)
-
-    assert root.id == 0
-    assert root.min_amount == 0.0
-    assert root.arcs_count() == 1
-    cdef Arc* arc = &root.get_arc(0)
+    assert g.nodes_count() == 4
+    assert g.arcs_count() == 4
+    g.csr.compact()
+    assert g.nodes_count() == 4
+    assert g.arcs_count() == 4
+
+    assert g.csr.ids[root] == 0
+    assert g.csr.min_amounts[root] == 0.0
+    assert g.csr.arcs_count(root) == 1
+    cdef Arc* arc = &g.csr.get_arc(root, 0)
     assert math.isinf(arc.amount)
 
-    currency = arc.node_ptr
-    assert currency.id == 666
-    assert currency.min_amount == 100.0
-    assert currency.arcs_count() == 2
+    currency = arc.node_index
+    assert g.csr.ids[currency] == 666
+    assert g.csr.min_amounts[currency] == 100.0
+    assert g.csr.arcs_count(currency) == 2
 
-    cdef Arc* a0 = &currency.get_arc(0)
-    assert a0.node_ptr.id == 1
-    assert a0.node_ptr.arcs_count() == 0
+    cdef Arc* a0 = &g.csr.get_arc(currency, 0)
+    assert g.csr.ids[a0.node_index] == 1
+    assert g.csr.arcs_count(a0.node_index) == 0
     assert a0.amount == 1000.0
 
-    cdef Arc* a1 = &currency.get_arc(1)
-    assert a1.node_ptr.id == 2
-    assert a1.node_ptr.arcs_count() == 1
+    cdef Arc* a1 = &g.csr.get_arc(currency, 1)
+    assert g.csr.ids[a1.node_index] == 2
+    assert g.csr.arcs_count(a1.node_index) == 1
     assert a1.amount == 2000.0
 
-    cdef Arc* trader1_arc = &a1.node_ptr.get_arc(0)
-    assert trader1_arc.node_ptr.id == 666
+    cdef Arc* trader1_arc = &g.csr.get_arc(a1.node_index, 0)
+    assert g.csr.ids[trader1_arc.node_index] == 666
     assert trader1_arc.amount == 500.0
 
 
@@ -193,15 +233,15 @@ def test_digraph_process_cycle():
 
     assert g._find_cycle()
     assert g.path.size() == 5
-    assert g.path.back().id == 1
+    assert g.csr.ids[g.path.back()] == 1
 
     # the cycle:
-    assert g.traders.get_node(1).status == 0b000
-    assert g.currencies.get_node(999).status == 0b001
-    assert g.traders.get_node(3).status == 0b001
-    assert g.currencies.get_node(666).status == 0b101
+    assert g.csr.statuses[g.csr.get_trader_index(1)] == 0b000
+    assert g.csr.statuses[g.csr.get_currency_index(999)] == 0b001
+    assert g.csr.statuses[g.csr.get_trader_index(3)] == 0b001
+    assert g.csr.statuses[g.csr.get_currency_index(666)] == 0b101
 
-    assert g.traders.get_node(2).status == 0b000
+    assert g.csr.statuses[g.csr.get_trader_index(2)] == 0b000
 
     amount, cycle = g._process_cycle()
     assert amount == 250.0
@@ -244,6 +284,10 @@ def test_digraph_self_cylcle():
     assert g.find_cycle() is None
 
 
+cdef i64 arc_target_id(Digraph g, size_t node_index, size_t arc_index):
+    return g.csr.ids[g.csr.get_arc(node_index, arc_index).node_index]
+
+
 @cytest
 def test_digraph_overlapping_cylcles():
     g = Digraph()
@@ -274,31 +318,241 @@ def test_digraph_overlapping_cylcles():
     assert len(list(g.cycles())) == 0
 
     # Check sort ranks.
-    assert g.traders.get_node(0).sort_rank == 5
-    assert g.traders.get_node(1).sort_rank == 1
-    assert g.traders.get_node(2).sort_rank == 1
-    assert g.traders.get_node(3).sort_rank == 2
-    assert g.traders.get_node(4).sort_rank == 2
-    assert g.currencies.get_node(101).sort_rank == 2
-    assert g.currencies.get_node(102).sort_rank == 2
-    assert g.currencies.get_node(103).sort_rank == 1
-    assert g.currencies.get_node(104).sort_rank == 0
+    assert g.csr.sort_ranks[g.csr.get_trader_index(0)] == 5
+    assert g.csr.sort_ranks[g.csr.get_trader_index(1)] == 1
+    assert g.csr.sort_ranks[g.csr.get_trader_index(2)] == 1
+    assert g.csr.sort_ranks[g.csr.get_trader_index(3)] == 2
+    assert g.csr.sort_ranks[g.csr.get_trader_index(4)] == 2
+    assert g.csr.sort_ranks[g.csr.get_currency_index(101)] == 2
+    assert g.csr.sort_ranks[g.csr.get_currency_index(102)] == 2
+    assert g.csr.sort_ranks[g.csr.get_currency_index(103)] == 1
+    assert g.csr.sort_ranks[g.csr.get_currency_index(104)] == 0
 
     # Check the order of arcs.
-    assert g.traders.get_node(0).get_arc(0).node_ptr.id in [101, 102]
-    assert g.traders.get_node(0).get_arc(1).node_ptr.id in [101, 102]
-    assert g.traders.get_node(0).get_arc(2).node_ptr.id == 103
-    assert g.traders.get_node(0).get_arc(3).node_ptr.id == 104
-    assert g.traders.get_node(1).get_arc(0).node_ptr.id == 103
-    assert g.traders.get_node(2).get_arc(0).node_ptr.id == 103
-    assert g.traders.get_node(2).get_arc(1).node_ptr.id == 104
-    assert g.traders.get_node(3).get_arc(0).node_ptr.id == 101
-    assert g.traders.get_node(4).get_arc(0).node_ptr.id == 102
-    assert g.currencies.get_node(101).get_arc(0).node_ptr.id == 4
-    assert g.currencies.get_node(101).get_arc(1).node_ptr.id == 1
-    assert g.currencies.get_node(102).get_arc(0).node_ptr.id == 3
-    assert g.currencies.get_node(102).get_arc(1).node_ptr.id == 2
-    assert g.currencies.get_node(103).get_arc(0).node_ptr.id == 4
+    assert arc_target_id(g, g.csr.get_trader_index(0), 0) in [101, 102]
+    assert arc_target_id(g, g.csr.get_trader_index(0), 1) in [101, 102]
+    assert arc_target_id(g, g.csr.get_trader_index(0), 2) == 103
+    assert arc_target_id(g, g.csr.get_trader_index(0), 3) == 104
+    assert arc_target_id(g, g.csr.get_trader_index(1), 0) == 103
+    assert arc_target_id(g, g.csr.get_trader_index(2), 0) == 103
+    assert arc_target_id(g, g.csr.get_trader_index(2), 1) == 104
+    assert arc_target_id(g, g.csr.get_trader_index(3), 0) == 101
+    assert arc_target_id(g, g.csr.get_trader_index(4), 0) == 102
+    assert arc_target_id(g, g.csr.get_currency_index(101), 0) == 4
+    assert arc_target_id(g, g.csr.get_currency_index(101), 1) == 1
+    assert arc_target_id(g, g.csr.get_currency_index(102), 0) == 3
+    assert arc_target_id(g, g.csr.get_currency_index(102), 1) == 2
+    assert arc_target_id(g, g.csr.get_currency_index(103), 0) == 4
+
+
+@cytest
+def test_digraph_parallel_cycles():
+    import random
+
+    def generate_graph():
+        g = Digraph()
+        for currency_id in range(101, 121):
+            g.add_currency(currency_id, 10.0)
+        for _ in range(400):
+            currency_id = rng.randrange(101, 121)
+            trader_id = rng.randrange(1, 101)
+            amount = float(rng.randrange(1, 1000))
+            if rng.random() < 0.5:
+                g.add_supply(amount, currency_id, trader_id)
+            else:
+                g.add_demand(amount, currency_id, trader_id)
+        return g
+
+    for seed in range(10):
+        rng = random.Random(seed)
+        g1 = generate_graph()
+        rng = random.Random(seed)
+        g2 = generate_graph()
+        rng = random.Random(seed)
+        g3 = generate_graph()
+
+        cycles1 = [(amt, list(nodes)) for amt, nodes in g1.cycles()]
+        cycles2 = [(amt, list(nodes)) for amt, nodes in g2.parallel_cycles()]
+        cycles3 = [(amt, list(nodes)) for amt, nodes in g3.parallel_cycles(4)]
+        assert len(cycles1) > 0
+        assert cycles2 == cycles3
+        assert sorted(cycles1) == sorted(cycles2)
+
+        assert len(list(g2.cycles())) == 0
+        assert len(list(g3.parallel_cycles(4))) == 0
+
+
+@cytest
+def test_digraph_parallel_cycles_components():
+    g = Digraph()
+    g.add_currency(101, 50.0)
+    g.add_currency(102, 50.0)
+    g.add_currency(103, 50.0)
+    g.add_currency(104, 50.0)
+    g.add_currency(105, 50.0)
+
+    # component 1
+    g.add_demand(100.0, 101, 1)
+    g.add_supply(100.0, 102, 1)
+    g.add_demand(100.0, 102, 2)
+    g.add_supply(100.0, 101, 2)
+
+    # component 2
+    g.add_demand(200.0, 103, 3)
+    g.add_supply(200.0, 103, 3)
+    g.add_demand(300.0, 104, 3)
+
+    with pytest.raises(ValueError):
+        next(g.parallel_cycles(0))
+
+    deals = list(g.parallel_cycles(3))
+    assert len(deals) == 2
+    assert deals[0][0] == 100.0
+    assert list(deals[0][1]) in [[101, 1, 102, 2], [102, 2, 101, 1]]
+    assert deals[1][0] == 200.0
+    assert list(deals[1][1]) == [103, 3]
+
+    # Component 1 includes currencies 101, 102; component 2 includes
+    # currencies 103, 104; and currency 105 forms a component itself.
+    assert g.csr.component_offsets.size() == 4
+
+    # The cycle iterators have been exhausted.
+    assert g.find_cycle() is None
+    assert len(list(g.parallel_cycles())) == 0
+
+    g = Digraph()
+    g.add_currency(101, 50.0)
+    g.add_demand(100.0, 101, 1)
+    g.add_supply(100.0, 101, 1)
+    g.add_demand(100.0, 101, 2)
+    g.add_supply(100.0, 101, 2)
+    assert g.find_cycle() is not None
+    with pytest.raises(RuntimeError):
+        next(g.parallel_cycles())
+
+
+@cytest
+def test_digraph_bounded_cycles():
+    def build_graph():
+        g = Digraph()
+        g.add_currency(101, 1.0)
+        g.add_currency(102, 1.0)
+        g.add_currency(103, 1.0)
+
+        # A long cycle: 101 -> 1 -> 102 -> 2 -> 103 -> 3 -> 101
+        g.add_supply(10.0, 101, 1)
+        g.add_demand(10.0, 102, 1)
+        g.add_supply(10.0, 102, 2)
+        g.add_demand(10.0, 103, 2)
+        g.add_supply(10.0, 103, 3)
+        g.add_demand(10.0, 101, 3)
+
+        # A short cycle: 101 -> 4 -> 103 -> 3 -> 101
+        g.add_supply(5.0, 101, 4)
+        g.add_demand(5.0, 103, 4)
+        return g
+
+    g = build_graph()
+    deals = list(g.cycles())
+    assert len(deals) == 1
+    assert deals[0][0] == 10.0
+    assert len(deals[0][1]) == 6
+
+    g = build_graph()
+    with pytest.raises(ValueError):
+        next(g.bounded_cycles(1))
+    deals = list(g.bounded_cycles(4))
+    assert len(deals) == 2
+    assert deals[0][0] == 5.0
+    assert list(deals[0][1]) == [101, 3, 103, 4]
+    assert deals[1][0] == 5.0
+    assert list(deals[1][1]) == [101, 3, 103, 2, 102, 1]
+    assert g.find_cycle() is None
+    assert len(list(g.bounded_cycles(4))) == 0
+
+    g = build_graph()
+    assert [(a, list(c)) for a, c in g.parallel_cycles(2, 4)] == [
+        (a, list(c)) for a, c in deals
+    ]
+
+    g = build_graph()
+    g.find_cycle()
+    with pytest.raises(RuntimeError):
+        next(g.bounded_cycles(4))
+
+
+@cytest
+def test_digraph_max_volume_cycles():
+    import random
+    from collections import defaultdict
+
+    def generate_offers(seed):
+        rng = random.Random(seed)
+        return [
+            (
+                rng.random() < 0.5,
+                rng.expovariate(1 / 100),
+                rng.randrange(101, 121),
+                rng.randrange(1, 201),
+            )
+            for _ in range(800)
+        ]
+
+    def create_graph(offers):
+        g = Digraph()
+        for currency_id in range(101, 121):
+            g.add_currency(currency_id, 1.0)
+        for is_supply, amount, currency_id, trader_id in offers:
+            if is_supply:
+                g.add_supply(amount, currency_id, trader_id)
+            else:
+                g.add_demand(amount, currency_id, trader_id)
+        return g
+
+    def calc_volume(offers, cycles):
+        supply = defaultdict(float)
+        demand = defaultdict(float)
+        for is_supply, amount, currency_id, trader_id in offers:
+            offered = supply if is_supply else demand
+            offered[(currency_id, trader_id)] += amount
+
+        volume = 0.0
+        for amount, nodes in cycles:
+            assert amount >= 1.0
+            n = len(nodes)
+            for i in range(0, n, 2):
+                supply[(nodes[i], nodes[i - 1])] -= amount
+                demand[(nodes[i], nodes[i + 1])] -= amount
+            volume += amount * n / 2
+
+        assert all(x > -1e-6 for x in supply.values())
+        assert all(x > -1e-6 for x in demand.values())
+        return volume
+
+    total_dfs_volume = 0.0
+    total_max_volume = 0.0
+    for seed in range(5):
+        offers = generate_offers(seed)
+        dfs_volume = calc_volume(offers, create_graph(offers).cycles())
+        g = create_graph(offers)
+        max_volume = calc_volume(offers, g.max_volume_cycles())
+        assert max_volume >= dfs_volume > 0.0
+        total_dfs_volume += dfs_volume
+        total_max_volume += max_volume
+
+        # The cycle iterators have been exhausted.
+        assert g.find_cycle() is None
+        assert len(list(g.max_volume_cycles())) == 0
+
+    assert total_max_volume > total_dfs_volume
+
+    g = Digraph()
+    g.add_currency(101, 50.0)
+    g.add_demand(100.0, 101, 1)
+    g.add_supply(100.0, 101, 1)
+    assert g.find_cycle() is not None
+    with pytest.raises(RuntimeError):
+        next(g.max_volume_cycles())
 
 
 @pytest.mark.skip('performance test')
@@ -392,3 +646,46 @@ def test_random_matches():
         cleared_amount += (amount * len(nodes) // 2)
 
     print(performed_deals, cleared_amount, time.time() - zero_time)
+
+
+@pytest.mark.skip('performance test')
+@cytest
+def test_compare_engines():
+    import random
+    import time
+
+    traders_count = 100000
+    offers_count = 5 * traders_count
+    currencies_count = traders_count // 50
+    random.seed(1)
+    offers = [
+        (
+            random.random() < 0.5,
+            random.expovariate(1 / 100.0),
+            random.randrange(1, currencies_count + 1),
+            random.randrange(1, traders_count + 1),
+        )
+        for _ in range(offers_count)
+    ]
+
+    def create_graph():
+        graph = Digraph()
+        for currency_id in range(1, currencies_count + 1):
+            graph.add_currency(currency_id, 1.0)
+        for is_supply, amount, currency_id, trader_id in offers:
+            if is_supply:
+                graph.add_supply(amount, currency_id, trader_id)
+            else:
+                graph.add_demand(amount, currency_id, trader_id)
+        return graph
+
+    for engine in ["cycles", "max_volume_cycles"]:
+        graph = create_graph()
+        zero_time = time.time()
+        performed_deals = 0
+        cleared_amount = 0
+        for amount, nodes in getattr(graph, engine)():
+            performed_deals += 1
+            cleared_amount += (amount * len(nodes) // 2)
+
+        print(engine, performed_deals, cleared_amount, time.time() - zero_time)
@@ -7,8 +7,10 @@ from swpt_pythonlib.utils import (
 )
 from datetime import timedelta
 from swpt_pythonlib.utils import ShardingRealm
+from swpt_trade.extensions import db
 from swpt_trade import models as m
 from swpt_trade import schemas
+from swpt_trade.utils import calc_hash, sharding_realm_hash_filter
 
 
 def test_sibnalbus_burst_count(app):
@@ -329,6 +331,52 @@ def test_trading_policy_is_useless(current_ts):
     assert not tp.is_useless
 
 
+def test_sharding_hash_columns(db_session, current_ts):
+    realm = ShardingRealm("1.0.#")
+    locators = [f"https://example.com/{i}" for i in range(20)]
+
+    for i, locator in enumerate(locators):
+        db.session.add(
+            m.TradingPolicy(creditor_id=i, debtor_id=666)
+        )
+        db.session.add(
+            m.DebtorInfoDocument(debtor_info_locator=locator, debtor_id=i)
+        )
+        db.session.add(
+            m.DebtorLocatorClaim(
+                debtor_id=i,
+                debtor_info_locator=locator,
+                latest_locator_fetch_at=current_ts,
+            )
+        )
+    db.session.flush()
+
+    tp = m.TradingPolicy.query.filter_by(creditor_id=5).one()
+    assert tp.creditor_hash >> 16 == calc_hash(5)
+
+    assert sorted(
+        x.creditor_id for x in m.TradingPolicy.query.filter(
+            sharding_realm_hash_filter(m.TradingPolicy.creditor_hash, realm)
+        )
+    ) == [i for i in range(20) if realm.match(i)]
+
+    assert sorted(
+        x.debtor_info_locator for x in m.DebtorInfoDocument.query.filter(
+            sharding_realm_hash_filter(
+                m.DebtorInfoDocument.debtor_info_locator_hash, realm
+            )
+        )
+    ) == sorted(x for x in locators if realm.match_str(x))
+
+    assert sorted(
+        x.debtor_id for x in m.DebtorLocatorClaim.query.filter(
+            sharding_realm_hash_filter(
+                m.DebtorLocatorClaim.debtor_hash, realm
+            )
+        )
+    ) == [i for i in range(20) if realm.match(i)]
+
+
 def test_account_lock_is_in_force(current_ts):
     al = m.AccountLock(
         creditor_id=777,
@@ -0,0 +1,216 @@
+import pytest
+import time
+import threading
+import sqlalchemy
+from sqlalchemy.exc import IntegrityError
+from swpt_trade.extensions import db
+from swpt_trade.partitions import (
+    PARTITIONED_MODELS,
+    STAGED_MODELS,
+    create_turn_partitions,
+    create_staging_partitions,
+    attach_staging_partitions,
+    drop_turn_partitions,
+    drop_obsolete_turn_partitions,
+)
+from swpt_trade.models import Turn, SellOffer, BuyOffer, CreditorGiving, TS0
+
+
+def _table_exists(name):
+    return db.session.execute(
+        sqlalchemy.text("SELECT to_regclass(:name) IS NOT NULL"),
+        {"name": name},
+        bind_arguments={"bind": db.engines["solver"]},
+    ).scalar_one()
+
+
+def _count_rows(name):
+    return db.session.execute(
+        sqlalchemy.text(f"SELECT count(*) FROM {name}"),
+        bind_arguments={"bind": db.engines["solver"]},
+    ).scalar_one()
+
+
+def _create_turn(db_session, phase):
+    turn = Turn(
+        phase=phase,
+        phase_deadline=TS0,
+        collection_started_at=TS0,
+        collection_deadline=TS0,
+        base_debtor_info_locator="https://example.com/101",
+        base_debtor_id=101,
+        max_distance_to_base=5,
+        min_trade_amount=5000,
+    )
+    db_session.add(turn)
+    db_session.flush()
+    return turn
+
+
+def test_turn_partitions(db_session):
+    turn_id = _create_turn(db_session, 3).turn_id
+
+    create_turn_partitions(turn_id)
+    create_turn_partitions(turn_id)
+    for model in PARTITIONED_MODELS:
+        assert _table_exists(f"{model.__table__.name}_t{turn_id}") == (
+            model not in STAGED_MODELS
+        )
+
+    db_session.add(
+        SellOffer(
+            turn_id=turn_id,
+            creditor_id=1,
+            debtor_id=101,
+            amount=1000,
+            collector_id=999,
+        )
+    )
+    db_session.add(
+        BuyOffer(turn_id=turn_id, creditor_id=1, debtor_id=101, amount=1)
+    )
+    db_session.commit()
+    assert _count_rows(f"sell_offer_t{turn_id}") == 1
+    assert _count_rows(f"buy_offer_t{turn_id}") == 1
+
+    drop_turn_partitions(turn_id, [SellOffer])
+    drop_turn_partitions(turn_id, [SellOffer])
+    assert not _table_exists(f"sell_offer_t{turn_id}")
+    assert _table_exists(f"buy_offer_t{turn_id}")
+    assert len(SellOffer.query.all()) == 0
+    assert len(BuyOffer.query.all()) == 1
+
+    # There is no partition for the rows anymore.
+    db_session.add(
+        SellOffer(
+            turn_id=turn_id,
+            creditor_id=2,
+            debtor_id=101,
+            amount=1000,
+            collector_id=999,
+        )
+    )
+    with pytest.raises(IntegrityError):
+        db_session.flush()
+    db_session.rollback()
+
+    drop_turn_partitions(turn_id, PARTITIONED_MODELS)
+    for model in PARTITIONED_MODELS:
+        assert not _table_exists(f"{model.__table__.name}_t{turn_id}")
+
+
+def test_drop_obsolete_turn_partitions(db_session):
+    turn2_id = _create_turn(db_session, 2).turn_id
+    turn3_id = _create_turn(db_session, 3).turn_id
+    create_turn_partitions(turn2_id)
+    create_turn_partitions(turn3_id)
+    create_staging_partitions(turn3_id, STAGED_MODELS)
+    attach_staging_partitions(turn3_id, STAGED_MODELS)
+    create_turn_partitions(turn3_id + 1000)
+    db_session.commit()
+
+    drop_obsolete_turn_partitions()
+    assert not _table_exists(f"debtor_info_t{turn2_id}")
+    assert _table_exists(f"sell_offer_t{turn2_id}")
+    assert not _table_exists(f"sell_offer_t{turn3_id}")
+    assert _table_exists(f"creditor_giving_t{turn3_id}")
+    assert not _table_exists(f"sell_offer_t{turn3_id + 1000}")
+
+    Turn.query.filter_by(turn_id=turn3_id).update({Turn.phase: 4})
+    db_session.commit()
+    drop_obsolete_turn_partitions()
+    assert not _table_exists(f"creditor_giving_t{turn3_id}")
+    assert _table_exists(f"sell_offer_t{turn2_id}")
+
+
+def test_parent_table_is_usable_while_dropping_partition(app, db_session):
+    turn1_id = _create_turn(db_session, 3).turn_id
+    turn2_id = _create_turn(db_session, 2).turn_id
+    create_turn_partitions(turn1_id)
+    create_turn_partitions(turn2_id)
+    db_session.commit()
+
+    insert_offer = sqlalchemy.text(
+        "INSERT INTO sell_offer"
+        " (turn_id, creditor_id, debtor_id, amount, collector_id)"
+        " VALUES (:turn_id, :creditor_id, 101, 1000, 999)"
+    )
+    errors = []
+
+    def drop_partitions():
+        try:
+            with app.app_context():
+                drop_turn_partitions(turn1_id, [SellOffer])
+        except Exception as e:  # pragma: no cover
+            errors.append(e)
+
+    with db.engines["solver"].connect() as conn:
+        # This transaction uses the partitioned table while the
+        # partition is being dropped. The drop must wait for it to
+        # finish, without blocking it.
+        conn.execute(sqlalchemy.text("SET lock_timeout = '5s'"))
+        conn.execute(insert_offer, {"turn_id": turn2_id, "creditor_id": 1})
+        thread = threading.Thread(target=drop_partitions)
+        thread.start()
+        time.sleep(0.5)
+
+        conn.execute(insert_offer, {"turn_id": turn2_id, "creditor_id": 2})
+        assert conn.execute(
+            sqlalchemy.text("SELECT count(*) FROM sell_offer")
+        ).scalar_one() == 2
+        assert thread.is_alive()
+        conn.commit()
+
+    thread.join(timeout=30.0)
+    assert not thread.is_alive()
+    assert errors == []
+    assert not _table_exists(f"sell_offer_t{turn1_id}")
+    assert _count_rows(f"sell_offer_t{turn2_id}") == 2
+    assert len(SellOffer.query.all()) == 2
+
+
+def test_staging_partitions(db_session):
+    turn_id = 123
+
+    create_staging_partitions(turn_id, STAGED_MODELS)
+    for model in STAGED_MODELS:
+        assert _table_exists(f"{model.__table__.name}_t{turn_id}")
+
+    db_session.execute(
+        sqlalchemy.text(
+            f"INSERT INTO creditor_giving_t{turn_id}"
+            " (turn_id, creditor_id, debtor_id, creditor_hash, amount,"
+            " collector_id)"
+            f" VALUES ({turn_id}, 1, 101, 0, 1000, 999)"
+        ),
+        bind_arguments={"bind": db.engines["solver"]},
+    )
+    assert _count_rows(f"creditor_giving_t{turn_id}") == 1
+    assert len(CreditorGiving.query.all()) == 0
+
+    # Re-creating the staging partitions discards their rows.
+    create_staging_partitions(turn_id, [CreditorGiving])
+    assert _count_rows(f"creditor_giving_t{turn_id}") == 0
+
+    db_session.execute(
+        sqlalchemy.text(
+            f"INSERT INTO creditor_giving_t{turn_id}"
+            " (turn_id, creditor_id, debtor_id, creditor_hash, amount,"
+            " collector_id)"
+            f" VALUES ({turn_id}, 2, 101, 0, 2000, 999)"
+        ),
+        bind_arguments={"bind": db.engines["solver"]},
+    )
+    attach_staging_partitions(turn_id, STAGED_MODELS)
+    attach_staging_partitions(turn_id, STAGED_MODELS)
+    attach_staging_partitions(turn_id + 1, STAGED_MODELS)
+    cg = CreditorGiving.query.all()
+    assert len(cg) == 1
+    assert cg[0].turn_id == turn_id
+    assert cg[0].creditor_id == 2
+    assert cg[0].amount == 2000
+
+    db_session.commit()
+    drop_turn_partitions(turn_id, STAGED_MODELS)
+    assert not _table_exists(f"creditor_giving_t{turn_id}")
+    assert len(CreditorGiving.query.all()) == 0
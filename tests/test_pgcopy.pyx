@@ -0,0 +1,84 @@
+# distutils: language = c++
+
+import pytest
+import array
+import struct
+from datetime import date, datetime, timedelta, timezone
+from . import cytest
+from swpt_trade.solver.pgcopy import encode_binary_copy
+
+HEADER = b"PGCOPY\n\xff\r\n\x00" + bytes(8)
+TRAILER = b"\xff\xff"
+
+
+@cytest
+def test_encode_binary_copy():
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    ts = datetime(2024, 5, 6, 7, 8, 9, 123456, tzinfo=timezone.utc)
+    ts_microseconds = (ts - epoch) // timedelta(microseconds=1)
+    creation_date = date(2023, 1, 4).toordinal() - 719163
+
+    data = encode_binary_copy(
+        (
+            3,
+            array.array('q', [-1, 2]),
+            array.array('i', [creation_date, 0]),
+            ts_microseconds,
+            array.array('h', [7, -8]),
+            5,
+        ),
+        "hqDThi",
+    )
+    assert data.startswith(HEADER)
+    assert data.endswith(TRAILER)
+
+    row_format = ">h ih iq ii iq ih ii"
+    row_size = struct.calcsize(row_format)
+    rows = data[len(HEADER):-len(TRAILER)]
+    assert len(rows) == 2 * row_size
+
+    pg_days = date(2023, 1, 4).toordinal() - date(2000, 1, 1).toordinal()
+    pg_microseconds = (
+        (ts - datetime(2000, 1, 1, tzinfo=timezone.utc))
+        // timedelta(microseconds=1)
+    )
+    assert struct.unpack(row_format, rows[:row_size]) == (
+        6, 2, 3, 8, -1, 4, pg_days, 8, pg_microseconds, 2, 7, 4, 5,
+    )
+    assert struct.unpack(row_format, rows[row_size:]) == (
+        6, 2, 3, 8, 2, 4, -10957, 8, pg_microseconds, 2, -8, 4, 5,
+    )
+
+
+@cytest
+def test_encode_binary_copy_booleans():
+    data = encode_binary_copy((array.array('b', [1, 0]), 1), "?h")
+    assert data == HEADER + (
+        struct.pack(">h ib ih", 2, 1, 1, 2, 1)
+        + struct.pack(">h ib ih", 2, 1, 0, 2, 1)
+    ) + TRAILER
+
+
+@cytest
+def test_encode_binary_copy_empty():
+    assert encode_binary_copy(
+        (1, array.array('q')), "hq"
+    ) == HEADER + TRAILER
+
+
+@cytest
+def test_encode_binary_copy_errors():
+    with pytest.raises(ValueError):
+        encode_binary_copy((1, 2), "hh")
+    with pytest.raises(ValueError):
+        encode_binary_copy((array.array('q'),), "hq")
+    with pytest.raises(ValueError):
+        encode_binary_copy((array.array('q'),), "x")
+    with pytest.raises(ValueError):
+        encode_binary_copy((array.array('i'),), "q")
+    with pytest.raises(ValueError):
+        encode_binary_copy(
+            (array.array('q', [1]), array.array('q', [1, 2])), "qq"
+        )
+    with pytest.raises(TypeError):
+        encode_binary_copy(("text",), "q")
@@ -7,6 +7,7 @@ from . import cytest
 from swpt_trade.solver.pricing cimport (
     compare_prices,
     Key128,
+    calc_key128,
     Currency,
     CurrencyRegistry,
     AuxData,
@@ -137,6 +138,18 @@ def test_bid_registry():
     with pytest.raises(RuntimeError):
         r.add_bid(1, 108, 700, 0, 1.0)
 
+    # The registry can be reused after clearing it.
+    r.clear()
+    for i in range(1000):
+        r.add_bid(1, 1000 + i, 1000, 101, 1.0, aux_data)
+    r.add_bid(1, 101, 6000, 0, 0.0)
+    r.add_bid(1, 102, 5000, 104, 1.0, aux_data)
+
+    debtor_ids = []
+    while (bid := r.get_priceable_bid()) != NULL:
+        debtor_ids.append(bid.debtor_id)
+    assert sorted(debtor_ids) == [101] + list(range(1000, 2000))
+
     del r
 
 @cytest
@@ -161,6 +174,30 @@ def test_key128_calc_hash():
             seen_values.add(h)
 
 
+@cytest
+def test_calc_key128():
+    # Test vectors from the SipHash reference implementation.
+    k0 = int.from_bytes(bytes(range(0, 8)), 'little')
+    k1 = int.from_bytes(bytes(range(8, 16)), 'little')
+
+    def h(bytes data):
+        k = calc_key128(data, len(data), k0, k1)
+        return (
+            (k.first & 0xffffffffffffffff).to_bytes(8, 'little')
+            + (k.second & 0xffffffffffffffff).to_bytes(8, 'little')
+        )
+
+    assert h(b'') == bytes.fromhex('a3817f04ba25a8e66df67214c7550293')
+    assert h(b'\x00') == bytes.fromhex('da87c1d86b99af44347659119b22fc45')
+
+    seen_values = set()
+    for i in range(100000):
+        data = f'https://example.com/{i}'.encode()
+        k = calc_key128(data, len(data), k0, k1)
+        seen_values.add((k.first, k.second))
+    assert len(seen_values) == 100000
+
+
 @cytest
 def test_currency():
     cdef Currency* c = new Currency(101, Key128(0, 0), 102, 2.0)
@@ -267,20 +304,22 @@ def test_currency_registry():
 
 @cytest
 def test_bp_calc_key128():
-    import hashlib
-    import sys
-
-    bp = BidProcessor('', 1)
+    bp1 = BidProcessor('', 1)
+    bp2 = BidProcessor('', 1)
+    seen_values = set()
     for x in range(20):
-        s = f'test{x}'
-        key = bp._calc_key128(s)
-        m = hashlib.sha256()
-        m.update(s.encode('utf8'))
-        digest = m.digest()
-        first = int.from_bytes(digest[:8], sys.byteorder, signed="True")
-        second = int.from_bytes(digest[8:16], sys.byteorder, signed="True")
-        assert first == key.first
-        assert second == key.second
+        s = f'test{x}\u20ac'
+        key = bp1._calc_key128(s)
+        assert (key.first, key.second) not in seen_values
+        seen_values.add((key.first, key.second))
+
+        interned_key = bp1._calc_key128(s)
+        assert interned_key.first == key.first
+        assert interned_key.second == key.second
+
+        other_key = bp2._calc_key128(s)
+        assert other_key.first == key.first
+        assert other_key.second == key.second
 
 
 @cytest
@@ -386,6 +425,21 @@ def test_bp_candidate_offers():
     assert len(bp.analyze_bids()) == 3
     assert len(bp.analyze_bids()) == 0
 
+    bp.register_bid(5, 101, 666666)  # not tradable
+    bp.register_bid(5, 105, -666666, 101, 5.0)  # not tradable
+    bp.register_bid(5, 106, -50000, 105, 6.000005, aux_data)  # OK!
+    bp.register_bid(5, 102, 10000, 101, 2.0)  # OK!
+    bp.register_bid(5, 103, 10000, 102, 3.0)  # OK!
+    bp.register_bid(6, 102, 10000, 101, 2.0)  # OK, but no seller for this!
+    columns = bp.analyze_bids(columnar=True)
+    assert [c.typecode for c in columns] == ['q', 'q', 'q', 'i', 'q']
+    assert sorted(zip(*columns)) == [
+        (-50000, 106, 5, 19361, 1234),
+        (10000, 102, 5, 0, 0),
+        (10000, 103, 5, 0, 0),
+    ]
+    assert [len(c) for c in bp.analyze_bids(columnar=True)] == [0] * 5
+
     with pytest.raises(RuntimeError):
         bp.register_currency(
             True, 'https://x.com/110', 110, 'https://x.com/102', 102, 1.0
@@ -405,3 +459,82 @@ def test_bp_candidate_offers():
     bp.remove_currency_to_be_confirmed(107)
     bp.remove_currency_to_be_confirmed(107)
     assert len(list(bp.currencies_to_be_confirmed())) == 0
+
+
+@cytest
+def test_bp_candidate_offers_iter():
+    bp = BidProcessor('https://x.com/101', 101, 2, 1000)
+    bp.reserve_currencies(10)
+    bp.register_currency(False, 'https://x.com/101', 101)  # base
+    bp.register_currency(
+        True, 'https://x.com/102', 102, 'https://x.com/101', 101, 2.0
+    )
+    bp.register_currency(
+        True, 'https://x.com/103', 103, 'https://x.com/102', 102, 3.0
+    )
+    bp.register_currency(
+        True, 'https://x.com/104', 104, 'https://x.com/103', 103, 4.0
+    )
+    bp.register_currency(
+        False, 'https://x.com/105', 105, 'https://x.com/101', 101, 5.0
+    )
+    bp.register_currency(
+        True, 'https://x.com/106', 106, 'https://x.com/105', 105, 6.0
+    )
+    d0 = date(1970, 1, 1)
+    d1 = date(2023, 1, 4)
+    nan = math.nan
+
+    bids = [
+        (1, 105, -666666, 101, 5.0, d0, 0),  # not tradable
+        (1, 106, -50000, 105, 6.000005, d1, 1234),  # OK!
+        (1, 102, 10000, 101, 2.0, d0, 0),  # OK!
+        (1, 103, 100, 102, 3.0, d0, 0),  # abs(amount) is too small
+
+        (2, 101, 666666, 0, nan, d0, 0),  # not tradable
+        (2, 105, -666666, 101, 5.0, d0, 0),  # not tradable
+        (2, 106, -50000, 105, 6.0, d0, 0),  # OK, but no buyer for this!
+        (2, 102, 10000, 101, 1.999, d0, 0),  # wrongly priced
+        (2, 103, 10000, 102, 3.0, d0, 0),  # pegged to wrongly priced
+
+        (3, 101, 666666, 0, nan, d0, 0),  # not tradable
+        (3, 106, 50000, 105, 6.0, d0, 0),  # OK, but no seller for this!
+        (3, 102, -100, 101, 2.0, d0, 0),  # abs(amount) is too small
+        (3, 103, 10000, 102, 3.0, d0, 0),  # OK, but no seller for this!
+        (3, 104, -10000, 103, 4.0, d0, 0),  # too big distance to base
+
+        (5, 101, 666666, 0, nan, d0, 0),  # not tradable
+        (5, 105, -666666, 101, 5.0, d0, 0),  # not tradable
+        (5, 106, -50000, 105, 6.000005, d1, 5),  # OK!
+        (5, 102, 10000, 101, 2.0, d0, 0),  # OK!
+        (5, 103, 10000, 102, 3.0, d0, 0),  # OK!
+    ]
+    offers = sorted(bp.candidate_offers_iter(iter(bids)))
+    assert offers == [
+        (-50000, 106, 1, d1, 1234),
+        (-50000, 106, 5, d1, 5),
+        (10000, 102, 1, d0, 0),
+        (10000, 102, 5, d0, 0),
+        (10000, 103, 5, d0, 0),
+    ]
+    assert sorted(bp.currencies_to_be_confirmed()) == [104, 105]
+    assert list(bp.candidate_offers_iter([])) == []
+
+    batches = list(bp.candidate_offer_columns_iter(iter(bids), 2))
+    assert [len(b[0]) for b in batches] == [2, 2, 1]
+    assert [c.typecode for c in batches[0]] == ['q', 'q', 'q', 'i', 'q']
+    assert sorted(
+        (amount, debtor_id, creditor_id, date.fromordinal(719163 + d), n)
+        for b in batches
+        for amount, debtor_id, creditor_id, d, n in zip(*b)
+    ) == offers
+    assert list(bp.candidate_offer_columns_iter([])) == []
+
+    with pytest.raises(ValueError):
+        list(bp.candidate_offer_columns_iter(bids, 0))
+
+    with pytest.raises(RuntimeError):
+        list(bp.candidate_offers_iter([
+            (1, 102, 10000, 101, 2.0, d0, 0),
+            (1, 102, 10000, 101, 2.0, d0, 0),
+        ]))
@@ -2,6 +2,13 @@ import pytest
 from datetime import timedelta, date
 from swpt_trade import procedures as p
 from swpt_trade import utils
+from swpt_trade.partitions import (
+    STAGED_MODELS,
+    create_turn_partitions,
+    create_staging_partitions,
+    attach_staging_partitions,
+    drop_obsolete_turn_partitions,
+)
 from swpt_trade.models import (
     Turn,
     DebtorInfo,
@@ -148,6 +155,7 @@ def test_try_to_advance_turn_to_phase2(db_session):
         )
     )
     db_session.flush()
+    create_turn_partitions(turn.turn_id)
     db_session.commit()
     turn_id = turn.turn_id
 
@@ -216,8 +224,12 @@ def test_try_to_advance_turn_to_phase2(db_session):
     assert all_turns[0].phase_deadline is not None
     assert all_turns[0].phase_deadline != TS0
 
+    assert len(DebtorInfo.query.all()) != 0
+    assert len(ConfirmedDebtor.query.all()) != 0
+    drop_obsolete_turn_partitions()
     assert len(DebtorInfo.query.all()) == 0
     assert len(ConfirmedDebtor.query.all()) == 0
+    assert len(db_session.query(CurrencyInfo).all()) == 2
 
     # Wrong turn_id or phase.
     p.try_to_advance_turn_to_phase2(
@@ -251,6 +263,8 @@ def test_try_to_advance_turn_to_phase4(db_session):
     db_session.add(turn)
     db_session.flush()
     turn_id = turn.turn_id
+    create_staging_partitions(turn_id, STAGED_MODELS)
+    attach_staging_partitions(turn_id, STAGED_MODELS)
     db_session.add(
         CollectorSending(
             turn_id=turn_id,
@@ -277,6 +291,8 @@ def test_try_to_advance_turn_to_phase4(db_session):
     assert len(all_turns) == 1
     assert all_turns[0].phase == 4
     assert all_turns[0].phase_deadline is None
+    drop_obsolete_turn_partitions()
+    assert len(CollectorSending.query.all()) == 0
 
     # Wrong turn_id or phase.
     p.try_to_advance_turn_to_phase4(-1)
@@ -1,4 +1,26 @@
-from swpt_trade.solve_turn import try_to_advance_turn_to_phase3
+import pytest
+import os
+import sqlalchemy
+from array import array
+from swpt_trade.solve_turn import (
+    try_to_advance_turn_to_phase3,
+    read_currency_prices_snapshot,
+    write_currency_prices_snapshot,
+    read_solver_checkpoint,
+    write_solver_checkpoint,
+    write_solver_metrics,
+    _calc_solver_checkpoint_fingerprint,
+    _split_range,
+)
+from swpt_trade import solve_turn
+from swpt_trade.extensions import db
+from swpt_trade.partitions import (
+    STAGED_MODELS,
+    create_turn_partitions,
+    create_staging_partitions,
+    drop_obsolete_turn_partitions,
+)
+from swpt_trade.solver import Solver
 from swpt_trade.utils import calc_hash
 from swpt_trade.models import (
     CollectorAccount,
@@ -12,11 +34,35 @@ from swpt_trade.models import (
     CollectorCollecting,
     CreditorGiving,
     CreditorTaking,
+    TurnCommitProgress,
     TS0,
 )
 
 
-def test_try_to_advance_turn_to_phase3(db_session):
+def _write_staged_taking(
+        turn_id, creditor_id, debtor_id, amount, collector_id
+):
+    db.session.execute(
+        sqlalchemy.text(
+            f"INSERT INTO creditor_taking_t{turn_id}"
+            " (turn_id, creditor_id, debtor_id, creditor_hash, amount,"
+            " collector_id)"
+            " VALUES (:turn_id, :creditor_id, :debtor_id, :creditor_hash,"
+            " :amount, :collector_id)"
+        ),
+        {
+            "turn_id": turn_id,
+            "creditor_id": creditor_id,
+            "debtor_id": debtor_id,
+            "creditor_hash": calc_hash(creditor_id),
+            "amount": amount,
+            "collector_id": collector_id,
+        },
+        bind_arguments={"bind": db.engines["solver"]},
+    )
+
+
+def _create_turn_with_offers(db_session):
     turn = Turn(
         phase=2,
         phase_deadline=TS0,
@@ -31,6 +77,7 @@ def test_try_to_advance_turn_to_phase3(db_session):
     db_session.flush()
     db_session.commit()
     turn_id = turn.turn_id
+    create_turn_partitions(turn_id)
 
     db_session.add(
         CurrencyInfo(
@@ -54,21 +101,6 @@ def test_try_to_advance_turn_to_phase3(db_session):
             is_confirmed=True,
         )
     )
-    db_session.add(
-        CollectorAccount(
-            debtor_id=101, collector_id=997, account_id="997", status=2
-        )
-    )
-    db_session.add(
-        CollectorAccount(
-            debtor_id=101, collector_id=998, account_id="998", status=2
-        )
-    )
-    db_session.add(
-        CollectorAccount(
-            debtor_id=102, collector_id=999, account_id="999", status=2
-        )
-    )
     db_session.add(
         SellOffer(
             turn_id=turn_id,
@@ -122,6 +154,57 @@ def test_try_to_advance_turn_to_phase3(db_session):
     )
     db_session.commit()
 
+    return turn
+
+
+def _get_solver_results(turn_id):
+    results = []
+    for model in [
+            CreditorTaking,
+            CollectorCollecting,
+            CollectorSending,
+            CollectorReceiving,
+            CollectorDispatching,
+            CreditorGiving,
+    ]:
+        names = [
+            c.name for c in model.__table__.columns if c.name != "turn_id"
+        ]
+        results.append(sorted(
+            tuple(getattr(row, name) for name in names)
+            for row in model.query.filter_by(turn_id=turn_id).all()
+        ))
+    return results
+
+
+@pytest.mark.parametrize("use_cache, use_spill, load_threads", [
+    (False, False, 1),
+    (True, False, 1),
+    (False, True, 1),
+    (False, False, 3),
+])
+def test_try_to_advance_turn_to_phase3(
+        db_session, mocker, tmp_path, use_cache, use_spill, load_threads
+):
+    db_session.add(
+        CollectorAccount(
+            debtor_id=101, collector_id=997, account_id="997", status=2
+        )
+    )
+    db_session.add(
+        CollectorAccount(
+            debtor_id=101, collector_id=998, account_id="998", status=2
+        )
+    )
+    db_session.add(
+        CollectorAccount(
+            debtor_id=102, collector_id=999, account_id="999", status=2
+        )
+    )
+    db_session.commit()
+    turn = _create_turn_with_offers(db_session)
+    turn_id = turn.turn_id
+
     ca = CollectorAccount.query.all()
     ca.sort(key=lambda row: row.collector_id)
     assert len(ca) == 3
@@ -132,13 +215,22 @@ def test_try_to_advance_turn_to_phase3(db_session):
     assert ca[2].collector_id == 999
     assert ca[2].collector_hash == calc_hash(ca[2].collector_id)
 
-    try_to_advance_turn_to_phase3(turn)
+    cache_dir = str(tmp_path) if use_cache else ""
+    spill_dir = str(tmp_path) if use_spill else ""
+    try_to_advance_turn_to_phase3(
+        turn,
+        cache_dir=cache_dir,
+        spill_dir=spill_dir,
+        load_threads=load_threads,
+    )
+    assert len(os.listdir(tmp_path)) == (1 if use_cache else 0)
 
     turn = Turn.query.filter_by(turn_id=turn_id).one()
     assert turn.phase == 3
     assert turn.phase_deadline is None
     assert turn.collection_started_at is not None
 
+    drop_obsolete_turn_partitions()
     assert len(CurrencyInfo.query.all()) == 0
     assert len(SellOffer.query.all()) == 0
     assert len(BuyOffer.query.all()) == 0
@@ -244,3 +336,320 @@ def test_try_to_advance_turn_to_phase3(db_session):
     assert cg[2].amount == 3000
     assert cg[2].collector_id == 999
     assert cg[2].creditor_hash == calc_hash(2)
+    assert len(TurnCommitProgress.query.all()) == 0
+
+    if use_cache:
+        # Solve an identical turn, which must use the cached prices.
+        read_snapshot = mocker.spy(solve_turn, "read_currency_prices_snapshot")
+        write_snapshot = mocker.spy(
+            solve_turn, "write_currency_prices_snapshot"
+        )
+        turn2 = _create_turn_with_offers(db_session)
+        turn2_id = turn2.turn_id
+        try_to_advance_turn_to_phase3(
+            turn2,
+            cache_dir=cache_dir,
+            spill_dir=spill_dir,
+            load_threads=load_threads,
+        )
+        assert read_snapshot.call_count == 1
+        assert read_snapshot.spy_return is not None
+        write_snapshot.assert_not_called()
+        assert len(os.listdir(tmp_path)) == 1
+
+        turn2 = Turn.query.filter_by(turn_id=turn2_id).one()
+        assert turn2.phase == 3
+        assert _get_solver_results(turn2_id) == _get_solver_results(turn_id)
+
+
+def test_resume_committing_solver_results(db_session):
+    turn = Turn(
+        phase=2,
+        phase_deadline=TS0,
+        collection_started_at=TS0,
+        collection_deadline=TS0,
+        base_debtor_info_locator="https://example.com/101",
+        base_debtor_id=101,
+        max_distance_to_base=5,
+        min_trade_amount=5000,
+    )
+    db_session.add(turn)
+    db_session.flush()
+    db_session.commit()
+    turn_id = turn.turn_id
+
+    # Simulate a process that has written all the results, and has
+    # crashed before advancing the turn to phase 3.
+    create_turn_partitions(turn_id)
+    create_staging_partitions(turn_id, STAGED_MODELS)
+    _write_staged_taking(turn_id, 1, 101, 1000, 999)
+    assert len(CreditorTaking.query.all()) == 0
+    for stream_name in ["takings", "collector_transfers", "givings"]:
+        db_session.add(
+            TurnCommitProgress(
+                turn_id=turn_id,
+                stream_name=stream_name,
+                written_rows=1,
+                is_completed=True,
+            )
+        )
+    db_session.add(
+        SellOffer(
+            turn_id=turn_id,
+            creditor_id=1,
+            debtor_id=101,
+            amount=1000,
+            collector_id=999,
+        )
+    )
+    db_session.commit()
+
+    try_to_advance_turn_to_phase3(turn)
+
+    turn = Turn.query.filter_by(turn_id=turn_id).one()
+    assert turn.phase == 3
+    assert len(CreditorTaking.query.all()) == 1
+    assert len(SellOffer.query.all()) == 1
+    drop_obsolete_turn_partitions()
+    assert len(SellOffer.query.all()) == 0
+    assert len(TurnCommitProgress.query.all()) == 0
+
+
+def test_discard_partially_written_solver_results(db_session):
+    turn = Turn(
+        phase=2,
+        phase_deadline=TS0,
+        collection_started_at=TS0,
+        collection_deadline=TS0,
+        base_debtor_info_locator="https://example.com/101",
+        base_debtor_id=101,
+        max_distance_to_base=5,
+        min_trade_amount=5000,
+    )
+    db_session.add(turn)
+    db_session.flush()
+    db_session.commit()
+    turn_id = turn.turn_id
+
+    create_staging_partitions(turn_id, STAGED_MODELS)
+    _write_staged_taking(turn_id, 1, 101, 1000, 999)
+    db_session.add(
+        TurnCommitProgress(
+            turn_id=turn_id,
+            stream_name="takings",
+            written_rows=1,
+            is_completed=False,
+        )
+    )
+    db_session.commit()
+
+    try_to_advance_turn_to_phase3(turn)
+
+    turn = Turn.query.filter_by(turn_id=turn_id).one()
+    assert turn.phase == 3
+    assert len(CreditorTaking.query.all()) == 0
+    assert len(TurnCommitProgress.query.all()) == 0
+
+
+def _create_solver_with_results():
+    s = Solver("https://example.com/101", 101, min_trade_amount=5000)
+    s.register_currency(True, "https://example.com/101", 101)
+    s.register_currency(
+        True, "https://example.com/102", 102, "https://example.com/101", 101,
+        2.0,
+    )
+    s.register_collector_account(998, 101)
+    s.register_collector_account(999, 102)
+    s.register_sell_offer(1, 101, 10000, 998)
+    s.register_buy_offer(1, 102, 5000)
+    s.register_sell_offer(2, 102, 5000, 999)
+    s.register_buy_offer(2, 101, 10000)
+    return s
+
+
+def test_resume_writing_solver_results_from_checkpoint(db_session, tmp_path):
+    turn = Turn(
+        phase=2,
+        phase_deadline=TS0,
+        collection_started_at=TS0,
+        collection_deadline=TS0,
+        base_debtor_info_locator="https://example.com/101",
+        base_debtor_id=101,
+        max_distance_to_base=5,
+        min_trade_amount=5000,
+    )
+    db_session.add(turn)
+    db_session.flush()
+    db_session.commit()
+    turn_id = turn.turn_id
+
+    # Simulate a process that has solved the turn, has saved the
+    # results to a checkpoint, has written the takings, and has
+    # crashed. Note that there are no offers in the database.
+    checkpoint_path = str(tmp_path / f"turn-{turn_id}.checkpoint")
+    s = _create_solver_with_results()
+    takings = list(s.takings_iter())
+    givings = list(s.givings_iter())
+    assert len(takings) == 2
+    assert len(givings) == 2
+
+    write_solver_checkpoint(
+        s, checkpoint_path, _calc_solver_checkpoint_fingerprint(turn)
+    )
+    assert os.listdir(tmp_path) == [f"turn-{turn_id}.checkpoint"]
+
+    create_staging_partitions(turn_id, STAGED_MODELS)
+    for t in takings:
+        _write_staged_taking(
+            turn_id, t.creditor_id, t.debtor_id, -t.amount, t.collector_id
+        )
+    for stream_name, written_rows, is_completed in [
+            ("takings", 2, True),
+            ("collector_transfers", 0, False),
+            ("givings", 0, False),
+    ]:
+        db_session.add(
+            TurnCommitProgress(
+                turn_id=turn_id,
+                stream_name=stream_name,
+                written_rows=written_rows,
+                is_completed=is_completed,
+            )
+        )
+    db_session.commit()
+
+    try_to_advance_turn_to_phase3(turn, checkpoint_dir=str(tmp_path))
+
+    turn = Turn.query.filter_by(turn_id=turn_id).one()
+    assert turn.phase == 3
+    assert len(CreditorTaking.query.all()) == 2
+    assert len(CollectorCollecting.query.all()) == 0
+    cg = CreditorGiving.query.order_by(CreditorGiving.creditor_id).all()
+    assert [(x.creditor_id, x.debtor_id, x.amount) for x in cg] == sorted(
+        (g.creditor_id, g.debtor_id, g.amount) for g in givings
+    )
+    assert len(CollectorDispatching.query.all()) == 2
+    assert len(TurnCommitProgress.query.all()) == 0
+    assert os.listdir(tmp_path) == []
+
+
+def test_solver_checkpoint(tmp_path):
+    path = str(tmp_path / "checkpoint")
+    fingerprint = b"x" * 32
+    assert read_solver_checkpoint(Solver("", 101), path, fingerprint) is None
+
+    s = _create_solver_with_results()
+    write_solver_checkpoint(s, path, fingerprint)
+    assert os.listdir(tmp_path) == ["checkpoint"]
+    assert read_solver_checkpoint(Solver("", 101), path, b"y" * 32) is None
+
+    c = Solver("", 101)
+    f = read_solver_checkpoint(c, path, fingerprint)
+    assert f is not None
+    try:
+        assert list(c.takings_iter()) == list(s.takings_iter())
+        assert list(c.givings_iter()) == list(s.givings_iter())
+        assert (
+            list(c.collector_transfers_iter())
+            == list(s.collector_transfers_iter())
+        )
+    finally:
+        f.close()
+
+    # Write a checkpoint from a solver which has read a checkpoint,
+    # and read it back.
+    c = Solver("", 101)
+    f = read_solver_checkpoint(c, path, fingerprint)
+    path2 = str(tmp_path / "checkpoint2")
+    try:
+        write_solver_checkpoint(c, path2, fingerprint)
+    finally:
+        f.close()
+    assert os.path.getsize(path2) == os.path.getsize(path)
+
+    c2 = Solver("", 101)
+    f = read_solver_checkpoint(c2, path2, fingerprint)
+    assert f is not None
+    try:
+        assert list(c2.takings_iter()) == list(s.takings_iter())
+        assert list(c2.givings_iter()) == list(s.givings_iter())
+        assert (
+            list(c2.collector_transfers_iter())
+            == list(s.collector_transfers_iter())
+        )
+    finally:
+        f.close()
+    os.remove(path2)
+
+    write_solver_checkpoint(
+        s, str(tmp_path / "nonexistent" / "checkpoint"), fingerprint
+    )
+    assert os.listdir(tmp_path) == ["checkpoint"]
+
+
+def test_write_solver_metrics(tmp_path):
+    path = str(tmp_path / "swpt_solver.prom")
+    write_solver_metrics(path, {
+        "turn_id": 5,
+        "resumed_from_checkpoint": False,
+        "step_seconds": {"load_offers": 1.5, "analyze_offers": 0.25},
+        "tradable_currencies": 3,
+        "graph_nodes": 10,
+        "graph_arcs": 20,
+        "cycles": 2,
+        "avg_cycle_length": 4.0,
+        "max_cycle_length": 6,
+        "peak_rss_bytes": 1024,
+    })
+    assert os.listdir(tmp_path) == ["swpt_solver.prom"]
+    with open(path) as f:
+        lines = f.read().splitlines()
+
+    assert "# TYPE swpt_solver_turn_id gauge" in lines
+    assert "swpt_solver_turn_id 5.0" in lines
+    assert "swpt_solver_resumed_from_checkpoint 0.0" in lines
+    assert (
+        'swpt_solver_step_duration_seconds{step="load_offers"} 1.5' in lines
+    )
+    assert (
+        'swpt_solver_step_duration_seconds{step="analyze_offers"} 0.25'
+        in lines
+    )
+    assert "swpt_solver_graph_arcs 20.0" in lines
+    assert "swpt_solver_peak_rss_bytes 1024.0" in lines
+
+
+def test_currency_prices_snapshot(tmp_path):
+    path = str(tmp_path / "snapshot")
+    fingerprint = b"x" * 32
+    assert read_currency_prices_snapshot(path, fingerprint) is None
+
+    debtor_ids = array("q", [101, 102])
+    prices = array("f", [1.0, 2.0])
+    write_currency_prices_snapshot(path, fingerprint, debtor_ids, prices)
+    assert os.listdir(tmp_path) == ["snapshot"]
+    assert read_currency_prices_snapshot(path, fingerprint) == (
+        debtor_ids,
+        prices,
+    )
+    assert read_currency_prices_snapshot(path, b"y" * 32) is None
+
+    write_currency_prices_snapshot(
+        str(tmp_path / "nonexistent" / "snapshot"),
+        fingerprint,
+        debtor_ids,
+        prices,
+    )
+    assert os.listdir(tmp_path) == ["snapshot"]
+
+
+def test_split_range():
+    assert _split_range(5, 5, 1) == [(5, 5)]
+    assert _split_range(5, 5, 3) == [(5, 5)]
+    assert _split_range(1, 10, 1) == [(1, 10)]
+    assert _split_range(1, 10, 3) == [(1, 3), (4, 6), (7, 10)]
+    assert _split_range(1, 2, 3) == [(1, 1), (2, 2)]
+
+    min_i64 = -0x8000000000000000
+    max_i64 = 0x7fffffffffffffff
+    assert _split_range(min_i64, max_i64, 2) == [(min_i64, -1), (0, max_i64)]
@@ -1,7 +1,11 @@
 import pytest
 import math
 from datetime import timedelta, datetime, timezone
+from hashlib import md5
 from flask import current_app
+from sqlalchemy import select, literal, BigInteger, String
+from swpt_pythonlib.utils import ShardingRealm
+from swpt_trade.extensions import db
 from swpt_trade.utils import (
     SECONDS_IN_DAY,
     SECONDS_IN_YEAR,
@@ -9,7 +13,13 @@ from swpt_trade.utils import (
     parse_timedelta,
     can_start_new_turn,
     batched,
+    iter_in_thread,
+    ThreadedConsumer,
+    to_microseconds,
     calc_hash,
+    calc_sql_hash,
+    sharding_realm_filter,
+    sharding_realm_hash_filter,
     i16_to_u16,
     u16_to_i16,
     i32_to_u32,
@@ -17,7 +27,6 @@ from swpt_trade.utils import (
     contain_principal_overflow,
     calc_k,
     calc_demurrage,
-    DispatchingData,
 )
 
 
@@ -109,10 +118,99 @@ def test_batched():
         list(batched('ABCDEFG', 0))
 
 
+def test_iter_in_thread():
+    assert list(iter_in_thread(lambda: range(100), 2)) == list(range(100))
+    assert list(iter_in_thread(lambda: [], 1)) == []
+
+    def fail():
+        yield 1
+        raise KeyError()
+
+    with pytest.raises(KeyError):
+        list(iter_in_thread(fail, 1))
+
+    it = iter_in_thread(lambda: iter(range(1000000)), 1)
+    assert next(it) == 0
+    it.close()
+
+    with pytest.raises(ValueError):
+        list(iter_in_thread(lambda: range(10), 0))
+
+
+def test_threaded_consumer():
+    items = []
+    with ThreadedConsumer(items.append, 2) as consumer:
+        for i in range(100):
+            consumer.put(i)
+    assert items == list(range(100))
+
+    def consume(item):
+        if item == 3:
+            raise KeyError()
+
+    with pytest.raises(KeyError):
+        with ThreadedConsumer(consume, 1) as consumer:
+            for i in range(100):
+                consumer.put(i)
+
+    items = []
+    with pytest.raises(RuntimeError):
+        with ThreadedConsumer(items.append, 1) as consumer:
+            consumer.put(1)
+            raise RuntimeError()
+
+    with pytest.raises(ValueError):
+        ThreadedConsumer(items.append, 0)
+
+
+def test_to_microseconds():
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    assert to_microseconds(epoch) == 0
+    assert to_microseconds(epoch + timedelta(days=1, microseconds=5)) == (
+        SECONDS_IN_DAY * 1000000 + 5
+    )
+    assert to_microseconds(epoch - timedelta(microseconds=1)) == -1
+
+
 def test_calc_hash():
     assert calc_hash(123) == u16_to_i16(0b1111110000010000)
 
 
+def test_calc_sql_hash(db_session):
+    def execute(expression):
+        return db.session.execute(select(expression)).scalar_one()
+
+    for n in [0, 1, -1, 123, 666, -(1 << 63), (1 << 63) - 1]:
+        h = execute(calc_sql_hash(literal(n, BigInteger)))
+        assert h >> 16 == calc_hash(n)
+
+    s = "https://example.com/\u0444"
+    h = execute(calc_sql_hash(literal(s, String)))
+    digest = md5(s.encode("utf8")).digest()
+    assert h == int.from_bytes(digest[:4], byteorder="big", signed=True)
+
+
+def test_sharding_realm_filter(db_session):
+    def execute(expression):
+        return db.session.execute(select(expression)).scalar_one()
+
+    for routing_key in ["#", "1.#", "0.1.#"]:
+        realm = ShardingRealm(routing_key)
+        for n in range(-50, 50):
+            h = calc_sql_hash(literal(n, BigInteger))
+            assert execute(sharding_realm_hash_filter(h, realm)) == (
+                realm.match(n)
+            )
+            column = literal(n, BigInteger)
+            assert execute(sharding_realm_filter(column, realm)) == (
+                realm.match(n)
+            )
+            column = literal(f"https://example.com/{n}", String)
+            assert execute(sharding_realm_filter(column, realm)) == (
+                realm.match_str(f"https://example.com/{n}")
+            )
+
+
 def test_i16_to_u16():
     assert i16_to_u16(-0x8000) == 0x8000
     assert i16_to_u16(-0x7fff) == 0x8001
@@ -296,32 +394,3 @@ def test_parse_transfer_note():
         TransferNote.parse("Trading session: 1\nBuyer: 1\nFrom: 2\n")
     with pytest.raises(ValueError):
         TransferNote.parse("Trading session: 1\nBuyer: 1\nBuyer: 2\n")
-
-
-def test_dispatching_data():
-    dd = DispatchingData(2)
-    dd.register_collecting(1, 2, 3, 100)
-    dd.register_collecting(1, 2, 3, 150)
-    dd.register_collecting(1, 2, 4, 300)
-    dd.register_sending(1, 2, 3, 500)
-    dd.register_receiving(1, 2, 3, 1000)
-    dd.register_dispatching(1, 2, 3, 2000)
-
-    ll = list(dd.statuses_iter())
-    ll.sort(key=lambda x: (x["collector_id"], x["turn_id"], x["debtor_id"]))
-    assert len(ll) == 2
-    assert ll[0]["collector_id"] == 1
-    assert ll[0]["turn_id"] == 2
-    assert ll[0]["debtor_id"] == 3
-    assert ll[0]["amount_to_collect"] == 250
-    assert ll[0]["amount_to_send"] == 500
-    assert ll[0]["amount_to_receive"] == 1000
-    assert ll[0]["number_to_receive"] == 1
-    assert ll[0]["amount_to_dispatch"] == 2000
-    assert ll[1]["collector_id"] == 1
-    assert ll[1]["turn_id"] == 2
-    assert ll[1]["debtor_id"] == 4
-    assert ll[1]["amount_to_collect"] == 300
-    assert ll[1]["amount_to_send"] == 0
-    assert ll[1]["number_to_receive"] == 0
-    assert ll[1]["amount_to_dispatch"] == 0